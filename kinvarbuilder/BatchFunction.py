@@ -0,0 +1,713 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#----------------------------------------------------------------------
+# generation of a single python function calculating the output
+# variables of a VarBuilder for all events of a batch with numpy
+#
+# Instead of evaluating the graph of nodes event by event, the source
+# code of a function is generated which calculates the input vectors,
+# the sums of vectors and the output variables as arrays (one value
+# per event), in an order where each sum is calculated before it is
+# first used. The sums and quantities derived from them (e.g. eta) are
+# calculated only once, the functions write their values directly into
+# the output matrix and share a few scratch arrays for intermediate values.
+#
+# The intermediate arrays are rows of arrays taken from a BufferPool
+# (see TreeReader.py), allocated once per batch size instead of for each
+# batch. The rows are assigned when generating the code: a row is
+# borrowed where the array is first needed and given back after the
+# line where it is used for the last time, such that the number of rows
+# needed is given by the number of arrays in use at the same time
+# rather than by the number of nodes of the graph.
+#
+# Functions support this by providing a static method
+#
+#   getBatchCode(out, args, tmp)
+#
+# returning the lines of code calculating the function, where
+#
+#   out   is the name of the array (one value per event) to be filled
+#   args  has one object per argument with the names of the arrays
+#         holding the components px, py, pz, e of the sum of fourvectors
+#         and a method get(quantity) returning the name of the array
+#         holding 'pt', 'eta', 'phi' or 'et' of the sum
+#   tmp   is a list of names of scratch arrays (see _numScratchArrays)
+#
+# For functions accepting transverse vectors (needFourVectors = False),
+# arguments can be sums containing a TransverseVector: isFourVector is
+# False for these, pz and e are None and the transverse energy must be
+# taken from get('et') (see VectorSum for how they are summed).
+#
+# The generated function sets the values of output variables which are
+# undefined (because one of the input vectors is not valid) to NaN and
+# marks them in a boolean matrix, such that NaN values calculated by
+# a function (e.g. from invalid inputs) are not taken as undefined.
+#
+# Output variables of functions without this method are not calculated
+# by the generated function (see BatchFunction.fallbackIndices).
+#----------------------------------------------------------------------
+
+import collections, linecache, re
+
+from .TransverseVector import TransverseVector
+
+# number of scratch arrays available to the code of a function
+_numScratchArrays = 4
+
+# the most recently used generated functions, by graph hash
+# (see VarBuilder.getGraphHash()), least recently used first
+_batchFunctions = collections.OrderedDict()
+
+# maximum number of generated functions kept in _batchFunctions
+maxCachedBatchFunctions = 16
+
+# for finding the names used in a line of generated code
+_identifierPattern = re.compile(r'\w+')
+
+#----------------------------------------------------------------------
+
+class BatchFunction:
+    """ a function calculating the output variables of a VarBuilder for
+        all events of a batch at once, generated from the graph of the VarBuilder
+    """
+
+    #----------------------------------------
+
+    def __init__(self, source, fileName, inputExpressions, outputIndices, fallbackIndices,
+                 numBuffers, numMasks):
+        # @param inputExpressions are the tree expressions the columns given
+        #        to evaluate(..) correspond to
+        #
+        # @param outputIndices are the indices of the output variables
+        #        (in VarBuilder.outputScalars) corresponding to the rows of
+        #        the output matrix
+        #
+        # @param fallbackIndices are the indices of the output variables
+        #        which must be calculated event by event
+        #
+        # @param numBuffers, numMasks are the number of float64 and boolean
+        #        arrays for intermediate values used by the generated function
+
+        self.source = source
+        self.fileName = fileName
+        self.inputExpressions = inputExpressions
+        self.outputIndices = outputIndices
+        self.fallbackIndices = fallbackIndices
+        self.numBuffers = numBuffers
+        self.numMasks = numMasks
+
+        # make the source available to tracebacks, the debugger and
+        # inspect.getsource(..) as long as this function exists
+        # (see __del__())
+        self.linecacheEntry = (len(source), None, source.splitlines(True), fileName)
+        linecache.cache[fileName] = self.linecacheEntry
+
+        import numpy, math
+
+        namespace = dict(numpy = numpy, math = math, nan = float('nan'))
+        exec compile(source, fileName, 'exec') in namespace
+
+        self.evaluate = namespace['evaluate']
+
+    #----------------------------------------
+
+    def __del__(self):
+        # removes the source from the linecache unless it was
+        # replaced by a function generated again for the same graph
+        if linecache.cache.get(self.fileName) is self.linecacheEntry:
+            del linecache.cache[self.fileName]
+
+    #----------------------------------------
+
+    def __call__(self, columns, out, bufferPool = None):
+        # calculates the output variables for a batch of events
+        #
+        # @param columns is a list of arrays with the values of the
+        #        input expressions (see inputExpressions) for the events
+        #        of the batch
+        #
+        # @param out is a float64 array with one row per output
+        #        variable calculated (see outputIndices) and one column
+        #        per event. Undefined values are set to NaN.
+        #
+        # @param bufferPool is the BufferPool the arrays for intermediate
+        #        values are taken from (typically the one of the TreeReader
+        #        the columns were read with). If None, they are allocated
+        #        for this call only.
+        #
+        # @return a boolean array (of the same shape as out, taken from
+        #        the bufferPool) which is True for the undefined values
+        numEvents = out.shape[1]
+
+        if bufferPool == None:
+            from .TreeReader import BufferPool
+            bufferPool = BufferPool(numEvents)
+
+        isUndefined = bufferPool.getArray('batchFunctionUndefined', len(self.outputIndices), numEvents, bool)
+
+        self.evaluate(columns, out, isUndefined,
+                      bufferPool.getArray('batchFunctionBuffers', self.numBuffers, numEvents),
+                      bufferPool.getArray('batchFunctionMasks', self.numMasks, numEvents, bool))
+
+        return isUndefined
+
+#----------------------------------------------------------------------
+
+class _BatchVector:
+    # the names of the arrays holding the components of an input
+    # vector or of a sum of vectors in the generated code
+
+    #----------------------------------------
+
+    def __init__(self, generator, prefix, undefined, isFourVector = True):
+        # @param undefined is the name of the boolean array which is
+        #        True for the events where this vector is not defined
+        #        (None if it is always defined)
+        #
+        # @param isFourVector if False, this is a transverse vector which
+        #        has no pz and e but the transverse energy (see get('et'))
+        self.generator = generator
+        self.prefix = prefix
+        self.isFourVector = isFourVector
+
+        self.px = prefix + "_px"
+        self.py = prefix + "_py"
+
+        if isFourVector:
+            self.pz = prefix + "_pz"
+            self.e  = prefix + "_e"
+        else:
+            self.pz = None
+            self.e  = None
+
+        self.undefined = undefined
+
+        # for input vectors, the name of the column with the
+        # pseudorapidity read from the tree
+        self.inputEta = None
+
+        # quantities derived from the components calculated so far
+        self.derived = {}
+
+    #----------------------------------------
+
+    def get(self, quantity):
+        # @return the name of the array holding the given quantity
+        # ('pt', 'eta', 'phi' or 'et', calculated as TLorentzVector does),
+        # adds the code calculating it when first requested
+
+        name = self.derived.get(quantity)
+        if name != None:
+            return name
+
+        name = self.prefix + "_" + quantity
+
+        self.generator.declare(name)
+
+        if quantity == 'pt':
+            self.generator.addLines([
+                "numpy.multiply(%s, %s, out = %s)" % (self.px, self.px, name),
+                "%s += numpy.multiply(%s, %s, out = tmp0)" % (name, self.py, self.py),
+                "numpy.sqrt(%s, out = %s)" % (name, name),
+                ])
+
+        elif quantity == 'phi':
+            # adding zero turns px = -0 into +0 such that the
+            # angle is zero (not pi) for vectors along the beam axis
+            self.generator.addLines([
+                "numpy.add(%s, 0., out = tmp0)" % self.px,
+                "numpy.arctan2(%s, tmp0, out = %s)" % (self.py, name),
+                ])
+
+        elif quantity == 'eta' and self.inputEta != None:
+            # TLorentzVector gives zero for vectors with zero momentum
+            self.generator.addLines([
+                "numpy.copyto(%s, %s)" % (name, self.inputEta),
+                "%s[%s == 0] = 0" % (name, self.get('pt')),
+                ])
+
+        elif quantity == 'eta':
+            pt = self.get('pt')
+            # the pseudorapidity is +/-10e10 along the beam axis
+            self.generator.addLines([
+                "numpy.divide(%s, %s, out = %s)" % (self.pz, pt, name),
+                "numpy.arcsinh(%s, out = %s)" % (name, name),
+                "%s[%s == 0] = numpy.sign(%s[%s == 0]) * 10e10" % (name, pt, self.pz, pt),
+                ])
+
+        elif quantity == 'et' and self.isFourVector:
+            # e^2 * pt^2 / p^2 with the sign of the energy
+            self.generator.addLines([
+                "numpy.multiply(%s, %s, out = tmp0)" % (self.px, self.px),
+                "tmp0 += numpy.multiply(%s, %s, out = tmp1)" % (self.py, self.py),
+                "numpy.multiply(%s, %s, out = tmp1)" % (self.pz, self.pz),
+                "tmp1 += tmp0",
+                "numpy.multiply(%s, %s, out = %s)" % (self.e, self.e, name),
+                "%s *= tmp0" % name,
+                "%s /= tmp1" % name,
+                "%s[tmp0 == 0] = 0" % name,
+                "numpy.sqrt(%s, out = %s)" % (name, name),
+                "numpy.copysign(%s, %s, out = %s)" % (name, self.e, name),
+                ])
+
+        else:
+            # note that the transverse energy of transverse
+            # vectors is always in self.derived
+            raise ValueError("unknown quantity '%s'" % quantity)
+
+        self.derived[quantity] = name
+
+        return name
+
+#----------------------------------------------------------------------
+
+class _CodeGenerator:
+    # generates the source code of the function for a VarBuilder
+
+    #----------------------------------------
+
+    def __init__(self, varBuilder):
+        self.varBuilder = varBuilder
+
+        # the lines of the body of the generated function, the
+        # declarations of intermediate arrays are given as tuples
+        # (see declare(..))
+        self.lines = []
+
+        # the tree expressions read and the name of the variable
+        # holding the values of each expression
+        self.inputExpressions = []
+        self.columnNames = {}
+
+        # the _BatchVector objects of the input vectors (by index)
+        # and of the sums (by tuple of input vector indices)
+        self.vectors = {}
+        self.sums = {}
+
+    #----------------------------------------
+
+    def addLines(self, lines):
+        self.lines.extend(lines)
+
+    #----------------------------------------
+
+    def declare(self, name, dtype = 'f8'):
+        # adds the declaration of an intermediate array with the
+        # given name (which is replaced by a row taken from
+        # the buffer pool, see __assignBuffers())
+        self.lines.append((name, dtype))
+
+    #----------------------------------------
+
+    def getColumn(self, expression):
+        # @return the name of the variable holding the values
+        # of the given tree expression
+        name = self.columnNames.get(expression)
+
+        if name == None:
+            name = "col%d" % len(self.inputExpressions)
+            self.addLines([ "%s = columns[%d] # %s" % (name, len(self.inputExpressions), expression) ])
+
+            self.inputExpressions.append(expression)
+            self.columnNames[expression] = name
+
+        return name
+
+    #----------------------------------------
+
+    def getInputVector(self, index):
+        # @return the _BatchVector of the input vector with the given index
+        vector = self.vectors.get(index)
+        if vector != None:
+            return vector
+
+        inputVector = self.varBuilder.inputVectors[index]
+
+        self.addLines([ "", "# input vector %s" % inputVector ])
+
+        if isinstance(inputVector, TransverseVector):
+            vector = self.__makeTransverseInputVector(index, inputVector)
+        else:
+            vector = self.__makeFourVectorInputVector(index, inputVector)
+
+        if vector.undefined != None:
+            validColumn = self.getColumn(inputVector.validExpr)
+            self.declare(vector.undefined, bool)
+            self.addLines([ "numpy.equal(%s, 0, out = %s)" % (validColumn, vector.undefined) ])
+
+        self.vectors[index] = vector
+
+        return vector
+
+    #----------------------------------------
+
+    def __makeTransverseInputVector(self, index, inputVector):
+        # adds the code calculating the components of the given TransverseVector
+        if inputVector.validExpr != None:
+            undefined = "v%d_undefined" % index
+        else:
+            undefined = None
+
+        vector = _BatchVector(self, "v%d" % index, undefined, isFourVector = False)
+
+        pt = self.getColumn(inputVector.ptName)
+        phi = self.getColumn(inputVector.phiName)
+
+        # as Vector2D.SetPhiEtPt(..), the transverse
+        # energy is read from the tree
+        vector.derived['et'] = self.getColumn(inputVector.etName)
+
+        self.declare(vector.px)
+        self.declare(vector.py)
+
+        self.addLines([
+            "numpy.cos(%s, out = %s)" % (phi, vector.px),
+            "%s *= %s" % (vector.px, pt),
+            "numpy.sin(%s, out = %s)" % (phi, vector.py),
+            "%s *= %s" % (vector.py, pt),
+            ])
+
+        return vector
+
+    #----------------------------------------
+
+    def __makeFourVectorInputVector(self, index, inputVector):
+        # adds the code calculating the components of the given FourVector
+        pt = self.getColumn(inputVector.ptName)
+        eta = self.getColumn(inputVector.etaName)
+        phi = self.getColumn(inputVector.phiName)
+
+        if inputVector.validExpr != None:
+            undefined = "v%d_undefined" % index
+        else:
+            undefined = None
+
+        vector = _BatchVector(self, "v%d" % index, undefined)
+
+        # the trigonometric and hyperbolic functions of the angles
+        # are calculated once per batch, the sums only add components
+        absPt, cosPhi, sinPhi, sinhEta, coshEta = [ vector.prefix + "_" + suffix
+                                                    for suffix in ("absPt", "cosPhi", "sinPhi", "sinhEta", "coshEta") ]
+
+        for name in (absPt, cosPhi, sinPhi, sinhEta, coshEta, vector.px, vector.py, vector.pz, vector.e):
+            self.declare(name)
+
+        # the energy is calculated from the momentum |p| = |pt| * cosh(eta)
+        # rather than from px^2 + py^2 + pz^2 (which loses precision for
+        # large |eta| and is not needed at all for massless vectors)
+        self.addLines([
+            "numpy.abs(%s, out = %s)" % (pt, absPt),
+            "numpy.cos(%s, out = %s)" % (phi, cosPhi),
+            "numpy.sin(%s, out = %s)" % (phi, sinPhi),
+            "numpy.sinh(%s, out = %s)" % (eta, sinhEta),
+            "numpy.cosh(%s, out = %s)" % (eta, coshEta),
+            "numpy.multiply(%s, %s, out = %s)" % (absPt, cosPhi, vector.px),
+            "numpy.multiply(%s, %s, out = %s)" % (absPt, sinPhi, vector.py),
+            "numpy.multiply(%s, %s, out = %s)" % (absPt, sinhEta, vector.pz),
+            "numpy.multiply(%s, %s, out = %s)" % (absPt, coshEta, vector.e),
+            ])
+
+        if inputVector.hasFixedMass():
+            mass = float(inputVector.massName)
+
+            if mass > 0:
+                self.addLines([ "numpy.hypot(%s, %s, out = %s)" % (vector.e, repr(mass), vector.e) ])
+            elif mass < 0:
+                # as TLorentzVector.SetPtEtaPhiM(..): a negative mass
+                # reduces the energy (but not below zero)
+                self.addLines([
+                    "numpy.multiply(%s, %s, out = %s)" % (vector.e, vector.e, vector.e),
+                    "%s -= %s" % (vector.e, repr(mass * mass)),
+                    "numpy.maximum(%s, 0, out = %s)" % (vector.e, vector.e),
+                    "numpy.sqrt(%s, out = %s)" % (vector.e, vector.e),
+                    ])
+
+        else:
+            if inputVector.massTable != None:
+                # look up the mass by the value of the key expression
+                key = self.getColumn(inputVector.massName)
+                mass = vector.prefix + "_mass"
+                self.declare(mass)
+                self.addLines([ "%s.fill(0.)" % mass ] +
+                              [ "%s[%s == %s] = %s" % (mass, key, repr(keyValue), repr(massValue))
+                                for keyValue, massValue in inputVector.massTable ])
+                massValues = [ massValue for keyValue, massValue in inputVector.massTable ]
+            else:
+                mass = self.getColumn(inputVector.massName)
+                massValues = None
+
+            if massValues != None and min(massValues) >= 0:
+                self.addLines([ "numpy.hypot(%s, %s, out = %s)" % (vector.e, mass, vector.e) ])
+            else:
+                # masses can be negative (see above)
+                self.addLines([
+                    "numpy.multiply(%s, %s, out = %s)" % (vector.e, vector.e, vector.e),
+                    "%s += numpy.multiply(%s, numpy.abs(%s, out = tmp0), out = tmp0)" % (vector.e, mass, mass),
+                    "numpy.maximum(%s, 0, out = %s)" % (vector.e, vector.e),
+                    "numpy.sqrt(%s, out = %s)" % (vector.e, vector.e),
+                    ])
+
+        # the transverse momentum is known already, the pseudorapidity
+        # is taken from the tree (see _BatchVector.get(..))
+        vector.derived['pt'] = absPt
+        vector.inputEta = eta
+
+        return vector
+
+    #----------------------------------------
+
+    def getSum(self, group):
+        # @return the _BatchVector of the sum of the input vectors
+        # with the given indices
+        #
+        # the sum of all but the last vector is reused such that the
+        # components are added in the same order as VectorSum does
+        # (i.e. for sums containing TransverseVectors, these are added
+        # one by one to the transverse projection of the fourvectors)
+        group = tuple(group)
+
+        if len(group) == 1:
+            return self.getInputVector(group[0])
+
+        vector = self.sums.get(group)
+        if vector != None:
+            return vector
+
+        transverseIndices = [ index for index in group
+                              if isinstance(self.varBuilder.inputVectors[index], TransverseVector) ]
+
+        if transverseIndices:
+            first = self.getSum([ index for index in group if index != transverseIndices[-1] ])
+            last = self.getInputVector(transverseIndices[-1])
+            isFourVector = False
+            components = ('px', 'py')
+        else:
+            first = self.getSum(group[:-1])
+            last = self.getInputVector(group[-1])
+            isFourVector = True
+            components = ('px', 'py', 'pz', 'e')
+
+        prefix = "s%d" % len(self.sums)
+
+        if first.undefined != None and last.undefined != None:
+            undefined = prefix + "_undefined"
+        else:
+            undefined = first.undefined or last.undefined
+
+        vector = _BatchVector(self, prefix, undefined, isFourVector)
+
+        if not isFourVector:
+            # the transverse energies of the parts
+            firstEt, lastEt = first.get('et'), last.get('et')
+
+        self.addLines([
+            "",
+            "# " + " + ".join(str(self.varBuilder.inputVectors[index]) for index in group)
+            ])
+
+        for component in components:
+            self.declare(getattr(vector, component))
+            self.addLines([ "numpy.add(%s, %s, out = %s)" % (getattr(first, component), getattr(last, component),
+                                                            getattr(vector, component)) ])
+
+        if not isFourVector:
+            et = prefix + "_et"
+            self.declare(et)
+            self.addLines([ "numpy.add(%s, %s, out = %s)" % (firstEt, lastEt, et) ])
+            vector.derived['et'] = et
+
+        if undefined != None and undefined != first.undefined and undefined != last.undefined:
+            self.declare(undefined, bool)
+            self.addLines([ "numpy.logical_or(%s, %s, out = %s)" % (first.undefined, last.undefined, undefined) ])
+
+        self.sums[group] = vector
+
+        return vector
+
+    #----------------------------------------
+
+    def canGenerate(self, outputIndex):
+        # @return True if the given output variable can be calculated
+        # by the generated function
+        return getattr(self.varBuilder.outputFunctions[outputIndex], 'getBatchCode', None) != None
+
+    #----------------------------------------
+
+    def addOutput(self, outputIndex, row):
+        # adds the code calculating the given output variable
+        # into the given row of the output matrix
+        varBuilder = self.varBuilder
+
+        args = [ self.getSum(group) for group in varBuilder.outputArguments[outputIndex] ]
+
+        self.addLines([
+            "",
+            "# %s: %s" % (varBuilder.outputVarnames[outputIndex], varBuilder.outputVarDescriptions[outputIndex]),
+            "o = out[%d]" % row,
+            "u = isUndefined[%d]" % row,
+            ])
+
+        self.addLines(varBuilder.outputFunctions[outputIndex].getBatchCode(
+            "o", args, [ "tmp%d" % index for index in range(_numScratchArrays) ]))
+
+        # the value is undefined if any argument is undefined
+        undefined = [ arg.undefined for arg in args if arg.undefined != None ]
+
+        if len(undefined) == 0:
+            self.addLines([ "u.fill(False)" ])
+        elif len(undefined) == 1:
+            self.addLines([ "numpy.copyto(u, %s)" % undefined[0] ])
+        else:
+            self.addLines([ "numpy.logical_or(%s, %s, out = u)" % (undefined[0], undefined[1]) ] +
+                          [ "numpy.logical_or(u, %s, out = u)" % name for name in undefined[2:] ])
+
+        if undefined:
+            self.addLines([ "o[u] = nan" ])
+
+    #----------------------------------------
+
+    def __assignBuffers(self):
+        # replaces the declarations of the intermediate arrays by rows
+        # of the buffer arrays, reusing the rows of arrays which are
+        # not used anymore
+        #
+        # @return the lines of code, the number of float64 rows and the
+        #         number of boolean rows needed
+
+        # the line where each array is used for the last time
+        dtypes = {}
+        lastUse = {}
+
+        for pos, line in enumerate(self.lines):
+            if isinstance(line, tuple):
+                name, dtype = line
+                assert not name in dtypes, "array %s declared twice" % name
+                dtypes[name] = dtype
+                lastUse[name] = pos
+
+            elif not line.startswith('#'):
+                for token in _identifierPattern.findall(line):
+                    if token in dtypes:
+                        lastUse[token] = pos
+
+        # the arrays given back after each line
+        releasedAt = {}
+        for name, pos in lastUse.items():
+            releasedAt.setdefault(pos, []).append(name)
+
+        # the rows currently not used and the number of rows
+        # needed so far for each type
+        freeRows = { 'f8': [], bool: [] }
+        numRows = { 'f8': 0, bool: 0 }
+        rows = {}
+
+        retval = []
+
+        for pos, line in enumerate(self.lines):
+            if isinstance(line, tuple):
+                name, dtype = line
+
+                if freeRows[dtype]:
+                    rows[name] = freeRows[dtype].pop()
+                else:
+                    rows[name] = numRows[dtype]
+                    numRows[dtype] += 1
+
+                retval.append("%s = %s[%d]" % (name, 'buffers' if dtype == 'f8' else 'masks', rows[name]))
+            else:
+                retval.append(line)
+
+            for name in releasedAt.get(pos, []):
+                freeRows[dtypes[name]].append(rows[name])
+
+        return retval, numRows['f8'], numRows[bool]
+
+    #----------------------------------------
+
+    def generate(self, graphHash):
+        # @return a BatchFunction for the VarBuilder
+        varBuilder = self.varBuilder
+
+        # the scratch arrays
+        for index in range(_numScratchArrays):
+            self.declare("tmp%d" % index)
+
+        outputIndices = []
+        fallbackIndices = []
+
+        for outputIndex in range(len(varBuilder.outputScalars)):
+            if self.canGenerate(outputIndex):
+                outputIndices.append(outputIndex)
+            else:
+                fallbackIndices.append(outputIndex)
+
+        # calculate the output variables in the order of the last
+        # sum of vectors they need, where the sums are ordered by the set
+        # of their input vectors (as binary number). Compared to the
+        # order of the output variables, this about halves the number
+        # of sums in use at the same time.
+        def lastSum(row):
+            return max(sum(1 << index for index in group)
+                       for group in varBuilder.outputArguments[outputIndices[row]])
+
+        for row in sorted(range(len(outputIndices)), key = lastSum):
+            self.addOutput(outputIndices[row], row)
+
+        lines, numBuffers, numMasks = self.__assignBuffers()
+
+        header = [
+            "# generated by kinvarbuilder from the VarBuilder graph %s" % graphHash,
+            "# (%d output variables, %d calculated event by event," % (len(outputIndices), len(fallbackIndices)),
+            "# %d buffers and %d masks for intermediate values)" % (numBuffers, numMasks),
+            "",
+            "def evaluate(columns, out, isUndefined, buffers, masks):",
+            "",
+            "    with numpy.errstate(all = 'ignore'):",
+            ]
+
+        body = [ ("        " + line).rstrip() for line in lines ]
+
+        source = "\n".join(header + body) + "\n"
+
+        fileName = "<kinvarbuilder-batch-%s>" % graphHash[:12]
+
+        return BatchFunction(source, fileName, self.inputExpressions, outputIndices, fallbackIndices,
+                             numBuffers, numMasks)
+
+#----------------------------------------------------------------------
+
+def getBatchFunction(varBuilder):
+    # @return the BatchFunction for the given VarBuilder (generated
+    # only once for VarBuilders with the same graph as long as it is
+    # one of the maxCachedBatchFunctions most recently used ones)
+
+    graphHash = varBuilder.getGraphHash()
+
+    retval = _batchFunctions.pop(graphHash, None)
+
+    if retval == None:
+        retval = _CodeGenerator(varBuilder).generate(graphHash)
+
+    # (re)insert as the most recently used one
+    _batchFunctions[graphHash] = retval
+
+    while len(_batchFunctions) > maxCachedBatchFunctions:
+        _batchFunctions.popitem(last = False)
+
+    return retval
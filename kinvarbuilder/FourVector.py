@@ -17,28 +17,71 @@
 # limitations under the License.
 
 
-from .kinvarbuilder import CachingFunction
+from .kinvarbuilder import Node
 
-@CachingFunction
-class FourVector:
+#----------------------------------------------------------------------
+
+class _MassLookup:
+    # provides the mass of an object looked up in a table
+    # by the value of a tree expression (e.g. the flavour of a jet)
+    # in the same way as the variables of the tree reader,
+    # i.e. the value for the current event is [0]
+
+    def __init__(self, var, table):
+        self.var = var
+        self.table = dict(table)
+
+    def __getitem__(self, index):
+        return self.table.get(float(self.var[index]), 0.)
+
+#----------------------------------------------------------------------
+
+class FourVector(Node):
     """ threevectors can be modeled by setting the mass to 0 """
 
+    __slots__ = ('ptName', 'etaName', 'phiName', 'massName', 'massTable', 'name', 'vector', 'validExpr',
+                 'varPt', 'varEta', 'varPhi', 'varMass', 'varValidExpr')
+
     #----------------------------------------
 
     def __init__(self, pt, eta, phi, mass = 0, name = None, validExpr = None):
         """
 
+        :param mass: the mass hypothesis for this object, one of
+
+          - a number: a fixed mass (e.g. 0 for three vectors or the
+            tau mass for tau leptons)
+          - a string: a ROOT tree expression giving the mass
+          - a tuple (keyExpr, table): the mass is looked up in the table
+            (a dict or a list of (key, mass) pairs) by the value of the
+            tree expression keyExpr (e.g. the flavour of a jet).
+            Objects with a key not in the table get mass zero.
+
         :param validExpr: if not None, this is a ROOT tree expression which
           indicates if this vector is valid for a given event (nonzero value)
           or not (zero value)
         :return:
         """
 
+        Node.__init__(self)
+
         # pt, eta, phi must contain names of variables in a ROOT TTree
         self.ptName  = pt
         self.etaName = eta
         self.phiName = phi
-        self.massName = mass
+
+        if isinstance(mass, tuple) or isinstance(mass, list):
+            # a lookup table
+            keyExpr, table = mass
+
+            if isinstance(table, dict):
+                table = table.items()
+
+            self.massName = keyExpr
+            self.massTable = tuple(sorted((float(key), float(value)) for key, value in table))
+        else:
+            self.massName = mass
+            self.massTable = None
 
         if name == None:
             if self.ptName.lower().endswith('pt'):
@@ -50,16 +93,50 @@ class FourVector:
 
         # raise Exception("implement creation of variables to read values from tree")
 
-        # the vector to hold the values
-        import ROOT
-        self.vector = ROOT.TLorentzVector()
+        # the vector to hold the values, created when first needed
+        # such that ROOT is only imported when processing events
+        self.vector = None
 
         self.validExpr = validExpr
 
-        # if self.massName == None, this is a three vector
-        # and we assume the mass is zero all the time
-        # TODO: support a fixed mass value (e.g. for tau leptons or b jets)
+    #----------------------------------------
+
+    def hasFixedMass(self):
+        # @return True if the mass is the same for all events
+        # (massName is the value then)
+        return isinstance(self.massName, float) or isinstance(self.massName, int)
+
+    #----------------------------------------
+
+    def getExpressions(self):
+        # @return the tree expressions read by this vector
+        retval = [ self.ptName, self.etaName, self.phiName ]
+
+        if not self.hasFixedMass():
+            retval.append(self.massName)
+
+        if self.validExpr != None:
+            retval.append(self.validExpr)
+
+        return retval
+
+    #----------------------------------------
 
+    def getSpec(self):
+        # @return a description of this vector from which
+        # it can be created again (see VarBuilder.getGraphSpec())
+        if self.massTable != None:
+            mass = [ self.massName, [ list(item) for item in self.massTable ] ]
+        else:
+            mass = self.massName
+
+        return dict(type = 'FourVector',
+                    pt = self.ptName,
+                    eta = self.etaName,
+                    phi = self.phiName,
+                    mass = mass,
+                    name = self.name,
+                    validExpr = self.validExpr)
 
     #----------------------------------------
 
@@ -67,13 +144,17 @@ class FourVector:
         # TODO: we should watch out for overlaps of multiple fourvectors
         #       setting branches on the same variable
 
+        self.resetCache()
+
         self.varPt = treeReader.getVar(self.ptName)
         self.varEta = treeReader.getVar(self.etaName)
         self.varPhi = treeReader.getVar(self.phiName)
 
-        if isinstance(self.massName, float) or isinstance(self.massName, int):
+        if self.hasFixedMass():
             # a fixed mass value has been set
             self.varMass = [ self.massName ]
+        elif self.massTable != None:
+            self.varMass = _MassLookup(treeReader.getVar(self.massName), self.massTable)
         else:
             self.varMass = treeReader.getVar(self.massName)
 
@@ -85,12 +166,22 @@ class FourVector:
     #----------------------------------------
 
 
-    def getValue(self):
+    def calcValue(self):
+        # note that the cos/sin(phi) and sinh/cosh(eta) of the input are
+        # only precomputed per batch by the generated batch code (see
+        # BatchFunction), here the vector is set with one call to
+        # SetPtEtaPhiM(..) per event: this is a single call into ROOT
+        # as SetXYZT(..) with precomputed components would be, the
+        # event by event processing is dominated by the python overhead
 
         if not self.varValidExpr[0]:
             # this vector is not defined for the current event
             return None
 
+        if self.vector == None:
+            import ROOT
+            self.vector = ROOT.TLorentzVector()
+
         # get the quantities from the tree
         self.vector.SetPtEtaPhiM(
                 self.varPt[0],
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#----------------------------------------------------------------------
+# measures of the separation between signal and background
+# for a single variable
+#
+# all metrics are calculated from the weighted cumulative distributions
+# of signal and background evaluated at the boundaries between distinct
+# values of the variable, so only one sort of the (combined) values
+# is needed per variable.
+#
+# The weights can also be given as 2D arrays (number of events x K),
+# in which case the metrics are calculated for each of the K sets
+# of weights (e.g. bootstrap replicas) at once.
+#----------------------------------------------------------------------
+
+# names of the supported metrics and descriptions
+# (for all metrics, larger values mean better separation)
+metricDescriptions = [
+    ('ks',                'maximum difference of the cumulative distributions (Kolmogorov-Smirnov)'),
+    ('auc',               'area under the ROC curve (max(AUC, 1 - AUC))'),
+    ('separation',        'separation <S^2> (0 = identical, 1 = no overlap)'),
+    ('mutualInformation', 'mutual information (bits) between the class and the binned variable'),
+    ('sOverSqrtB',        'best S / sqrt(B) for a single cut on the variable'),
+    ]
+
+metricNames = [ name for name, description in metricDescriptions ]
+
+#----------------------------------------------------------------------
+
+class SortedSamples:
+    # the combined sort of the signal and background values of one
+    # variable, can be used to calculate the metrics for several
+    # sets of weights (e.g. bootstrap replicas)
+
+    #----------------------------------------
+
+    def __init__(self, valuesSig, valuesBkg):
+        import numpy
+
+        valuesSig = numpy.asarray(valuesSig, dtype = 'f8')
+        valuesBkg = numpy.asarray(valuesBkg, dtype = 'f8')
+
+        # undefined values do not take part in the comparison
+        self.isDefinedSig = numpy.isfinite(valuesSig)
+        self.isDefinedBkg = numpy.isfinite(valuesBkg)
+
+        values = numpy.concatenate((valuesSig[self.isDefinedSig], valuesBkg[self.isDefinedBkg]))
+
+        # the one sort shared by all metrics
+        self.order = numpy.argsort(values, kind = 'mergesort')
+        sortedValues = values[self.order]
+
+        # the last entry of each group of equal values: we must
+        # not evaluate the cumulative distributions between events
+        # with the same value since one can't place a cut there
+        self.isGroupEnd = numpy.ones(len(sortedValues), dtype = bool)
+        self.isGroupEnd[:-1] = sortedValues[1:] != sortedValues[:-1]
+
+        self.groupValues = sortedValues[self.isGroupEnd]
+
+        # boundaries of the bins for the binned metrics, determined
+        # by the first set of weights the metrics are calculated for
+        # and kept for all further sets of weights
+        self.numBins = None
+        self.binEnds = None
+
+    #----------------------------------------
+
+    def calcMetrics(self, weightsSig, weightsBkg, metrics = None, numBins = 50):
+        # see calcMetrics(..) below
+        import numpy
+
+        if metrics == None:
+            metrics = metricNames
+
+        for metric in metrics:
+            if not metric in metricNames:
+                raise ValueError("unknown separation metric '%s'" % metric)
+
+        isVector = numpy.ndim(weightsSig) == 2
+
+        distributions = _CumulativeDistributions(self, weightsSig, weightsBkg)
+
+        if self.numBins != numBins:
+            self.numBins = numBins
+            self.binEnds = distributions.findBinEnds(numBins)
+
+        retval = {}
+
+        for metric in metrics:
+            if metric in ('separation', 'mutualInformation'):
+                value = getattr(distributions, metric)(self.binEnds)
+            else:
+                value = getattr(distributions, metric)()
+
+            if not isVector:
+                value = float(value[0])
+
+            retval[metric] = value
+
+        return retval
+
+#----------------------------------------------------------------------
+
+class _CumulativeDistributions:
+    # weighted cumulative distributions of signal and background
+    # at the end of each group of equal values
+
+    #----------------------------------------
+
+    def __init__(self, sortedSamples, weightsSig, weightsBkg):
+        import numpy
+
+        self.groupValues = sortedSamples.groupValues
+
+        weightsSig = self.__asMatrix(weightsSig)[sortedSamples.isDefinedSig]
+        weightsBkg = self.__asMatrix(weightsBkg)[sortedSamples.isDefinedBkg]
+
+        order = sortedSamples.order
+        isGroupEnd = sortedSamples.isGroupEnd
+
+        # weights in the combined sorted order (zero for the events of
+        # the other sample) summed up to the end of each group
+        self.cumSig = numpy.cumsum(numpy.vstack((weightsSig, numpy.zeros((len(weightsBkg), weightsSig.shape[1]))))[order],
+                                   axis = 0)[isGroupEnd]
+        self.cumBkg = numpy.cumsum(numpy.vstack((numpy.zeros((len(weightsSig), weightsBkg.shape[1])), weightsBkg))[order],
+                                   axis = 0)[isGroupEnd]
+
+        if len(self.groupValues) > 0:
+            self.totSig = self.cumSig[-1]
+            self.totBkg = self.cumBkg[-1]
+        else:
+            self.totSig = numpy.zeros(self.cumSig.shape[1])
+            self.totBkg = numpy.zeros(self.cumBkg.shape[1])
+
+        # normalized cumulative distributions
+        self.fracSig = self.cumSig / numpy.where(self.totSig > 0, self.totSig, 1.)
+        self.fracBkg = self.cumBkg / numpy.where(self.totBkg > 0, self.totBkg, 1.)
+
+    #----------------------------------------
+
+    def __asMatrix(self, weights):
+        # @return the weights as 2D array (events x sets of weights)
+        import numpy
+
+        weights = numpy.asarray(weights, dtype = 'f8')
+        if weights.ndim == 1:
+            weights = weights[:, numpy.newaxis]
+
+        return weights
+
+    #----------------------------------------
+
+    def ks(self):
+        import numpy
+        if len(self.groupValues) == 0:
+            return numpy.zeros(self.fracSig.shape[1])
+
+        return numpy.abs(self.fracSig - self.fracBkg).max(axis = 0)
+
+    #----------------------------------------
+
+    def auc(self):
+        # probability that a signal event has a larger value than a
+        # background event (counting equal values half)
+        import numpy
+
+        if len(self.groupValues) == 0:
+            return 0.5 * numpy.ones(self.fracSig.shape[1])
+
+        deltaSig = numpy.vstack((self.fracSig[:1], numpy.diff(self.fracSig, axis = 0)))
+        fracBkgBefore = numpy.vstack((numpy.zeros((1, self.fracBkg.shape[1])), self.fracBkg[:-1]))
+        deltaBkg = self.fracBkg - fracBkgBefore
+
+        auc = (deltaSig * (fracBkgBefore + 0.5 * deltaBkg)).sum(axis = 0)
+
+        # a variable where signal tends to have smaller values is as
+        # useful as one where signal tends to have larger values
+        return numpy.maximum(auc, 1 - auc)
+
+    #----------------------------------------
+
+    def findBinEnds(self, numBins):
+        # @return the index of the last group of each of the bins
+        # with (approximately) equal population of the combined
+        # signal and background distribution of the first set of weights
+        import numpy
+
+        if len(self.groupValues) == 0:
+            return numpy.zeros(0, dtype = int)
+
+        combined = 0.5 * (self.fracSig[:, 0] + self.fracBkg[:, 0])
+
+        binEnds = numpy.searchsorted(combined, numpy.linspace(0, 1, numBins + 1)[1:-1])
+        binEnds = numpy.unique(numpy.append(binEnds, len(combined) - 1))
+
+        return binEnds[binEnds < len(combined)]
+
+    #----------------------------------------
+
+    def binnedFractions(self, binEnds):
+        # @return the fractions of signal and background in the
+        # bins ending at the given groups
+        import numpy
+
+        if len(binEnds) == 0:
+            return numpy.zeros((0, self.fracSig.shape[1])), numpy.zeros((0, self.fracBkg.shape[1]))
+
+        fracSig = numpy.diff(numpy.vstack((numpy.zeros((1, self.fracSig.shape[1])), self.fracSig[binEnds])), axis = 0)
+        fracBkg = numpy.diff(numpy.vstack((numpy.zeros((1, self.fracBkg.shape[1])), self.fracBkg[binEnds])), axis = 0)
+
+        return fracSig, fracBkg
+
+    #----------------------------------------
+
+    def separation(self, binEnds):
+        # <S^2> = 1/2 sum (s - b)^2 / (s + b)
+        # with s, b the normalized bin contents
+        import numpy
+
+        fracSig, fracBkg = self.binnedFractions(binEnds)
+
+        total = fracSig + fracBkg
+        terms = numpy.where(total > 0, (fracSig - fracBkg)**2 / numpy.where(total > 0, total, 1.), 0.)
+
+        return 0.5 * terms.sum(axis = 0)
+
+    #----------------------------------------
+
+    def mutualInformation(self, binEnds):
+        # mutual information between the class (assuming equal
+        # prior probabilities for signal and background) and the bin
+        # of the variable:
+        #
+        #   I = 1/2 sum [ s log2(2 s / (s + b)) + b log2(2 b / (s + b)) ]
+        import numpy
+
+        fracSig, fracBkg = self.binnedFractions(binEnds)
+
+        total = fracSig + fracBkg
+
+        retval = 0.
+        for frac in (fracSig, fracBkg):
+            isPositive = frac > 0
+            ratio = numpy.where(isPositive, 2 * frac / numpy.where(isPositive, total, 1.), 1.)
+            retval = retval + 0.5 * (frac * numpy.log2(ratio)).sum(axis = 0)
+
+        return retval
+
+    #----------------------------------------
+
+    def sOverSqrtB(self):
+        # best S / sqrt(B) (with the absolute weights) for a cut
+        # requiring values above or below a boundary between two
+        # distinct values
+        import numpy
+
+        if len(self.groupValues) == 0:
+            return numpy.zeros(self.cumSig.shape[1])
+
+        retval = numpy.zeros(self.cumSig.shape[1])
+
+        for numSig, numBkg in (
+            # values up to and including the group
+            (self.cumSig, self.cumBkg),
+            # values above the group (including no cut at all)
+            (numpy.vstack((self.totSig, self.totSig - self.cumSig)),
+             numpy.vstack((self.totBkg, self.totBkg - self.cumBkg))),
+            ):
+
+            # cuts without any background left are not considered
+            isValid = numBkg > 0
+            significance = numpy.where(isValid, numSig / numpy.sqrt(numpy.where(isValid, numBkg, 1.)), 0.)
+
+            retval = numpy.maximum(retval, significance.max(axis = 0))
+
+        return retval
+
+#----------------------------------------------------------------------
+
+def calcMetrics(valuesSig, valuesBkg, weightsSig, weightsBkg, metrics = None, numBins = 50):
+    # calculates several measures of separation between the signal and
+    # background distribution of one variable with a single sort of
+    # the values
+    #
+    # @param weightsSig, weightsBkg can be 1D arrays (one weight per event)
+    #        or 2D arrays (events x sets of weights)
+    # @param metrics is the list of names of metrics to be calculated
+    #        (see metricNames), all metrics if None
+    # @param numBins is the number of bins (of approximately equal population)
+    #        used for the binned metrics (separation and mutual information)
+    #
+    # @return a dict mapping from the metric name to the value
+    #         (an array with one value per set of weights for 2D weights)
+
+    return SortedSamples(valuesSig, valuesBkg).calcMetrics(weightsSig, weightsBkg, metrics, numBins)
@@ -17,11 +17,7 @@
 # limitations under the License.
 
 
-# TODO: review in which cases it makes sense to convert a fourvector
-#       back to a transverse vector to add it to a transverse vector
-#
-
-from .kinvarbuilder import CachingFunction
+from .kinvarbuilder import Node
 import math
 
 # our own implementation of a transverse vector
@@ -44,7 +40,12 @@ class Vector2D:
         self.py = pt * math.sin(phi)
 
         self.e = et
-        
+
+    def SetPxPyEt(self, px, py, et):
+        self.px = px
+        self.py = py
+        self.e = et
+
     def M(self):
 
         diff = self.e * self.e - self.px * self.px - self.py * self.py
@@ -70,13 +71,88 @@ class Vector2D:
     def Pt(self):
         return math.sqrt(self.px * self.px + self.py * self.py)
 
-@CachingFunction
-class TransverseVector:
+#----------------------------------------------------------------------
+
+class Vector2DArray:
+    # the transverse vectors of all events of a batch: holds
+    # one array per component (with one value per event) and
+    # provides the methods of Vector2D, which return arrays here
+
+    def __init__(self, numEvents = 0):
+        import numpy
+
+        self.px = numpy.zeros(numEvents)
+        self.py = numpy.zeros(numEvents)
+        self.e = numpy.zeros(numEvents)
+
+    def SetPhiEtPt(self, phi, et, pt):
+        import numpy
+
+        if pt is None:
+            # assume massless vectors
+            pt = et
+
+        self.px = numpy.cos(phi)
+        self.px *= pt
+
+        self.py = numpy.sin(phi)
+        self.py *= pt
+
+        self.e = numpy.array(et, dtype = 'f8')
+
+    def SetPxPyEt(self, px, py, et):
+        import numpy
+
+        self.px = numpy.array(px, dtype = 'f8')
+        self.py = numpy.array(py, dtype = 'f8')
+        self.e = numpy.array(et, dtype = 'f8')
+
+    def M(self):
+        import numpy
+
+        diff = self.e * self.e - self.px * self.px - self.py * self.py
+
+        # negative for spacelike vectors
+        return numpy.copysign(numpy.sqrt(numpy.abs(diff)), diff)
+
+    def Px(self):
+        return self.px
+
+    def Py(self):
+        return self.py
+
+    def Et(self):
+        return self.e
+
+    def Phi(self):
+        import numpy
+        return numpy.arctan2(self.py, self.px)
+
+    def Pt(self):
+        import numpy
+        return numpy.sqrt(self.px * self.px + self.py * self.py)
+
+    def __len__(self):
+        return len(self.e)
+
+    def __getitem__(self, index):
+        # @return the Vector2D of the given event
+        retval = Vector2D()
+        retval.SetPxPyEt(self.px[index], self.py[index], self.e[index])
+        return retval
+
+#----------------------------------------------------------------------
+
+class TransverseVector(Node):
     """ a transverse vector (typically at a hadron collider), i.e. the component
     parallel to the beam pipe is not known.
 
     """
 
+    __slots__ = ('etName', 'phiName', 'ptName', 'name', 'vector', 'validExpr',
+                 'varEt', 'varPt', 'varPhi', 'varValidExpr',
+                 'treeReader', 'batchVectors', 'batchValues')
+
     #----------------------------------------
 
     def __init__(self, phi, et, pt = None, name = None, validExpr = None):
@@ -91,6 +167,8 @@ class TransverseVector:
         :return:
         """
 
+        Node.__init__(self)
+
         # pt, eta, phi must contain names of variables in a ROOT TTree
         self.etName  = et
         self.phiName = phi
@@ -110,14 +188,46 @@ class TransverseVector:
         self.name = name
 
         # the vector to hold the values
-        import ROOT
         self.vector = Vector2D()
 
+        # the vectors of all events of the current batch
+        # of the tree reader (see calcValue())
+        self.batchVectors = Vector2DArray()
+        self.batchValues = None
+
         self.validExpr = validExpr
 
     #----------------------------------------
 
+    def getExpressions(self):
+        # @return the tree expressions read by this vector
+        retval = [ self.etName, self.ptName, self.phiName ]
+
+        if self.validExpr != None:
+            retval.append(self.validExpr)
+
+        return retval
+
+    #----------------------------------------
+
+    def getSpec(self):
+        # @return a description of this vector from which
+        # it can be created again (see VarBuilder.getGraphSpec())
+        return dict(type = 'TransverseVector',
+                    phi = self.phiName,
+                    et = self.etName,
+                    pt = self.ptName,
+                    name = self.name,
+                    validExpr = self.validExpr)
+
+    #----------------------------------------
+
     def setTreeReader(self, treeReader):
+        self.resetCache()
+
+        self.treeReader = treeReader
+        self.batchValues = None
+
         self.varEt = treeReader.getVar(self.etName)
         self.varPt = treeReader.getVar(self.ptName)
         self.varPhi = treeReader.getVar(self.phiName)
@@ -130,18 +240,30 @@ class TransverseVector:
     #----------------------------------------
 
 
-    def getValue(self):
+    def calcValue(self):
 
         if not self.varValidExpr[0]:
             # this vector is not defined for the current event
             return None
 
-        # get the quantities from the tree
-        self.vector.SetPhiEtPt(
-                self.varPhi[0],
-                self.varEt[0],
-                self.varPt[0],
-            )
+        treeReader = self.treeReader
+
+        if treeReader.cache is not self.batchValues:
+            # a new batch was read, calculate the components
+            # for all of its events at once
+            self.batchVectors.SetPhiEtPt(
+                self.varPhi.getBatch(),
+                self.varEt.getBatch(),
+                self.varPt.getBatch(),
+                )
+            self.batchValues = treeReader.cache
+
+        # get the components of the current event
+        row = treeReader.currentRow
+        vectors = self.batchVectors
+
+        self.vector.SetPxPyEt(vectors.px[row], vectors.py[row], vectors.e[row])
+
         return self.vector
 
     #----------------------------------------
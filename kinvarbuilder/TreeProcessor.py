@@ -17,52 +17,190 @@
 # limitations under the License.
 
 
+import time
+
 from .TreeReader import TreeReader
 
 #----------------------------------------------------------------------
 
+# numpy types of the output columns for ROOT leaf types
+# (used for spectator variables which are kept in their
+# native type)
+#
+# note that the values are read as doubles (by TTree::Draw(..)),
+# 64 bit integers are therefore stored as doubles such that
+# values above 2^53 are not silently changed to different integers
+_rootLeafTypeToDtype = {
+    'Bool_t':    'bool',
+    'Char_t':    'i1',
+    'UChar_t':   'u1',
+    'Short_t':   'i2',
+    'UShort_t':  'u2',
+    'Int_t':     'i4',
+    'UInt_t':    'u4',
+    'Long64_t':  'f8',
+    'ULong64_t': 'f8',
+    'Float_t':   'f4',
+    'Double_t':  'f8',
+    }
+
+# ROOT branch type codes and the type of the buffer
+# used for filling for the supported output types
+#
+# note that Float16_t ('f2') is a float in memory
+# which is stored with a reduced precision mantissa
+_dtypeToRootBranchType = {
+    'bool': ('O', 'bool'),
+    'i1':   ('B', 'i1'),
+    'u1':   ('b', 'u1'),
+    'i2':   ('S', 'i2'),
+    'u2':   ('s', 'u2'),
+    'i4':   ('I', 'i4'),
+    'u4':   ('i', 'u4'),
+    'i8':   ('L', 'i8'),
+    'u8':   ('l', 'u8'),
+    'f2':   ('f', 'f4'),
+    'f4':   ('F', 'f4'),
+    'f8':   ('D', 'f8'),
+    }
+
+# the ROOT leaf types of the branch type codes
+_rootBranchTypeToLeafType = {
+    'O': 'Bool_t',
+    'B': 'Char_t',
+    'b': 'UChar_t',
+    'S': 'Short_t',
+    's': 'UShort_t',
+    'I': 'Int_t',
+    'i': 'UInt_t',
+    'L': 'Long64_t',
+    'l': 'ULong64_t',
+    'f': 'Float16_t',
+    'F': 'Float_t',
+    'D': 'Double_t',
+    }
+
+#----------------------------------------------------------------------
+
 
 class _RootTreeWriter:
     """
     helper class for TreeProcessor for producing a ROOT tree
     """
 
-    def __init__(self,outputFileName, outputTreeName):
+    def __init__(self,outputFileName, outputTreeName, resume = False, checkpoints = False):
+        # @param resume if True, events are added to the existing
+        #        tree in the existing output file (see TreeProcessor.makeTree(..))
+        #
+        # @param checkpoints if True, the tree is only saved by checkpoint()
+        #        (and finish()), such that the number of entries saved
+        #        always corresponds to a checkpoint
+
         #----------
         # create an output tree with the variables
         #----------
 
         if outputFileName != None:
             import ROOT
-            self.fout = ROOT.TFile(outputFileName, "RECREATE")
+            if resume:
+                self.fout = ROOT.TFile(outputFileName, "UPDATE")
+            else:
+                self.fout = ROOT.TFile(outputFileName, "RECREATE")
+
+            if not self.fout or self.fout.IsZombie():
+                raise IOError("could not open output file " + outputFileName)
         else:
             self.fout = None
 
         self.outputTreeName = outputTreeName
+        self.resume = resume
+        self.checkpoints = checkpoints
 
 
     def setNumOutputEvents(self, numOutputEvents):
         # not needed for ROOT files
         pass
 
-    def setVariableNames(self, outputVarNames):
-        import ROOT
-        self.outTree = ROOT.TNtuple(self.outputTreeName,"output tree",
-                               ":".join(outputVarNames))
+    def setVariableNames(self, outputVarNames, outputVarTypes = None):
+        # creates a tree with one branch per output variable
+        # of the given (numpy) type (float by default)
+        import ROOT, numpy
+
+        if outputVarTypes == None:
+            outputVarTypes = [ 'f4' ] * len(outputVarNames)
+
+        if self.resume:
+            self.outTree = self.fout.Get(self.outputTreeName)
+            if not self.outTree:
+                raise IOError("tree %s not found in output file to resume" % self.outputTreeName)
+
+            existingNames = [ branch.GetName() for branch in self.outTree.GetListOfBranches() ]
+            if existingNames != list(outputVarNames):
+                raise ValueError("the variables of the existing output tree differ from the ones to be written")
+        else:
+            self.outTree = ROOT.TTree(self.outputTreeName,"output tree")
 
-        import array
-        # buffer for TTree.Fill(..)
-        self.outputValues =  array.array("f", [ 0.0 ] * len(outputVarNames))
+            if self.fout != None:
+                # the current directory may be an input file by now
+                self.outTree.SetDirectory(self.fout)
+
+        if self.checkpoints:
+            # no automatic saving by ROOT between checkpoints
+            self.outTree.SetAutoSave(0)
+
+        # buffers for TTree.Fill(..)
+        self.outputValues = []
+
+        for varName, varType in zip(outputVarNames, outputVarTypes):
+            varType = numpy.dtype(varType)
+            varType = 'bool' if varType.kind == 'b' else varType.str[1:]
+
+            if not varType in _dtypeToRootBranchType:
+                raise ValueError("unsupported output type %s for variable %s" % (varType, varName))
+
+            branchType, bufferType = _dtypeToRootBranchType[varType]
+
+            buffer = numpy.zeros(1, dtype = bufferType)
+
+            if self.resume:
+                # the buffer must have the type of the existing branch
+                leaf = self.outTree.GetLeaf(varName)
+                leafType = leaf.GetTypeName() if leaf else None
+
+                if leafType != _rootBranchTypeToLeafType[branchType]:
+                    raise ValueError("variable %s has type %s in the existing output tree instead of %s" %
+                                     (varName, leafType, _rootBranchTypeToLeafType[branchType]))
+
+                self.outTree.SetBranchAddress(varName, buffer)
+            else:
+                self.outTree.Branch(varName, buffer, "%s/%s" % (varName, branchType))
+
+            self.outputValues.append(buffer)
 
     def addEvent(self, values):
         assert(len(values) == len(self.outputValues))
 
-        # copy this to the array for filling it into the ntuple
-        for index, value in enumerate(values):
-            self.outputValues[index] = value
+        # copy this to the buffers of the branches
+        for buffer, value in zip(self.outputValues, values):
+            buffer[0] = value
 
         # fill the output tree
-        self.outTree.Fill(self.outputValues)
+        self.outTree.Fill()
+
+    def addEvents(self, columns):
+        # adds several events given as one array
+        # of values per output variable
+        for values in zip(*columns):
+            self.addEvent(values)
+
+    def getNumEntries(self):
+        return self.outTree.GetEntries()
+
+    def checkpoint(self):
+        # writes the baskets and the header of the tree to the
+        # file such that the entries filled so far can be recovered
+        # when the job does not finish
+        self.outTree.AutoSave("SaveSelf")
 
     def finish(self):
         # write the output tree to the file
@@ -71,7 +209,9 @@ class _RootTreeWriter:
             import ROOT
 
             self.fout.cd()
-            self.outTree.Write()
+
+            # overwrite the tree header written by checkpoint(..)
+            self.outTree.Write("", ROOT.TObject.kOverwrite)
 
             # TODO: go back to the ROOT directory we were before instead of going to ROOT.gROOT
 
@@ -93,40 +233,603 @@ class _NumpyArrayMaker:
 
 
     def setNumOutputEvents(self, numOutputEvents):
-        self.numOutputEvents = numOutputEvents
+        # called once per input tree before the events
+        # of this tree are added
+        #
+        # TODO: do we have to create an array of zeros or can we create
+        #       an uninitialized array ?
+        import numpy
+        self.chunks.append(numpy.zeros(numOutputEvents, dtype = self.dtypes))
+
+        # row into the current chunk
+        self.rowIndex = 0
 
-    def setVariableNames(self, outputVarNames):
+    def setVariableNames(self, outputVarNames, outputVarTypes = None):
         #----------
-        # create a record array
+        # define the columns of the record array
         #----------
         # see e.g. http://docs.scipy.org/doc/numpy/user/basics.rec.html
 
-        import numpy
-
-        # TODO: do we have to create an array of zeros or can we create
-        #       an uninitialized array ?
-
-        dtypes = [ (varname, 'f4') for varname in outputVarNames ]
+        if outputVarTypes == None:
+            outputVarTypes = [ 'f4' ] * len(outputVarNames)
 
-        self.retval = numpy.zeros(self.numOutputEvents, dtype = dtypes)
+        self.dtypes = zip(outputVarNames, outputVarTypes)
 
-        # row into the returned matrix
-        self.rowIndex = 0
+        # one record array per input tree
+        self.chunks = []
 
     def addEvent(self, values):
+        row = self.chunks[-1][self.rowIndex]
         for index in range(len(values)):
-            self.retval[self.rowIndex][index] = values[index]
+            row[index] = values[index]
 
         # prepare next iteration
         self.rowIndex += 1
 
+    def addEvents(self, columns):
+        # adds several events given as one array
+        # of values per output variable
+        if not columns:
+            return
+
+        numEvents = len(columns[0])
+
+        chunk = self.chunks[-1]
+        for (varName, varType), values in zip(self.dtypes, columns):
+            chunk[varName][self.rowIndex:self.rowIndex + numEvents] = values
+
+        self.rowIndex += numEvents
+
 
     def finish(self):
         # nothing to do here
         pass
 
     def getResult(self):
-        return self.retval
+        import numpy
+
+        if len(self.chunks) == 1:
+            return self.chunks[0]
+        elif not self.chunks:
+            return numpy.zeros(0, dtype = self.dtypes)
+        else:
+            return numpy.concatenate(self.chunks)
+
+#----------------------------------------------------------------------
+
+class _InputTree:
+    """
+    helper class for TreeProcessor: an input tree with its TreeReader
+    and the list of events to be processed
+    """
+
+    def __init__(self, fileName, fin, treeReader, entryOffset, entries, rangeBegin, rangeEnd):
+        # @param fileName is None if the tree was given directly
+        #
+        # @param entryOffset is the number of events in the previous
+        #        input files (the index of the first event of this tree
+        #        in the chained input)
+        #
+        # @param entries the indices (within this tree) of the events
+        #        to be processed
+        #
+        # @param rangeBegin, rangeEnd are the index (within this tree) of the
+        #        first event and of the event after the range of events
+        #        to be processed
+
+        self.fileName = fileName
+        self.fin = fin
+        self.treeReader = treeReader
+        self.entryOffset = entryOffset
+        self.entries = entries
+        self.rangeBegin = rangeBegin
+        self.rangeEnd = max(rangeEnd, rangeBegin)
+
+    def close(self):
+        self.treeReader.close()
+
+        if self.fin != None:
+            # the lock may be shared with the readers of other
+            # input files (see _InputFileReader)
+            with self.treeReader.treeLock:
+                self.fin.Close()
+            self.fin = None
+
+#----------------------------------------------------------------------
+
+class _InputFileReader:
+    """
+    helper class for TreeProcessor: opens the given input files one after
+    the other in a background thread, determines the events to be processed
+    and reads the first batch of events while the previous file is
+    being processed.
+
+    Unless enableThreadSafety is True (and ROOT.EnableThreadSafety()
+    is available), all ROOT calls for the input files are serialised
+    through one lock, such that only opening the files overlaps with
+    the processing of the previous file.
+
+    Iterating over this object returns _InputTree objects in the
+    order of the input files.
+    """
+
+    def __init__(self, fileNames, treeName, expressions, firstEvent = 0, endEvent = None,
+                 selection = None, numPrefetchFiles = 1, treeReaderArgs = {},
+                 enableThreadSafety = False):
+        # @param expressions are the tree expressions to be
+        #        read for each event
+        #
+        # @param treeReaderArgs are additional keyword arguments
+        #        for the TreeReader objects
+        #
+        # @param endEvent is the index (in the chained input) of the
+        #        last event + 1 to process or None to process all events
+        #
+        # @param numPrefetchFiles is the maximum number of files which
+        #        are opened ahead of the file being processed
+        #
+        # @param enableThreadSafety if True, ROOT.EnableThreadSafety()
+        #        is called (which affects the whole process) such that
+        #        the files can be read without a common lock
+
+        self.fileNames = list(fileNames)
+        self.treeName = treeName
+        self.expressions = list(expressions)
+        self.firstEvent = firstEvent
+        self.endEvent = endEvent
+        self.selection = selection
+        self.treeReaderArgs = dict(treeReaderArgs)
+
+        import Queue
+        self.queue = Queue.Queue(maxsize = max(int(numPrefetchFiles), 1))
+
+        import threading
+        self.stopRequested = threading.Event()
+
+        # held while opening a file
+        self.rootLock = threading.Lock()
+
+        import ROOT
+        if enableThreadSafety and hasattr(ROOT, "ROOT") and hasattr(ROOT.ROOT, "EnableThreadSafety"):
+            # we use ROOT from more than one thread
+            ROOT.ROOT.EnableThreadSafety()
+        else:
+            # the trees of different files must not be read
+            # at the same time either
+            self.treeReaderArgs['treeLock'] = self.rootLock
+
+        self.thread = threading.Thread(target = self.__readFiles)
+        self.thread.daemon = True
+        self.thread.start()
+
+    #----------------------------------------
+
+    def __openFile(self, fileName, entryOffset):
+        # @return an _InputTree object for the given file
+
+        import ROOT
+
+        with self.rootLock:
+            fin = ROOT.TFile.Open(fileName)
+            if not fin or fin.IsZombie():
+                raise IOError("could not open input file " + fileName)
+
+            tree = fin.Get(self.treeName)
+            if not tree:
+                fin.Close()
+                raise IOError("tree %s not found in file %s" % (self.treeName, fileName))
+
+            numEvents = tree.GetEntries()
+
+        if self.selection is None or isinstance(self.selection, basestring):
+            selection = self.selection
+        else:
+            # a mask for the chained input
+            selection = self.selection[entryOffset:entryOffset + numEvents]
+
+        treeReader = TreeReader(tree, selection = selection, **self.treeReaderArgs)
+
+        for expression in self.expressions:
+            treeReader.getVar(expression)
+
+        # the range of events to process within this file
+        begin = max(self.firstEvent - entryOffset, 0)
+
+        if self.endEvent != None:
+            end = min(self.endEvent - entryOffset, numEvents)
+        else:
+            end = numEvents
+
+        treeReader.setReadRange(begin, end)
+
+        entries = treeReader.getSelectedEntries(begin, end)
+
+        if len(entries) > 0:
+            # already read the first batch of events
+            treeReader.getEvent(entries[0])
+
+        return _InputTree(fileName, fin, treeReader, entryOffset, entries, begin, end)
+
+    #----------------------------------------
+
+    def __put(self, item):
+        # puts an item into the queue unless the consumer
+        # has stopped
+        #
+        # @return False if the consumer has stopped
+        import Queue
+
+        while not self.stopRequested.is_set():
+            try:
+                self.queue.put(item, timeout = 0.1)
+                return True
+            except Queue.Full:
+                pass
+
+        return False
+
+    #----------------------------------------
+
+    def __readFiles(self):
+        # runs in the background thread
+
+        entryOffset = 0
+
+        try:
+            for fileName in self.fileNames:
+
+                if self.endEvent != None and entryOffset >= self.endEvent:
+                    # no more events needed
+                    break
+
+                inputTree = self.__openFile(fileName, entryOffset)
+
+                entryOffset += inputTree.treeReader.numEvents
+
+                if not self.__put((inputTree, None)):
+                    inputTree.close()
+                    return
+
+        except Exception:
+            # pass the exception to the consumer
+            import sys
+            self.__put((None, sys.exc_info()))
+            return
+
+        # signal the end of the input files
+        self.__put((None, None))
+
+    #----------------------------------------
+
+    def __iter__(self):
+        try:
+            while True:
+                inputTree, excInfo = self.queue.get()
+
+                if excInfo != None:
+                    raise excInfo[0], excInfo[1], excInfo[2]
+
+                if inputTree == None:
+                    # no more files
+                    break
+
+                yield inputTree
+
+        finally:
+            self.close()
+
+    #----------------------------------------
+
+    def __closeQueued(self):
+        # closes the files which were opened ahead
+        import Queue
+
+        while True:
+            try:
+                inputTree, excInfo = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+
+            if inputTree != None:
+                inputTree.close()
+
+    #----------------------------------------
+
+    def close(self):
+        # stops the background thread
+        self.stopRequested.set()
+
+        self.__closeQueued()
+        self.thread.join()
+        self.__closeQueued()
+
+#----------------------------------------------------------------------
+
+class _Checkpointer:
+    """
+    helper class for TreeProcessor.makeTree(..): periodically saves
+    the output tree and records the range of input events completed so far
+    in a manifest (a JSON file next to the output file) such that an
+    interrupted job can be resumed.
+
+    A checkpoint first records the one being made as 'pending' in the
+    manifest, then saves the tree and finally marks it as completed. When
+    resuming, the number of entries in the output tree tells whether
+    the job was interrupted while saving the tree.
+    """
+
+    #----------------------------------------
+
+    def __init__(self, manifestFileName, interval, config, firstEvent, numOutputEvents = 0):
+        # @param interval is the number of input events between
+        #        checkpoints (None for checkpointing only at the end
+        #        of each input file)
+        #
+        # @param config describes the job (input, selection, output variables etc.),
+        #        a job can only be resumed with the same configuration
+
+        self.manifestFileName = manifestFileName
+        self.interval = interval
+        self.config = config
+
+        self.firstEvent = firstEvent
+
+        self.completed = dict(end = firstEvent, numOutputEvents = numOutputEvents)
+
+        self.numEventsSinceCheckpoint = 0
+
+        self.treeWriter = None
+
+    #----------------------------------------
+
+    @staticmethod
+    def readManifest(manifestFileName):
+        # @return the contents of the manifest or None if it does not exist
+        import json, os
+
+        if not os.path.exists(manifestFileName):
+            return None
+
+        fin = open(manifestFileName)
+        retval = json.load(fin)
+        fin.close()
+
+        return retval
+
+    #----------------------------------------
+
+    def __writeManifest(self, pending = None, finished = False):
+        import json, os
+
+        manifest = dict(config = self.config,
+                        completedRanges = [ [ self.firstEvent, self.completed['end'] ] ],
+                        completed = self.completed,
+                        pending = pending,
+                        finished = finished)
+
+        # write to a temporary file first such that an interruption
+        # does not leave an incomplete manifest
+        fout = open(self.manifestFileName + ".tmp", "w")
+        json.dump(manifest, fout, indent = 2, sort_keys = True)
+        fout.close()
+
+        os.rename(self.manifestFileName + ".tmp", self.manifestFileName)
+
+    #----------------------------------------
+
+    def eventProcessed(self, nextEvent, numEvents = 1):
+        # called after each event (or batch of numEvents events)
+        # was processed
+        #
+        # @param nextEvent is the index (in the chained input) of the
+        #        event after the one just processed
+        self.numEventsSinceCheckpoint += numEvents
+
+        if self.interval != None and self.numEventsSinceCheckpoint >= self.interval:
+            self.checkpoint(nextEvent)
+
+    #----------------------------------------
+
+    def checkpoint(self, nextEvent):
+        # saves the output and records that all input events
+        # before nextEvent have been processed
+        pending = dict(end = nextEvent, numOutputEvents = self.treeWriter.getNumEntries())
+
+        self.__writeManifest(pending)
+
+        self.treeWriter.checkpoint()
+
+        self.completed = pending
+        self.__writeManifest()
+
+        self.numEventsSinceCheckpoint = 0
+
+    #----------------------------------------
+
+    def finish(self):
+        # called after the output file was written
+        self.__writeManifest(finished = True)
+
+#----------------------------------------------------------------------
+
+class ProcessingMetrics:
+    """
+    timing and throughput of a call to TreeProcessor.makeTree(..) or makeArray(..),
+    available in the attribute 'metrics' of the TreeProcessor during (e.g. from
+    the progress callback) and after processing
+    """
+
+    #----------------------------------------
+
+    def __init__(self):
+        # the time processing started and ended
+        # (None while processing)
+        self.startTime = time.time()
+        self.endTime = None
+
+        # the number of input events processed so far
+        # and the number of batches they were read in
+        self.numEvents = 0
+        self.numBatches = 0
+
+        # seconds spent in the stages of processing:
+        #
+        #   readTime        getting the events from the tree readers
+        #                   (including waiting for batches to be read)
+        #   evaluationTime  calculating the output variables
+        #   undefinedTime   replacing undefined values
+        #   writeTime       adding the values to the output
+        #
+        # when processing event by event (not in batch mode), the time
+        # is only measured per batch, evaluationTime then includes
+        # replacing undefined values and writing the output
+        self.readTime = 0.
+        self.evaluationTime = 0.
+        self.undefinedTime = 0.
+        self.writeTime = 0.
+
+        # (numEvents, seconds) of each batch processed
+        self.batches = []
+
+        # statistics of the tree readers of the input
+        # files completed so far (see TreeReader.getStats())
+        self.ioWaitTime = 0.
+        self.treeReadTime = 0.
+        self.numEventLookups = 0
+        self.numBatchLoads = 0
+
+    #----------------------------------------
+
+    def addBatch(self, numEvents, seconds):
+        # called after a batch of events was processed
+        self.numBatches += 1
+        self.batches.append((numEvents, seconds))
+
+    #----------------------------------------
+
+    def addTreeReaderStats(self, treeReader):
+        # called when the events of an input tree were processed
+        stats = treeReader.getStats()
+
+        self.ioWaitTime += stats['ioWaitTime']
+        self.treeReadTime += stats['readTime']
+        self.numEventLookups += stats['numEventLookups']
+        self.numBatchLoads += stats['numBatchLoads']
+
+    #----------------------------------------
+
+    def finish(self):
+        # called when all events were processed
+        self.endTime = time.time()
+
+    #----------------------------------------
+
+    def getElapsedTime(self):
+        # @return the number of seconds processing took
+        # (so far if it is not finished yet)
+        if self.endTime != None:
+            return self.endTime - self.startTime
+
+        return time.time() - self.startTime
+
+    #----------------------------------------
+
+    def getEventsPerSecond(self):
+        # @return the number of events processed per second
+        # for each batch
+        return [ numEvents / seconds if seconds > 0 else float('inf')
+                 for numEvents, seconds in self.batches ]
+
+    #----------------------------------------
+
+    def getCacheHitRate(self):
+        # @return the fraction of lookups of events in the tree readers
+        # which found the event in the batch in memory (None if no
+        # input tree was completed yet)
+        if self.numEventLookups == 0:
+            return None
+
+        return 1. - self.numBatchLoads / float(self.numEventLookups)
+
+    #----------------------------------------
+
+    def asDict(self):
+        # @return the metrics as dict (e.g. for writing them as JSON)
+        return dict(numEvents = self.numEvents,
+                    numBatches = self.numBatches,
+                    elapsedTime = self.getElapsedTime(),
+                    readTime = self.readTime,
+                    evaluationTime = self.evaluationTime,
+                    undefinedTime = self.undefinedTime,
+                    writeTime = self.writeTime,
+                    ioWaitTime = self.ioWaitTime,
+                    treeReadTime = self.treeReadTime,
+                    eventsPerSecond = self.getEventsPerSecond(),
+                    cacheHitRate = self.getCacheHitRate())
+
+#----------------------------------------------------------------------
+
+# when the progress callback is called every given number of seconds,
+# the time is checked every this number of events
+_progressTimeCheckEvents = 100
+
+class _ProgressReporter:
+    # calls the progress callback given to TreeProcessor.makeTree(..)
+    # or makeArray(..), at most every numEvents input events or every
+    # 'seconds' seconds (whichever comes first) if any of these is set
+
+    #----------------------------------------
+
+    def __init__(self, callback, numEvents = None, seconds = None):
+        self.callback = callback
+        self.numEvents = numEvents
+        self.seconds = seconds
+
+        self.always = numEvents == None and seconds == None
+
+        # the callback is called next when the event with this
+        # index is processed or at this time
+        self.nextEventIndex = 0
+        self.nextTime = 0.
+
+    #----------------------------------------
+
+    def update(self, numEventsToProcess, eventIndex):
+        # calls the callback with the number of input events to process
+        # and the index of the event about to be processed if it is due
+        #
+        # @return the number of processed events after which this must
+        # be called again at the latest (such that the caller need not
+        # call this for every event)
+
+        if self.always:
+            self.callback(numEventsToProcess, eventIndex)
+            return 1
+
+        if self.seconds != None:
+            now = time.time()
+
+        if (self.numEvents != None and eventIndex >= self.nextEventIndex) or \
+           (self.seconds != None and now >= self.nextTime):
+
+            self.callback(numEventsToProcess, eventIndex)
+
+            if self.numEvents != None:
+                self.nextEventIndex = eventIndex + self.numEvents
+
+            if self.seconds != None:
+                self.nextTime = now + self.seconds
+
+        if self.numEvents != None:
+            # each processed event advances the index by at least one
+            retval = self.nextEventIndex - eventIndex
+        else:
+            retval = _progressTimeCheckEvents
+
+        if self.seconds != None:
+            retval = min(retval, _progressTimeCheckEvents)
+
+        return max(retval, 1)
 
 #----------------------------------------------------------------------
 
@@ -137,28 +840,139 @@ class TreeProcessor:
 
     #----------------------------------------
 
-    def __init__(self, varBuilder, undefValue = None):
+    def __init__(self, varBuilder, undefValue = None, entryVariableName = "entry",
+                 readBatchSize = 10000, prefetchDepth = 0, memoryBudget = None,
+                 defaultOutputType = 'f4', outputTypes = None, batchMode = False,
+                 progressEvents = None, progressSeconds = None, enableThreadSafety = False):
         """
         :param undefValue: the value to be put into the output for undefined quantities
          (e.g. import for ROOT tree output)
+        :param entryVariableName: name of the output column holding the index of the
+         event in the input tree when a selection is applied
+        :param readBatchSize: number of events read from the input tree at once
+        :param prefetchDepth: if larger than zero, this number of batches of events
+         are read ahead in a background thread while the current batch is processed
+        :param memoryBudget: if not None, the approximate number of bytes the batches of
+         events read may occupy. The batch size is then adapted automatically (starting
+         from readBatchSize), see TreeReader
+        :param defaultOutputType: the numpy type ('f2', 'f4' or 'f8') in which the derived variables
+         are stored (they are always calculated in double precision)
+        :param outputTypes: a dict from the output variable name (or the description of a derived
+         variable) to the numpy type of the output column, overriding the default type
+         (see also setOutputType(..))
+        :param batchMode: if True, the derived variables are calculated for all events of a
+         batch read from the input tree at once by a function generated from the graph of the
+         VarBuilder (see VarBuilder.getBatchFunction()). Variables the generated function does not
+         support are still calculated event by event.
+        :param progressEvents, progressSeconds: if not None, the progress callback given to
+         makeTree(..) or makeArray(..) is called at most every this number of input events or
+         seconds (whichever comes first) instead of for each event (or batch in batch mode). The
+         timing and throughput of the processing are available in the attribute metrics
+         (see ProcessingMetrics).
+        :param enableThreadSafety: if True, ROOT.EnableThreadSafety() is called when processing
+         input files (see makeTree(..)) such that the files opened ahead in a background thread are
+         read while the current file is processed. Note that this affects ROOT in the whole process.
+         Otherwise all ROOT calls for the input files are made while holding a common lock.
         """
         
 
         self.varBuilder = varBuilder
 
+        self.treeReaderArgs = dict(readBatchSize = readBatchSize,
+                                   prefetchDepth = prefetchDepth,
+                                   memoryBudget = memoryBudget)
+
+        self.entryVariableName = entryVariableName
+
         self.spectatorExpressions = []
         self.spectatorOutputVariableNames = []
 
         self.undefValue = undefValue
 
+        self.defaultOutputType = defaultOutputType
+
+        self.batchMode = batchMode
+
+        self.progressEvents = progressEvents
+        self.progressSeconds = progressSeconds
+
+        self.enableThreadSafety = enableThreadSafety
+
+        # the metrics of the current or last processing
+        self.metrics = None
+
+        # output types set explicitly
+        self.outputTypes = {}
+        if outputTypes != None:
+            self.outputTypes.update(outputTypes)
+
+    #----------------------------------------
+
+    def withVarBuilder(self, varBuilder):
+        """
+        :return: a TreeProcessor with the same settings and spectator variables
+         as this one which calculates the output variables of the given VarBuilder
+         (e.g. a subset of the variables, see VarBuilder.getSubset(..))
+        """
+        import copy
+
+        retval = copy.copy(self)
+
+        retval.varBuilder = varBuilder
+        retval.spectatorExpressions = list(self.spectatorExpressions)
+        retval.spectatorOutputVariableNames = list(self.spectatorOutputVariableNames)
+        retval.outputTypes = dict(self.outputTypes)
+        retval.metrics = None
+
+        return retval
+
     #----------------------------------------
 
-    def addSpectatorVariable(self, expression, outputName = None):
+    def getNumInputEvents(self, inputTree, treeName = None):
+        """
+        :return: the number of events in the given input, which can be a tree or
+         input files (see makeTree(..)), in which case the files are opened to
+         count the events
+        """
+
+        if not isinstance(inputTree, (basestring, list, tuple)):
+            return inputTree.GetEntries()
+
+        if treeName == None:
+            raise ValueError("must specify treeName when processing input files")
+
+        import ROOT
+
+        retval = 0
+
+        for fileName in self.__getInputFileNames(inputTree):
+            fin = ROOT.TFile.Open(fileName)
+            if not fin or fin.IsZombie():
+                raise IOError("could not open input file " + fileName)
+
+            tree = fin.Get(treeName)
+            if not tree:
+                fin.Close()
+                raise IOError("tree %s not found in file %s" % (treeName, fileName))
+
+            retval += tree.GetEntries()
+
+            fin.Close()
+
+        return retval
+
+    #----------------------------------------
+
+    def addSpectatorVariable(self, expression, outputName = None, outputType = None):
         """
         adds a ROOT expression to be also put into the output tree, e.g. for checking
         or distinguishing signal from background or event weights etc.
 
         :param expression:
+        :param outputType: the numpy type of the output column. If None, a branch of the
+         input tree is stored in its own type (e.g. 'i4' for an Int_t run number) and other
+         expressions as 'f8'. Since the values are read as doubles, 64 bit integer branches
+         are also stored as 'f8' unless given otherwise here.
         """
 
         if outputName == None:
@@ -169,24 +983,213 @@ class TreeProcessor:
         self.spectatorExpressions.append(expression)
         self.spectatorOutputVariableNames.append(outputName)
 
+        if outputType != None:
+            self.outputTypes[outputName] = outputType
+
+    #----------------------------------------
+
+    def setOutputType(self, outputName, outputType):
+        """
+        sets the numpy type of an output column
+
+        :param outputName: the name of the output variable (or the description
+         of a derived variable as in varBuilder.outputVarDescriptions)
+        :param outputType: a numpy type such as 'f2', 'f4', 'f8', 'i4' or 'i8'
+        """
+        self.outputTypes[outputName] = outputType
+
+    #----------------------------------------
+
+    def __getOutputTypes(self, tree):
+        # @return the list of numpy types of the derived and
+        # spectator output variables
+        #
+        # @param tree is used to determine the native type of spectator
+        #        variables (may be None when there are no input events)
+
+        retval = []
+
+        for varName, description in zip(self.varBuilder.outputVarnames, self.varBuilder.outputVarDescriptions):
+            retval.append(self.outputTypes.get(varName, self.outputTypes.get(description, self.defaultOutputType)))
+
+        for expression, varName in zip(self.spectatorExpressions, self.spectatorOutputVariableNames):
+            outputType = self.outputTypes.get(varName)
+
+            if outputType == None:
+                # values of expressions from TTree::Draw(..) are doubles
+                outputType = 'f8'
+
+                if tree != None:
+                    leaf = tree.GetLeaf(expression)
+                    if leaf:
+                        outputType = _rootLeafTypeToDtype.get(leaf.GetTypeName(), 'f8')
+
+            retval.append(outputType)
+
+        return retval
+
+    #----------------------------------------
+
+    def __getInputFileNames(self, inputFiles):
+        # @return the list of input files given a file name, a glob
+        # pattern or a list of those
+
+        if isinstance(inputFiles, basestring):
+            inputFiles = [ inputFiles ]
+
+        import glob
+
+        retval = []
+        for pattern in inputFiles:
+            if glob.has_magic(pattern):
+                fileNames = sorted(glob.glob(pattern))
+                if not fileNames:
+                    raise IOError("no input files matching " + pattern)
+                retval.extend(fileNames)
+            else:
+                # could also be a remote file, do not check
+                # for existence here
+                retval.append(pattern)
+
+        return retval
+
     #----------------------------------------
 
     def _makeOutput(self, inputTree, outputMaker, firstEvent = 0, maxEvents = None,
-                 progressCallback = None):
+                 progressCallback = None, selection = None, treeName = None,
+                 fileCallback = None, numPrefetchFiles = 1, checkpointer = None):
+
+        #----------
+        # set up the output variables
+        #----------
+
+        allOutputVarNames = self.varBuilder.outputVarnames + self.spectatorOutputVariableNames
+
+        # when a selection is applied, keep track of which input
+        # event each output row corresponds to
+        addEntryColumn = selection is not None
+
+        if addEntryColumn:
+            allOutputVarNames.append(self.entryVariableName)
+
+        def setOutputVariables(tree):
+            # the types of the output variables can only be
+            # determined once the first input tree is available
+            allOutputVarTypes = self.__getOutputTypes(tree)
+
+            if addEntryColumn:
+                allOutputVarTypes.append('i8')
+
+            outputMaker.setVariableNames(allOutputVarNames, allOutputVarTypes)
 
-        treeReader = TreeReader(inputTree)
+        treeReaderArgs = dict(self.treeReaderArgs, numOutputColumns = len(allOutputVarNames))
 
         #----------
-        # determine the number of rows in the array to return
+        # set up the input
         #----------
-        if maxEvents != None:
-            endEvent = min(firstEvent + maxEvents, treeReader.numEvents)
+        if isinstance(inputTree, (basestring, list, tuple)):
+            # a list of input files
+            if treeName == None:
+                raise ValueError("must specify treeName when processing input files")
+
+            fileNames = self.__getInputFileNames(inputTree)
+
+            if maxEvents != None:
+                endEvent = firstEvent + maxEvents
+            else:
+                endEvent = None
+
+            expressions = [ expression for vector in self.varBuilder.inputVectors
+                                       for expression in vector.getExpressions() ] + self.spectatorExpressions
+
+            inputTrees = _InputFileReader(fileNames, treeName, expressions, firstEvent, endEvent,
+                                          selection, numPrefetchFiles, treeReaderArgs,
+                                          self.enableThreadSafety)
+        else:
+            fileNames = [ None ]
+
+            treeReader = TreeReader(inputTree, selection = selection, **treeReaderArgs)
+
+            #----------
+            # determine the number of rows in the array to return
+            #----------
+            if maxEvents != None:
+                endEvent = min(firstEvent + maxEvents, treeReader.numEvents)
+            else:
+                endEvent = treeReader.numEvents
+
+            treeReader.setReadRange(firstEvent, endEvent)
+
+            # the events passing the selection
+            entries = treeReader.getSelectedEntries(firstEvent, endEvent)
+
+            inputTrees = [ _InputTree(None, None, treeReader, 0, entries, firstEvent, endEvent) ]
+
+        # number of output rows for each input file
+        self.fileEntryCounts = []
+
+        self.metrics = ProcessingMetrics()
+
+        if progressCallback != None:
+            progress = _ProgressReporter(progressCallback, self.progressEvents, self.progressSeconds)
         else:
-            endEvent = treeReader.numEvents
+            progress = None
+
+        # for the progress callback: the number of input events in the
+        # range to process (of the input files opened so far)
+        numEventsToProcess = 0
+
+        try:
+            for fileIndex, thisInput in enumerate(inputTrees):
+                try:
+                    if fileIndex == 0:
+                        setOutputVariables(thisInput.treeReader.tree)
+
+                    numEventsToProcess += thisInput.rangeEnd - thisInput.rangeBegin
+
+                    self.__processInputTree(thisInput, outputMaker, progress, numEventsToProcess, addEntryColumn,
+                                            fileIndex, len(fileNames), fileCallback, checkpointer)
 
-        numEventsToProcess = endEvent - firstEvent
+                    self.metrics.addTreeReaderStats(thisInput.treeReader)
 
-        outputMaker.setNumOutputEvents(numEventsToProcess)
+                    if checkpointer != None:
+                        checkpointer.checkpoint(thisInput.entryOffset + thisInput.rangeEnd)
+                finally:
+                    thisInput.close()
+
+                self.fileEntryCounts.append((thisInput.fileName, len(thisInput.entries)))
+        finally:
+            if isinstance(inputTrees, _InputFileReader):
+                # stop reading ahead
+                inputTrees.close()
+
+        if not self.fileEntryCounts:
+            # no input tree at all
+            setOutputVariables(None)
+
+        outputMaker.finish()
+
+        self.metrics.finish()
+
+        return outputMaker.getResult()
+
+    #----------------------------------------
+
+    def __processInputTree(self, inputTree, outputMaker, progress, numEventsToProcess, addEntryColumn,
+                           fileIndex, numFiles, fileCallback, checkpointer):
+        # @param progress is the _ProgressReporter (or None)
+        #
+        # @param numEventsToProcess is the number of input events to process
+        #        (passed to the progress callback)
+
+        treeReader = inputTree.treeReader
+        entries = inputTree.entries
+        entryOffset = inputTree.entryOffset
+
+        if fileCallback != None:
+            fileCallback(fileIndex, numFiles, inputTree.fileName)
+
+        outputMaker.setNumOutputEvents(len(entries))
 
         #----------
         # set the input tree
@@ -199,21 +1202,56 @@ class TreeProcessor:
         # add spectator expressions to the treeReader
         spectatorBuffers = [ treeReader.getVar(expression) for expression in self.spectatorExpressions ]
 
-        allOutputVarNames = self.varBuilder.outputVarnames + self.spectatorOutputVariableNames
+        if self.batchMode:
+            self.__processBatches(inputTree, outputMaker, progress, numEventsToProcess, addEntryColumn,
+                                  spectatorBuffers, checkpointer)
+            return
+
+        metrics = self.metrics
+
+        # the number of events processed before this input tree
+        numProcessedBefore = metrics.numEvents
 
-        outputMaker.setVariableNames(allOutputVarNames)
+        # the number of events after which the progress
+        # reporter is called again
+        progressCountdown = 1
+
+        # the time is only measured when a new batch was read
+        # (detected by the number of batches loaded by the tree
+        # reader), not for each event
+        loopStartTime = time.time()
+        ioWaitTimeBefore = treeReader.ioWaitTime
+
+        numBatchLoads = treeReader.numBatchLoads
+        batchStartTime = None
+        numBatchEvents = 0
 
         #----------
         # loop over all lines of the data given
         #----------
-        for eventIndex in range(firstEvent, endEvent):
+        for pos, eventIndex in enumerate(entries):
 
-            if progressCallback != None:
-                progressCallback(numEventsToProcess, eventIndex)
+            if progress != None:
+                progressCountdown -= 1
+                if progressCountdown <= 0:
+                    metrics.numEvents = numProcessedBefore + pos
+                    progressCountdown = progress.update(numEventsToProcess, entryOffset + eventIndex)
 
             # read the event into memory
             treeReader.getEvent(eventIndex)
 
+            if treeReader.numBatchLoads != numBatchLoads:
+                # a new batch was read
+                numBatchLoads = treeReader.numBatchLoads
+
+                now = time.time()
+
+                if batchStartTime != None:
+                    metrics.addBatch(numBatchEvents, now - batchStartTime)
+
+                batchStartTime = now
+                numBatchEvents = 0
+
             # clear the caches from the previous event
             for obj in self.varBuilder.outputScalars:
                 obj.newEvent()
@@ -237,48 +1275,324 @@ class TreeProcessor:
                 if values[index] == None:
                     values[index] = self.undefValue
 
+            if addEntryColumn:
+                values.append(entryOffset + eventIndex)
+
             outputMaker.addEvent(values)
 
+            if checkpointer != None:
+                checkpointer.eventProcessed(entryOffset + eventIndex + 1)
+
+            numBatchEvents += 1
+
             # TODO: add support for quantity not existing
 
+        endTime = time.time()
 
-        outputMaker.finish()
+        if batchStartTime != None:
+            metrics.addBatch(numBatchEvents, endTime - batchStartTime)
 
-        return outputMaker.getResult()
+        readTime = treeReader.ioWaitTime - ioWaitTimeBefore
+
+        metrics.readTime += readTime
+        metrics.evaluationTime += endTime - loopStartTime - readTime
+
+        metrics.numEvents = numProcessedBefore + len(entries)
+
+    #----------------------------------------
+
+    def __processBatches(self, inputTree, outputMaker, progress, numEventsToProcess, addEntryColumn,
+                         spectatorBuffers, checkpointer):
+        # calculates the output variables for all events of each batch
+        # read by the TreeReader at once (see batchMode in the constructor)
+        import numpy
+
+        treeReader = inputTree.treeReader
+        entries = numpy.asarray(inputTree.entries)
+        entryOffset = inputTree.entryOffset
+
+        batchFunction = self.varBuilder.getBatchFunction()
+
+        inputBuffers = [ treeReader.getVar(expression) for expression in batchFunction.inputExpressions ]
+
+        # the output variables calculated event by event
+        fallbackScalars = [ self.varBuilder.outputScalars[index] for index in batchFunction.fallbackIndices ]
+
+        numOutputScalars = len(self.varBuilder.outputScalars)
+
+        metrics = self.metrics
+
+        pos = 0
+        while pos < len(entries):
+
+            if progress != None:
+                progress.update(numEventsToProcess, entryOffset + int(entries[pos]))
+
+            startTime = time.time()
+
+            # read the batch containing the next event
+            treeReader.getEvent(entries[pos])
+
+            end = entries.searchsorted(treeReader.cacheEnd)
+            batchEntries = entries[pos:end]
+            numEvents = len(batchEntries)
+
+            rows = treeReader.getBatchRows(batchEntries)
+
+            readTime = time.time()
+
+            #----------
+            # the output variables of the generated function
+            #----------
+            values = treeReader.bufferPool.getArray('batchOutput', len(batchFunction.outputIndices), numEvents)
+
+            isUndefined = batchFunction([ buffer.getBatch()[rows] for buffer in inputBuffers ], values,
+                                        treeReader.bufferPool)
+
+            columns = [ None ] * numOutputScalars
+
+            for row, index in enumerate(batchFunction.outputIndices):
+                columns[index] = values[row]
+
+            #----------
+            # the other output variables
+            #----------
+            if fallbackScalars:
+                fallbackValues = treeReader.bufferPool.getArray('fallbackOutput', len(fallbackScalars), numEvents)
+
+                fallbackUndefined = treeReader.bufferPool.getArray('fallbackUndefined', len(fallbackScalars), numEvents, bool)
+                fallbackUndefined.fill(False)
+
+                for eventPos, eventIndex in enumerate(batchEntries):
+                    treeReader.getEvent(eventIndex)
+
+                    for obj in fallbackScalars:
+                        obj.newEvent()
+
+                    for row, obj in enumerate(fallbackScalars):
+                        value = obj.getValue()
+                        if value == None:
+                            # replaced by undefValue below
+                            value = numpy.nan
+                            fallbackUndefined[row, eventPos] = True
+
+                        fallbackValues[row, eventPos] = value
+
+                for row, index in enumerate(batchFunction.fallbackIndices):
+                    columns[index] = fallbackValues[row]
+
+            evaluationTime = time.time()
+
+            # replace undefined values (which are marked separately such
+            # that NaN values calculated by a function are kept as in
+            # the event by event processing)
+            if self.undefValue != None:
+                values[isUndefined] = self.undefValue
+
+                if fallbackScalars:
+                    fallbackValues[fallbackUndefined] = self.undefValue
+
+            undefinedTime = time.time()
+
+            columns.extend(buffer.getBatch()[rows] for buffer in spectatorBuffers)
+
+            if addEntryColumn:
+                columns.append(entryOffset + batchEntries)
+
+            outputMaker.addEvents(columns)
+
+            pos = end
+
+            if checkpointer != None:
+                checkpointer.eventProcessed(entryOffset + batchEntries[-1] + 1, numEvents)
+
+            endTime = time.time()
+
+            metrics.readTime += readTime - startTime
+            metrics.evaluationTime += evaluationTime - readTime
+            metrics.undefinedTime += undefinedTime - evaluationTime
+            metrics.writeTime += endTime - undefinedTime
+
+            metrics.numEvents += numEvents
+            metrics.addBatch(numEvents, endTime - startTime)
 
     #----------------------------------------
 
     def makeTree(self, inputTree, outputTreeName, outputFileName = None, firstEvent = 0, maxEvents = None,
-                 progressCallback = None):
+                 progressCallback = None, selection = None, treeName = None, fileCallback = None,
+                 numPrefetchFiles = 1, checkpointInterval = None, resume = False):
         """
         produce a ROOT output tree
 
-        :param inputTree: the tree from which the variables shall be calculated
+        :param inputTree: the tree from which the variables shall be calculated. Can also be
+            the name of an input file, a glob pattern or a list of those, in which case
+            treeName must be given and the files are processed as if they were chained
+            (i.e. event indices count from the first event in the first file)
         :param outputTreeName: must be specified: the name of the output tree produced
         :param outputFileName: optional: if given, a TFile is created and the generated tree is written
             to this file
         :param maxEvents: process at most this number of events (unless it is None)
         :param: firstEvent is the index of the first event to process (zero based)
-        :param progressCallback: a function taking the pointer to this class and the index (0 based) of
-         the event about to be processed
+        :param progressCallback: a function taking the number of input events to process (in the
+         range given by firstEvent and maxEvents, including the events not passing the selection)
+         and the index (0 based) of the event about to be processed (in batch mode, the first
+         event of the batch). When processing input files, the event index counts from the first
+         event in the first file and the number of events to process only includes the input files
+         opened so far (i.e. it grows while later files are opened). See progressEvents and
+         progressSeconds in the constructor for how often it is called, the number of events
+         processed (passing the selection) and the timing of the processing so far are in the
+         attribute metrics (see ProcessingMetrics).
+        :param selection: if not None, only events passing this selection are processed. Can be
+         a ROOT tree expression or a numpy boolean array with one entry per event in the input tree.
+         The output then has an additional column with the index of the event in the input tree.
+        :param treeName: the name of the tree to read when processing input files
+        :param fileCallback: when processing input files, a function called with the index
+         of the input file, the number of input files and the name of the input file before the
+         file is processed
+        :param numPrefetchFiles: when processing input files, the number of files opened
+         and read ahead in a background thread while processing the current file.
+         The number of output rows for each input file is available in the attribute
+         fileEntryCounts after processing.
+        :param checkpointInterval: if not None, the output tree is saved to the output file every
+         this number of processed events (and after each input file) and the range of input
+         events processed so far is recorded in the file outputFileName + '.checkpoint.json'
+        :param resume: if True and a checkpoint file from an interrupted job with the same
+         parameters exists, the events already written to the output file are kept and
+         processing continues after the last checkpoint. Implies checkpointing after each input file.
         :return:
         """
-        outputMaker = _RootTreeWriter(outputFileName, outputTreeName)
 
-        return self._makeOutput(inputTree, outputMaker, firstEvent, maxEvents, progressCallback)
+        if checkpointInterval == None and not resume:
+            outputMaker = _RootTreeWriter(outputFileName, outputTreeName)
+
+            return self._makeOutput(inputTree, outputMaker, firstEvent, maxEvents, progressCallback,
+                                    selection, treeName, fileCallback, numPrefetchFiles)
+
+        #----------
+        # checkpointing
+        #----------
+        if outputFileName == None:
+            raise ValueError("checkpointing needs an output file")
+
+        manifestFileName = outputFileName + ".checkpoint.json"
+
+        config = self.__getCheckpointConfig(inputTree, outputTreeName, firstEvent, maxEvents, selection, treeName)
+
+        manifest = None
+        if resume:
+            manifest = _Checkpointer.readManifest(manifestFileName)
+
+        startEvent = firstEvent
+        numOutputEvents = 0
+
+        if manifest != None:
+            if manifest['config'] != config:
+                raise ValueError("can't resume: the checkpoint in %s was made with different parameters" % manifestFileName)
+
+            if manifest['finished']:
+                # nothing left to do
+                return None
+
+            # find out whether the last checkpoint was completed
+            numSavedEvents = self.__getNumSavedEvents(outputFileName, outputTreeName)
+
+            for state in (manifest['completed'], manifest['pending']):
+                if state != None and state['numOutputEvents'] == numSavedEvents:
+                    startEvent = state['end']
+                    numOutputEvents = numSavedEvents
+                    break
+            else:
+                raise IOError("can't resume: output tree has %d entries which does not correspond to a checkpoint in %s" %
+                              (numSavedEvents, manifestFileName))
+
+        # (when nothing was written to the output tree yet,
+        # it is simply recreated)
+        outputMaker = _RootTreeWriter(outputFileName, outputTreeName, resume = numOutputEvents > 0, checkpoints = True)
+
+        checkpointer = _Checkpointer(manifestFileName, checkpointInterval, config, firstEvent, numOutputEvents)
+        checkpointer.treeWriter = outputMaker
+
+        if maxEvents != None:
+            maxEvents = max(firstEvent + maxEvents - startEvent, 0)
+
+        retval = self._makeOutput(inputTree, outputMaker, startEvent, maxEvents, progressCallback,
+                                  selection, treeName, fileCallback, numPrefetchFiles, checkpointer)
+
+        checkpointer.finish()
+
+        return retval
+
+    #----------------------------------------
+
+    def __getCheckpointConfig(self, inputTree, outputTreeName, firstEvent, maxEvents, selection, treeName):
+        # @return a description of the processing job, a job can only
+        # be resumed with the same configuration
+        import numpy
+
+        if isinstance(inputTree, (basestring, list, tuple)):
+            inputs = self.__getInputFileNames(inputTree)
+        else:
+            inputs = [ inputTree.GetName() ]
+
+        if selection is not None and not isinstance(selection, basestring):
+            # a boolean mask
+            import hashlib
+            selection = "mask:" + hashlib.sha1(numpy.asarray(selection, dtype = bool).tostring()).hexdigest()
+
+        def typeName(outputType):
+            return numpy.dtype(outputType).str
+
+        return dict(inputs = inputs,
+                    treeName = treeName,
+                    outputTreeName = outputTreeName,
+                    firstEvent = firstEvent,
+                    maxEvents = maxEvents,
+                    selection = selection,
+                    outputVariables = self.varBuilder.outputVarDescriptions + self.spectatorExpressions,
+                    defaultOutputType = typeName(self.defaultOutputType),
+                    outputTypes = dict((name, typeName(outputType)) for name, outputType in self.outputTypes.items()),
+                    )
+
+    #----------------------------------------
+
+    def __getNumSavedEvents(self, outputFileName, outputTreeName):
+        # @return the number of entries of the output tree
+        # saved in the given file
+        import ROOT
+
+        fin = ROOT.TFile.Open(outputFileName)
+        if not fin or fin.IsZombie():
+            raise IOError("can't resume: could not open output file " + outputFileName)
+
+        tree = fin.Get(outputTreeName)
+        if tree:
+            retval = tree.GetEntries()
+        else:
+            retval = 0
+
+        fin.Close()
+
+        return retval
 
     #----------------------------------------
 
     def makeArray(self, inputTree, maxEvents = None,
                   firstEvent = 0,
-                  progressCallback = None):
+                  progressCallback = None,
+                  selection = None,
+                  treeName = None,
+                  fileCallback = None,
+                  numPrefetchFiles = 1):
         """
         :return: a numpy record array with the values of the new variables
         :param: firstEvent is the index of the first event to process (zero based)
+        :param selection: see makeTree(..)
+        :param inputTree, treeName, fileCallback, numPrefetchFiles: see makeTree(..)
         """
 
         outputMaker = _NumpyArrayMaker()
 
-        return self._makeOutput(inputTree, outputMaker, firstEvent, maxEvents, progressCallback)
+        return self._makeOutput(inputTree, outputMaker, firstEvent, maxEvents, progressCallback,
+                                selection, treeName, fileCallback, numPrefetchFiles)
 
-    #----------------------------------------    
+    #----------------------------------------
@@ -16,91 +16,637 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading, time
+
+#----------------------------------------------------------------------
+
+# memory needed to cache one value (float64)
+_bytesPerCachedValue = 8
+
+# approximate memory needed per output value of an event
+_bytesPerOutputValue = 8
+
+#----------------------------------------------------------------------
+
+def _drawBufferToArray(vec, numValues):
+    # @return a numpy array viewing the first numValues values
+    # of the buffer returned by TTree::GetV1()
+    #
+    # note that this buffer is overwritten by the next call
+    # to TTree::Draw(..)
+    import numpy
+
+    if numValues == 0:
+        return numpy.zeros(0)
+
+    if hasattr(vec, 'SetSize'):
+        # PyROOT buffers do not know their size
+        vec.SetSize(numValues)
+    elif hasattr(vec, 'reshape'):
+        # cppyy low level views
+        vec.reshape((numValues,))
+
+    return numpy.frombuffer(vec, dtype = 'f8', count = numValues)
+
+#----------------------------------------------------------------------
+
+class _CacheBatch:
+    # a batch of consecutive events read from the tree
+
+    def __init__(self, begin, end, entries, values, readTime):
+        # @param entries are the indices of the events in values
+        #        (in increasing order) when a selection is applied
+        #        (None otherwise)
+        #
+        # @param values is a 2D float64 array with one row
+        #        per expression and one column per event
+        #
+        # @param readTime is the time it took to read the batch
+
+        self.begin = begin
+        self.end = end
+        self.entries = entries
+        self.values = values
+        self.readTime = readTime
+
+#----------------------------------------------------------------------
+
+class BufferPool:
+    # preallocated arrays with one column per event of a batch, for
+    # values calculated from the values read (e.g. intermediate values
+    # of the function generated by VarBuilder.getBatchFunction()).
+    #
+    # Each array is identified by a name and reused for all batches
+    # instead of allocating new arrays for each batch. The arrays are
+    # allocated for 'capacity' events (the batch size of the TreeReader)
+    # and released when the batch size decreases.
+
+    #----------------------------------------
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+
+        # maps from the name to the 2D array (rows x capacity)
+        self.arrays = {}
+
+    #----------------------------------------
+
+    def setCapacity(self, capacity):
+        # sets the number of events per batch, arrays which
+        # are larger than needed are released
+        self.capacity = int(capacity)
+
+        for name, array in self.arrays.items():
+            if array.shape[1] > self.capacity:
+                del self.arrays[name]
+
+    #----------------------------------------
+
+    def getArray(self, name, numRows, numEvents, dtype = 'f8'):
+        # @return an array with the given number of rows and events
+        # (with undefined contents) which is valid until this
+        # method is called again with the same name
+        import numpy
+
+        array = self.arrays.get(name)
+
+        if array is None or array.shape[0] < numRows or array.shape[1] < numEvents or \
+           array.dtype != numpy.dtype(dtype):
+            array = numpy.empty((numRows, max(numEvents, self.capacity)), dtype = dtype)
+            self.arrays[name] = array
+
+        return array[:numRows, :numEvents]
+
+    #----------------------------------------
+
+    def getBytesPerEvent(self):
+        # @return the memory used by the arrays per event of a batch
+        return sum(array.shape[0] * array.itemsize for array in self.arrays.values())
+
+#----------------------------------------------------------------------
+
+class TreeVariable(object):
+    # handle for an expression read by a TreeReader, returned
+    # by TreeReader.getVar(..)
+
+    __slots__ = ('treeReader', 'index')
+
+    def __init__(self, treeReader, index):
+        # @param index is the position of the expression in the TreeReader
+        self.treeReader = treeReader
+        self.index = index
+
+    def __getitem__(self, item):
+        # @return the value of the expression for the current event
+        #
+        # only item = 0 is meant to be used here (this object replaces
+        # the one-element lists previously returned by getVar(..)),
+        # it is not checked for speed reasons
+        treeReader = self.treeReader
+        return treeReader.cache[self.index, treeReader.currentRow]
+
+    def getValue(self):
+        # @return the value of the expression for the current event
+        return self[0]
+
+    def getBatch(self):
+        # @return a view of the values of the expression for all events
+        # of the batch containing the current event
+        return self.treeReader.cache[self.index]
+
+#----------------------------------------------------------------------
+
 class TreeReader:
     # class for reading multiple expressions from a ROOT tree in batches of multiple events
 
     #----------------------------------------
 
-    def __init__(self, tree, readBatchSize = 10000):
+    def __init__(self, tree, readBatchSize = 10000, selection = None, prefetchDepth = 0,
+                 memoryBudget = None, numOutputColumns = 0, targetBatchTime = 0.5,
+                 minBatchSize = 100, treeLock = None):
         # @param readBatchSize is the number of events which
         #        are read in a batch
+        #
+        # @param selection if not None, only events passing this selection
+        #        are read into the cache. This can either be a ROOT tree
+        #        expression (passed as selection string to TTree::Draw(..))
+        #        or a numpy boolean array with one entry per event in the tree
+        #
+        # @param prefetchDepth if larger than zero, a background thread
+        #        reads up to this number of batches ahead of the batch
+        #        currently being processed
+        #
+        # @param memoryBudget if not None, the number of bytes the
+        #        batches in memory may occupy. The batch size is then
+        #        chosen automatically: readBatchSize is only used as
+        #        initial value and adapted after each batch such that
+        #        reading a batch takes about targetBatchTime seconds,
+        #        while staying within the budget given the number of
+        #        expressions read, the number of output columns and
+        #        the number of batches held in memory at the same time.
+        #        minBatchSize is the smallest batch size used.
+        #
+        # @param numOutputColumns is the number of values per event
+        #        produced from the values read (see setNumOutputColumns(..))
+        #
+        # @param treeLock if not None, the lock held while reading from
+        #        the tree. Readers of different trees used from different
+        #        threads must share a lock when ROOT is not thread safe.
 
         self.tree = tree
         self.readBatchSize = int(readBatchSize)
 
         self.numEvents = tree.GetEntries()
 
+        self.selectionExpr = None
+        self.selectionMask = None
+
+        if isinstance(selection, basestring):
+            self.selectionExpr = selection
+        elif selection is not None:
+            import numpy
+            self.selectionMask = numpy.asarray(selection, dtype = bool)
+
+            if len(self.selectionMask) != self.numEvents:
+                raise ValueError("selection mask has %d entries but the tree has %d events" % (
+                    len(self.selectionMask), self.numEvents))
+
+        # the range of events and the events in it passing the selection
+        # (begin, end, entries) found by the last call to getSelectedEntries(..)
+        self.selectedEntries = None
+
         # the expressions we want to read from a tree
         self.expressions = []
 
-        # the float buffers (lists) corresponding to the expressions
-        self.buffers = []
+        # the TreeVariable objects corresponding to the expressions
+        self.variables = []
 
-        # arrays to read from the tree
-        self.cache = []
+        # the values of the expressions for the events in the cache
+        # (one row per expression, one column per event)
+        self.cache = None
         
         # the first and last + 1 event in the cache
         self.cacheBegin = None
         self.cacheEnd = None
 
-        # the currently loaded event
+        # the indices of the events in the cache when a selection
+        # is applied (None otherwise)
+        self.cacheEntries = None
+
+        # the currently loaded event and its column in the cache
         self.currentEvent = None
+        self.currentRow = None
+
+        #----------
+        # reading ahead
+        #----------
+        self.prefetchDepth = int(prefetchDepth)
+
+        #----------
+        # batch size
+        #----------
+        self.memoryBudget = memoryBudget
+        self.numOutputColumns = int(numOutputColumns)
+        self.targetBatchTime = float(targetBatchTime)
+        self.minBatchSize = int(minBatchSize)
+
+        # arrays for values calculated for the events of a batch
+        self.bufferPool = BufferPool(self.readBatchSize)
+
+        if self.memoryBudget != None:
+            self.readBatchSize = min(self.readBatchSize, self.getMaxBatchSize())
+            self.bufferPool.setCapacity(self.readBatchSize)
+
+        # batches are read ahead up to this event
+        self.readRangeEnd = self.numEvents
+
+        self.prefetchThread = None
+        self.prefetchQueue = None
+        self.prefetchStop = None
+
+        # the first event of the next batch to be taken from
+        # the prefetch queue
+        self.prefetchNext = None
+
+        # TTree::Draw(..) must not be called from two threads
+        # at the same time
+        if treeLock == None:
+            treeLock = threading.Lock()
+
+        self.treeLock = treeLock
+
+        #----------
+        # statistics
+        #----------
+
+        # time spent waiting for a batch to be read
+        self.ioWaitTime = 0.
+
+        # time spent reading batches (in any thread)
+        self.readTime = 0.
+
+        self.numBatchesRead = 0
+
+        # number of calls to getEvent(..) and the number of
+        # these which did not find the event in the cache
+        self.numEventLookups = 0
+        self.numBatchLoads = 0
 
 
     #----------------------------------------
 
     def getVar(self, expression):
 
-        # @return a variable which will hold the given expression
-        # whenever a new event is read
-        # 
-        # this will return a list with one float variable which will
-        # be updated by this class (there are no references for
-        # floats in python)
+        # @return a TreeVariable object giving access to the value
+        # of the given expression for the current event (var[0])
+        # or all events of the current batch (var.getBatch())
         #
         try:
             index = self.expressions.index(expression)
 
             # if we come here, the expression exists already
-            return self.buffers[index]
+            return self.variables[index]
 
         except ValueError:
-            # expression is not yet there, reserve a new buffer
-
-            # TODO: check that this is not happening after we
-            #       have read events (or we would have to
-            #       invalidate the buffers we read already)
+            # expression is not yet there, reserve a new row in the cache
 
             self.expressions.append(expression)
-            self.buffers.append([ 0. ])
+            self.variables.append(TreeVariable(self, len(self.expressions) - 1))
+
+            # batches read so far do not contain the new expression
+            self.__invalidateCache()
+
+            if self.memoryBudget != None:
+                self.readBatchSize = min(self.readBatchSize, self.getMaxBatchSize())
+
+            return self.variables[-1]
+
+    #----------------------------------------
+
+    def setNumOutputColumns(self, numOutputColumns):
+        # sets the number of values calculated per event from the
+        # values read, used to determine the batch size
+        # when a memory budget is given
+        self.numOutputColumns = int(numOutputColumns)
+
+        if self.memoryBudget != None:
+            self.readBatchSize = min(self.readBatchSize, self.getMaxBatchSize())
+
+    #----------------------------------------
+
+    def getMaxBatchSize(self):
+        # @return the largest batch size fitting into the memory budget
+        # (None if no budget was given)
+
+        if self.memoryBudget == None:
+            return None
+
+        bytesPerEvent = len(self.expressions) * _bytesPerCachedValue + \
+                        self.numOutputColumns * _bytesPerOutputValue + \
+                        self.bufferPool.getBytesPerEvent()
+
+        # the batch being processed, the batches in the prefetch
+        # queue and the batch being read by the prefetching thread
+        if self.prefetchDepth > 0:
+            numBatches = self.prefetchDepth + 2
+        else:
+            numBatches = 1
+
+        retval = int(self.memoryBudget / float(max(bytesPerEvent, 1) * numBatches))
+
+        return max(retval, self.minBatchSize)
+
+    #----------------------------------------
+
+    def __adaptBatchSize(self, numEvents, elapsed):
+        # adapts the batch size given the time it took to read
+        # a batch of numEvents events
+        if self.memoryBudget == None or numEvents < self.readBatchSize or elapsed <= 0:
+            # fixed batch size or not a full batch
+            return
+
+        # aim for reading a batch in targetBatchTime: larger batches
+        # amortize the overhead per TTree::Draw(..) call, smaller
+        # ones reduce the latency when reading ahead.
+        # Change the size by at most a factor two at a time.
+        factor = min(max(self.targetBatchTime / elapsed, 0.5), 2.0)
+
+        newSize = int(self.readBatchSize * factor)
+        newSize = min(newSize, self.getMaxBatchSize())
+        newSize = max(newSize, self.minBatchSize)
+
+        self.readBatchSize = newSize
 
-            # add a buffer for reading from the tree
-            self.cache.append([ 0. ] * self.readBatchSize)
+    #----------------------------------------
+
+    def __invalidateCache(self):
+        self.__stopPrefetch()
+
+        self.cache = None
+        self.cacheBegin = None
+        self.cacheEnd = None
+        self.cacheEntries = None
+        self.currentEvent = None
+        self.currentRow = None
+
+    #----------------------------------------
+
+    def hasSelection(self):
+        return self.selectionExpr != None or self.selectionMask is not None
+
+    #----------------------------------------
 
-            return self.buffers[-1]
+    def __readSelectedEntries(self, begin, end):
+        # @return an array with the indices of the events in [begin, end)
+        # passing the selection
+        import numpy
+
+        selectedEntries = self.selectedEntries
+
+        if selectedEntries != None and selectedEntries[0] <= begin and end <= selectedEntries[1]:
+            # the selection was already evaluated for these events
+            entries = selectedEntries[2]
+            return entries[entries.searchsorted(begin):entries.searchsorted(end)]
+
+        if self.selectionExpr != None:
+            with self.treeLock:
+                self.tree.Draw("Entry$", self.selectionExpr, "goff",
+                               end - begin,
+                               begin)
+
+                return _drawBufferToArray(self.tree.GetV1(), self.tree.GetSelectedRows()).astype('i8')
+
+        elif self.selectionMask is not None:
+            return begin + self.selectionMask[begin:end].nonzero()[0]
+
+        else:
+            return numpy.arange(begin, end)
 
     #----------------------------------------
 
-    def __fillCache(self, begin, end):
+    def getSelectedEntries(self, begin, end):
+        # @return an array with the indices of the events in [begin, end)
+        # passing the selection (all events in this range if no
+        # selection was given)
+        #
+        # this reads only the selection expression, in batches
+        # of readBatchSize events
+        import numpy
+
+        if not self.hasSelection():
+            return numpy.arange(begin, max(begin, end))
+
+        parts = [ numpy.zeros(0, dtype = 'i8') ]
+        for batchBegin in range(begin, end, self.readBatchSize):
+            batchEnd = min(batchBegin + self.readBatchSize, end)
+            parts.append(self.__readSelectedEntries(batchBegin, batchEnd))
+
+        retval = numpy.concatenate(parts)
+
+        # keep them for reading the batches
+        self.selectedEntries = (begin, end, retval)
+
+        return retval
+
+    #----------------------------------------
+
+    def __readBatch(self, begin, end, expressions):
+        # reads the given expressions for the events in [begin, end)
+        #
+        # @return a _CacheBatch object
+        #
+        # this may be called from the prefetching thread, so it
+        # must not modify the state of this object (the statistics
+        # and the batch size are updated by __batchLoaded(..)
+        # when the consumer takes the batch)
+
+        import numpy
+
         numEvents = end - begin
         assert numEvents >= 0
 
-        for index, expr in enumerate(self.expressions):
-            self.tree.Draw(expr, "", "goff",
-                           numEvents,
-                           begin)
-            
-            vec = self.tree.GetV1()
-            for i in range(numEvents):
-                self.cache[index][i] = vec[i]
+        startTime = time.time()
+
+        if self.hasSelection():
+            entries = self.__readSelectedEntries(begin, end)
+            numRows = len(entries)
+        else:
+            entries = None
+            numRows = numEvents
+
+        values = numpy.empty((len(expressions), numRows))
+
+        # the range of events to read from the tree: with a selection
+        # only the range spanned by the selected events is read (e.g.
+        # the blocks of events sampled by a selection mask) and the
+        # selected events are taken from the values read, instead of
+        # evaluating the selection again for each expression
+        drawBegin, drawEnd = begin, end
+
+        if entries is not None:
+            if numRows > 0:
+                drawBegin, drawEnd = entries[0], entries[-1] + 1
+            else:
+                drawBegin = drawEnd = begin
+
+        with self.treeLock:
+            if drawEnd > drawBegin:
+                for index, expr in enumerate(expressions):
+                    self.tree.Draw(expr, "", "goff",
+                                   drawEnd - drawBegin,
+                                   drawBegin)
+
+                    vec = _drawBufferToArray(self.tree.GetV1(), drawEnd - drawBegin)
+                    if entries is not None:
+                        values[index] = vec[entries - drawBegin]
+                    else:
+                        values[index] = vec
+
+        return _CacheBatch(begin, end, entries, values, time.time() - startTime)
+
+    #----------------------------------------
+
+    def __batchLoaded(self, batch):
+        # called (in the consumer thread) for each batch read
+        self.readTime += batch.readTime
+        self.numBatchesRead += 1
+
+        self.__adaptBatchSize(batch.end - batch.begin, batch.readTime)
+
+    #----------------------------------------
+
+    def setReadRange(self, begin, end):
+        # tells this reader that only events in [begin, end) will
+        # be requested (in increasing order), so no batches
+        # beyond 'end' are read ahead
+        #
+        # (begin is currently not used)
+
+        end = min(end, self.numEvents)
+
+        if end != self.readRangeEnd:
+            self.__stopPrefetch()
+            self.readRangeEnd = end
+
+    #----------------------------------------
+
+    def __prefetch(self, begin, expressions, queue, stop):
+        # runs in the prefetching thread: reads consecutive
+        # batches starting at 'begin'
+        import Queue
+
+        def put(item):
+            # wait until the consumer has space for this item
+            # or reading ahead is stopped
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout = 0.1)
+                    return
+                except Queue.Full:
+                    pass
 
-        self.cacheBegin = begin
-        self.cacheEnd = end
+        try:
+            while begin < self.readRangeEnd and not stop.is_set():
+                # (the batch size may be changed by the consumer
+                # thread, the next batch then has the new size)
+                end = min(begin + self.readBatchSize, self.numEvents)
+                put((self.__readBatch(begin, end, expressions), None))
+
+                begin = end
+
+        except Exception:
+            # pass the exception to the consumer
+            import sys
+            put((None, sys.exc_info()))
+
+    #----------------------------------------
+
+    def __startPrefetch(self, begin):
+        self.__stopPrefetch()
+
+        import Queue
+
+        self.prefetchQueue = Queue.Queue(maxsize = self.prefetchDepth)
+        self.prefetchStop = threading.Event()
+        self.prefetchNext = begin
+
+        self.prefetchThread = threading.Thread(target = self.__prefetch,
+                                               args = (begin, list(self.expressions),
+                                                       self.prefetchQueue, self.prefetchStop))
+        self.prefetchThread.daemon = True
+        self.prefetchThread.start()
+
+    #----------------------------------------
+
+    def __stopPrefetch(self):
+        if self.prefetchThread == None:
+            return
+
+        self.prefetchStop.set()
+        self.prefetchThread.join()
+
+        self.prefetchThread = None
+        self.prefetchQueue = None
+        self.prefetchStop = None
+        self.prefetchNext = None
+
+    #----------------------------------------
+
+    def close(self):
+        # stops reading ahead
+        self.__stopPrefetch()
+
+    #----------------------------------------
+
+    def __loadBatch(self, eventIndex):
+        # @return the batch containing the given event
+
+        if self.memoryBudget == None:
+            start = (eventIndex // self.readBatchSize) * self.readBatchSize
+        else:
+            # the batch size changes, so batches are not aligned
+            start = eventIndex
+
+        if self.prefetchDepth > 0 and eventIndex < self.readRangeEnd:
+
+            if self.prefetchThread == None or eventIndex < self.prefetchNext:
+                # (re)start reading ahead from the batch containing this event
+                self.__startPrefetch(start)
+
+            while True:
+                startTime = time.time()
+                batch, excInfo = self.prefetchQueue.get()
+                self.ioWaitTime += time.time() - startTime
+
+                if excInfo != None:
+                    self.__stopPrefetch()
+                    raise excInfo[0], excInfo[1], excInfo[2]
+
+                self.prefetchNext = batch.end
+                self.__batchLoaded(batch)
+
+                if batch.end > eventIndex:
+                    return batch
+
+                # the caller has skipped this batch
+
+        # read synchronously
+        end = min(start + self.readBatchSize, self.numEvents)
+
+        startTime = time.time()
+        batch = self.__readBatch(start, end, self.expressions)
+        self.ioWaitTime += time.time() - startTime
+
+        self.__batchLoaded(batch)
+
+        return batch
 
     #----------------------------------------
 
     def getEvent(self, eventIndex):
-        # fills the buffers with the event given by 'index'
+        # makes the event given by 'index' the current event
+
+        self.numEventLookups += 1
 
         # avoid getting the same event multiple times
         if self.currentEvent == eventIndex:
@@ -109,22 +655,66 @@ class TreeReader:
         # check if we have the event in the cache
         if self.cacheBegin == None or not (eventIndex >= self.cacheBegin and eventIndex < self.cacheEnd):
             # must fill the cache
-            start = (eventIndex // self.readBatchSize) * self.readBatchSize
-            end = (eventIndex // self.readBatchSize + 1) * self.readBatchSize
-            end = min(end, self.numEvents)
-            
-            self.__fillCache(start, end)
+            self.numBatchLoads += 1
+            batch = self.__loadBatch(eventIndex)
+
+            self.cache = batch.values
+            self.cacheBegin = batch.begin
+            self.cacheEnd = batch.end
+            self.cacheEntries = batch.entries
+
+            if self.memoryBudget != None:
+                # release the buffers when the batch size decreased
+                self.bufferPool.setCapacity(self.readBatchSize)
+
+        # find the event in the cache
+        if self.cacheEntries is not None:
+            row = self.cacheEntries.searchsorted(eventIndex)
+            if row >= len(self.cacheEntries) or self.cacheEntries[row] != eventIndex:
+                raise ValueError("event %d does not pass the selection" % eventIndex)
+        else:
+            row = eventIndex - self.cacheBegin
+
+        # the TreeVariable objects read from this column
+        self.currentRow = row
+        self.currentEvent = eventIndex
 
-        # fill the event
-        relIndex = eventIndex - self.cacheBegin
+    #----------------------------------------
 
-        # copy a line of our internal buffer 
-        # to 
-        for index in range(len(self.buffers)):
-            self.buffers[index][0] = self.cache[index][relIndex]
+    def getBatchRows(self, entries):
+        # @return the columns in the cache (see TreeVariable.getBatch())
+        # of the given events which must all be in the current batch,
+        # as slice if they are consecutive
+        import numpy
 
-        self.currentEvent = eventIndex
+        if self.cacheEntries is not None:
+            rows = self.cacheEntries.searchsorted(entries)
+            if len(rows) > 0 and (rows[-1] >= len(self.cacheEntries) or
+                                  numpy.any(self.cacheEntries[rows] != entries)):
+                raise ValueError("not all events pass the selection")
+        else:
+            rows = numpy.asarray(entries) - self.cacheBegin
 
+        if len(rows) == 0:
+            return slice(0, 0)
+
+        if rows[0] < 0 or rows[-1] >= self.cache.shape[1]:
+            raise ValueError("not all events are in the current batch")
+
+        if rows[-1] - rows[0] + 1 == len(rows):
+            return slice(rows[0], rows[-1] + 1)
+
+        return rows
 
     #----------------------------------------
 
+    def getStats(self):
+        # @return a dict with statistics about reading from the tree
+        return dict(ioWaitTime = self.ioWaitTime,
+                    readTime = self.readTime,
+                    numBatchesRead = self.numBatchesRead,
+                    readBatchSize = self.readBatchSize,
+                    numEventLookups = self.numEventLookups,
+                    numBatchLoads = self.numBatchLoads)
+
+    #----------------------------------------
@@ -17,10 +17,17 @@
 # limitations under the License.
 
 
-from .functions import *
+from . import functions
 
-from .kinvarbuilder import makePartitions, IllegalArgumentTypes
-from VectorSum import VectorSum
+from .kinvarbuilder import makePartitions, IllegalArgumentTypes, acceptsArguments, getSymmetry
+import itertools
+from VectorSum import VectorSum, sumIsFourVector
+from FourVector import FourVector
+from TransverseVector import TransverseVector
+
+# version of the format of the graph specification
+# (see VarBuilder.getGraphSpec())
+graphSpecVersion = 1
 
 class VarBuilder:
     """ creates the new variables given a list of fourvectors
@@ -28,9 +35,15 @@ class VarBuilder:
 
     #----------------------------------------
 
-    def __init__(self, inputVectors, initialStateZcomponentKnown, listOfFunctions = None):
+    def __init__(self, inputVectors, initialStateZcomponentKnown, listOfFunctions = None,
+                 loadPlugins = False):
         # @param initialStateZcomponentKnown is typically set to true for lepton
         # colliders and false for hadron colliders
+        #
+        # @param loadPlugins if True, functions provided by other packages
+        # through the 'kinvarbuilder.functions' entry point are loaded
+        # (see functions.loadPlugins()). Functions registered with
+        # functions.registerFunction(..) are added to the default list of functions.
 
         self.inputVectors = inputVectors
         self.initialStateZcomponentKnown = initialStateZcomponentKnown
@@ -45,12 +58,12 @@ class VarBuilder:
             # compile the list of functions to be applied
             self.listOfFunctions.extend(
                 [
-                Mass,        # should NOT be used on single vectors ?
+                functions.Mass,        # should NOT be used on single vectors ?
                 ### funcPt,      # should NOT be used on single vectors ?
 
-                DeltaPhi,
+                functions.DeltaPhi,
 
-                PtOverMass,
+                functions.PtOverMass,
 
                 ]
             )
@@ -61,7 +74,7 @@ class VarBuilder:
                 #----------
 
                 self.listOfFunctions.extend([
-                    Angle3D,
+                    functions.Angle3D,
                 ])
 
             else:
@@ -70,34 +83,105 @@ class VarBuilder:
                 #----------
 
                 self.listOfFunctions.extend([
-                    AbsDeltaEta,
-                    DeltaR,
+                    functions.AbsDeltaEta,
+                    functions.DeltaR,
                     ### AbsEta,
 
-                    SumPt,
+                    functions.SumPt,
 
-                    TransverseMass,
+                    functions.TransverseMass,
 
-                    MeanEta,
+                    functions.MeanEta,
 
                 ])
 
+            #----------
+            # functions provided by other packages
+            #----------
+            if loadPlugins:
+                functions.loadPlugins()
+
+            self.listOfFunctions.extend(functions.getPluginFunctions())
+
     #----------------------------------------
 
-    def makeDerived(self):
+    def __getVectorSum(self, group):
+        # @return the VectorSum object for the given group of
+        # indices of input vectors (created only once per group such that
+        # it is calculated only once per event)
+        key = tuple(group)
+
+        vectorSum = self.vectorSums.get(key)
+        if vectorSum == None:
+            vectorSum = VectorSum([ self.inputVectors[index] for index in group ])
+            self.vectorSums[key] = vectorSum
+
+        return vectorSum
+
+    #----------------------------------------
+
+    def __addOutput(self, func, arguments):
+        # creates an output variable applying the given function to the
+        # sums of the given groups of input vector indices
+        #
+        # raises IllegalArgumentTypes if the function does not accept
+        # these arguments
+        self.outputScalars.append(func(*[ self.__getVectorSum(group) for group in arguments ]))
+
+        self.outputFunctions.append(func)
+        self.outputArguments.append(tuple(tuple(group) for group in arguments))
+
+    #----------------------------------------
+
+    def __setOutputNames(self):
+        self.outputVarnames = [ "out%02d" % index for index in range(len(self.outputScalars))]
+
+        self.outputVarDescriptions = [ str(outputScalar) for outputScalar in self.outputScalars ]
+
+    #----------------------------------------
+
+    def makeDerived(self, dropRedundant = True):
         # can also be called after the list of functions was customized by the caller
+        #
+        # each output variable is produced once: functions which are symmetric
+        # or antisymmetric under exchange of their arguments are only applied
+        # to one (canonical) order of the arguments, functions depending
+        # on the order of their arguments or not declaring their symmetry
+        # are applied to all orders (see getSymmetry(..)).
+        #
+        # @param dropRedundant if True, functions declaring to be a function of
+        #        another function in the list of functions (class attribute
+        #        'functionOf', e.g. AbsDeltaEta of DeltaEta) are not applied
 
         # TODO: should we support things like sum of scalars (e.g. sums of pts) ?
 
+        functionNames = set(func.__name__ for func in self.listOfFunctions)
+
         self.outputScalars = []
 
+        # the function and the groups of input vector indices
+        # (one per argument) of each output
+        self.outputFunctions = []
+        self.outputArguments = []
+
+        # VectorSum objects created so far
+        self.vectorSums = {}
+
         # maps from the number of subgroups to the list of partitions of this size
+        # for which all groups of vectors can be summed, together with
+        # the argument types (see acceptsArguments(..)) of the sums
         nSizedPartitions = {}
 
         # for vectorCombination in allVectorCombinations:
 
         for func in self.listOfFunctions:
 
+            if dropRedundant and getattr(func, 'functionOf', None) in functionNames:
+                # exactly calculable from another output
+                continue
+
+            symmetry = getSymmetry(func)
+
             # see how many vector (sums) this function wants
             numArgumentsList = func.getNumArguments(len(self.inputVectors))
 
@@ -105,45 +189,201 @@ class VarBuilder:
 
                 if not nSizedPartitions.has_key(numArguments):
                     # create all possible partitions with numArguments groups
-                    # and create sums of these
-                    groups = makePartitions(self.inputVectors, numArguments)
-
-                    for line in groups:
-                        print line
-
-                    # produce vector sums of these
+                    #
+                    # we partition the indices of the input vectors such
+                    # that the order of the groups (which is the canonical
+                    # order of the arguments) does not depend on the memory
+                    # addresses of the vector objects
+                    #
                     # note that some combinations of vectors
-                    # are not allowed
-                    sums = []
-                    for line in groups:
-                        thisLine = []
+                    # can not be summed
+                    partitions = []
+                    for line in makePartitions(range(len(self.inputVectors)), numArguments):
                         try:
-                            for group in line:
-                                thisLine.append(VectorSum(group))
-                        except IllegalArgumentTypes,ex:
-                            thisLine = None
+                            argumentTypes = [ (sumIsFourVector([ self.inputVectors[index] for index in group ]), len(group))
+                                              for group in line ]
+                        except IllegalArgumentTypes:
+                            continue
 
-                        if thisLine != None:
-                            sums.append(thisLine)
+                        partitions.append((line, argumentTypes))
 
-                    nSizedPartitions[numArguments] = sums
-                else:
-                    sums = nSizedPartitions[numArguments]
+                    nSizedPartitions[numArguments] = partitions
 
                 # create a function for these
 
-                for line in sums:
+                for line, argumentTypes in nSizedPartitions[numArguments]:
 
-                    try:
-                        self.outputScalars.append(func(*line))
-                    except IllegalArgumentTypes:
-                        # this function can not be applied to the given set of vectors
-                        pass
+                    # check the constraints declared by the function
+                    # before creating any objects
+                    if not acceptsArguments(func, argumentTypes):
+                        continue
+
+                    if symmetry == 'ordered':
+                        argumentLists = itertools.permutations(line)
+                    else:
+                        argumentLists = [ line ]
+
+                    for arguments in argumentLists:
+                        try:
+                            self.__addOutput(func, arguments)
+                        except IllegalArgumentTypes:
+                            # this function can not be applied to the given set of vectors
+                            pass
 
             # end of loop over possible number of arguments of the current function
 
         # end of loop over functions to apply to the vector combinations
 
-        self.outputVarnames = [ "out%02d" % index for index in range(len(self.outputScalars))]
+        self.__setOutputNames()
 
-        self.outputVarDescriptions = [ str(outputScalar) for outputScalar in self.outputScalars ]
+    #----------------------------------------
+
+    def getGraphSpec(self):
+        # @return a description of the input vectors, the sums of vectors and
+        # the output variables (the function and the sums it is applied to)
+        # from which the same VarBuilder can be created again (see fromGraphSpec(..)).
+        #
+        # The description only contains lists, dicts, strings and numbers
+        # (i.e. it can be written as JSON) and does not depend on the
+        # input tree. It is e.g. sent to worker processes instead of
+        # the VarBuilder itself.
+        #
+        # The output variables are None if makeDerived() was not called yet.
+        # Their names are included such that they are kept e.g. for a subset
+        # of the variables (see getSubset(..)).
+
+        retval = dict(version = graphSpecVersion,
+                      initialStateZcomponentKnown = self.initialStateZcomponentKnown,
+                      inputs = [ vector.getSpec() for vector in self.inputVectors ],
+                      functions = [ functions.getFunctionName(func) for func in self.listOfFunctions ],
+                      sums = None,
+                      outputs = None,
+                      )
+
+        if hasattr(self, 'outputScalars'):
+            # the groups of input vectors summed, in the order they
+            # are first used by the outputs
+            sumIndices = {}
+            sums = []
+
+            outputs = []
+
+            for func, arguments, name in zip(self.outputFunctions, self.outputArguments, self.outputVarnames):
+                for group in arguments:
+                    if not group in sumIndices:
+                        sumIndices[group] = len(sums)
+                        sums.append(list(group))
+
+                outputs.append(dict(function = functions.getFunctionName(func),
+                                    arguments = [ sumIndices[group] for group in arguments ],
+                                    name = name))
+
+            retval['sums'] = sums
+            retval['outputs'] = outputs
+
+        return retval
+
+    #----------------------------------------
+
+    def getGraphHash(self):
+        # @return a hash of the graph specification (see getGraphSpec()),
+        # e.g. to be used as key for caching results
+        import hashlib, json
+
+        return hashlib.sha1(json.dumps(self.getGraphSpec(), sort_keys = True)).hexdigest()
+
+    #----------------------------------------
+
+    def getBatchFunction(self):
+        # @return a function calculating the output variables for all
+        # events of a batch at once, generated from the graph of input
+        # vectors, sums and functions (see BatchFunction.py).
+        #
+        # The most recently used generated functions are cached by the
+        # graph hash (see BatchFunction.maxCachedBatchFunctions), the source
+        # code can be inspected in the attribute 'source' of the returned object.
+        from .BatchFunction import getBatchFunction
+
+        return getBatchFunction(self)
+
+    #----------------------------------------
+
+    def getSubset(self, outputIndices):
+        # @return a VarBuilder with the same input vectors calculating
+        # only the output variables with the given indices (e.g. to
+        # calculate only the most promising variables on more events)
+        #
+        # The output variables keep their names.
+        spec = self.getGraphSpec()
+
+        spec['outputs'] = [ spec['outputs'][index] for index in outputIndices ]
+
+        return VarBuilder.fromGraphSpec(spec)
+
+    #----------------------------------------
+
+    @staticmethod
+    def fromGraphSpec(spec):
+        # creates a VarBuilder from the description returned by getGraphSpec()
+        # (without searching for the combinations of vectors again)
+        #
+        # @param spec can also be given as JSON string
+        import json
+
+        if isinstance(spec, basestring):
+            spec = json.loads(spec)
+
+        if spec['version'] != graphSpecVersion:
+            raise ValueError("unsupported graph specification version %s" % str(spec['version']))
+
+        inputVectors = [ _makeInputVector(inputSpec) for inputSpec in spec['inputs'] ]
+
+        retval = VarBuilder(inputVectors, spec['initialStateZcomponentKnown'],
+                            listOfFunctions = [ functions.getFunction(name) for name in spec['functions'] ])
+
+        if spec['outputs'] != None:
+            retval.outputScalars = []
+            retval.outputFunctions = []
+            retval.outputArguments = []
+            retval.vectorSums = {}
+
+            for output in spec['outputs']:
+                retval.__addOutput(functions.getFunction(output['function']),
+                                   [ spec['sums'][index] for index in output['arguments'] ])
+
+            retval.__setOutputNames()
+
+            # (specifications written before the names
+            # were added are numbered as by makeDerived())
+            if all('name' in output for output in spec['outputs']):
+                retval.outputVarnames = [ str(output['name']) for output in spec['outputs'] ]
+
+        return retval
+
+    #----------------------------------------
+
+    def __getstate__(self):
+        # pickle the graph specification only (the input vectors and
+        # functions hold values of the last event and references
+        # to the tree reader)
+        return dict(graphSpec = self.getGraphSpec())
+
+    def __setstate__(self, state):
+        other = VarBuilder.fromGraphSpec(state['graphSpec'])
+        self.__dict__.update(other.__dict__)
+
+#----------------------------------------------------------------------
+
+def _makeInputVector(inputSpec):
+    # @return the input vector for the given description
+    # (see FourVector.getSpec() and TransverseVector.getSpec())
+    inputSpec = dict((str(key), value) for key, value in inputSpec.items())
+
+    vectorType = inputSpec.pop('type')
+
+    if vectorType == 'FourVector':
+        return FourVector(**inputSpec)
+    elif vectorType == 'TransverseVector':
+        return TransverseVector(**inputSpec)
+    else:
+        raise ValueError("unknown input vector type '%s'" % vectorType)
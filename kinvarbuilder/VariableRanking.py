@@ -20,92 +20,402 @@
 
 import sys, os
 
+import SeparationMetrics
+
+#----------------------------------------------------------------------
+
 def maxCumulativeDifference(valuesSig, valuesBkg, weightsSig, weightsBkg):
-    # from scipy.stats import ks_2samp
+    # @return the maximum difference between the weighted cumulative
+    # distributions of signal and background (i.e. the Kolmogorov-Smirnov
+    # distance, the 'ks' metric of SeparationMetrics.calcMetrics(..))
+    sortedSamples = SeparationMetrics.SortedSamples(valuesSig, valuesBkg)
+
+    return float(SeparationMetrics._CumulativeDistributions(sortedSamples, weightsSig, weightsBkg).ks()[0])
+
+#----------------------------------------------------------------------
+
+def _weightedRanks(values, weights):
+    # @return the weighted mid-ranks of the given values: the sum of the
+    # weights of all smaller values plus half the sum of the weights
+    # of all equal values
+    import numpy
+
+    order = numpy.argsort(values, kind = 'mergesort')
+    sortedValues = values[order]
+    sortedWeights = weights[order]
+
+    cumWeights = numpy.cumsum(sortedWeights)
 
-    # there seems NOT to be a Kolmogorov-Smirnov test for weighted
-    # samples in python but since all variables have the same
-    # number of values, we just can compare the difference in the cumulative
-    # distribution for the moment
+    # first and last position of each group of equal values
+    isGroupStart = numpy.ones(len(values), dtype = bool)
+    isGroupStart[1:] = sortedValues[1:] != sortedValues[:-1]
 
-    # calculate the weighted cumulative distributions
+    groupIndex = numpy.cumsum(isGroupStart) - 1
+    groupStarts = isGroupStart.nonzero()[0]
+    groupEnds = numpy.append(groupStarts[1:], len(values)) - 1
 
-    # sortedValuesSig, sortedSumWeightsSig = cumulativeSum(valuesSig, weightsSig)
-    # sortedValuesBkg, sortedSumWeightsBkg = cumulativeSum(valuesBkg, weightsBkg)
+    # sum of weights before the group and up to the end of the group
+    weightBefore = cumWeights[groupStarts] - sortedWeights[groupStarts]
+    weightUpToEnd = cumWeights[groupEnds]
 
-    sumWeightsSig = sum(weightsSig)
-    sumWeightsBkg = sum(weightsBkg)
+    retval = numpy.empty(len(values))
+    retval[order] = (0.5 * (weightBefore + weightUpToEnd))[groupIndex]
 
-    numEventsSig = len(valuesSig)
-    numEventsBkg = len(valuesBkg)
+    return retval
 
-    # see also scipy.ks_2samp(..)
-    # make a combined list of all data points
+#----------------------------------------------------------------------
+
+def _standardizedColumns(columns, weights, method):
+    # @return a 2D array (one column per input column) with the
+    # columns centered, scaled to unit weighted variance and multiplied
+    # by sqrt(weight / sum of weights) such that Z^T Z is the
+    # weighted correlation matrix of the columns
     #
-    # since we also have to keep track of the weights, we work with indices
-    # note that both samples need not to have the same number of entries,
-    # so we work with a scheme where the indices are:
-    #   0 .. numEventsSig - 1                           : signal events
-    #   numEventsSig .. numEventsSig + numEventsBkg - 1 : background events
-
-    def isSignal(index):
-        return index < numEventsSig
-
-    def getValue(index):
-        if index < numEventsSig:
-            return valuesSig[index]
-        else:
-            return valuesBkg[index - numEventsSig]
+    # undefined (nan) values are replaced by the weighted mean
+    # of the column, i.e. they do not contribute to the correlation
+    import numpy
+
+    sumWeights = float(weights.sum())
+    sqrtWeights = numpy.sqrt(weights / sumWeights)
+
+    retval = numpy.empty((len(weights), len(columns)))
+
+    for index, column in enumerate(columns):
+        values = numpy.array(column, dtype = 'f8')
+
+        isDefined = numpy.isfinite(values)
+
+        if method == 'rank':
+            # Spearman's rank correlation: Pearson's correlation
+            # of the (weighted) ranks
+            values[isDefined] = _weightedRanks(values[isDefined], weights[isDefined])
+        elif method != 'pearson':
+            raise ValueError("unknown correlation method '%s'" % method)
 
-    def getWeight(index):
-        if index < numEventsSig:
-            return weightsSig[index]
+        definedWeights = weights[isDefined]
+        if definedWeights.sum() > 0:
+            mean = numpy.average(values[isDefined], weights = definedWeights)
         else:
-            return weightsBkg[index - numEventsSig]
+            mean = 0.
 
-    indices = range(numEventsSig + numEventsBkg)
+        values[~isDefined] = mean
+        values -= mean
 
-    # sort signal and background together by increasing value
-    indices.sort(key = getValue)
+        values *= sqrtWeights
 
-    cumulativeSumSoFar = 0
+        norm = numpy.sqrt(numpy.dot(values, values))
+        if norm > 0:
+            values /= norm
 
-    maxDiff = 0
+        retval[:, index] = values
 
-    # when we have lots of events with the same value,
-    # the sorting could be such that we first have
-    # all the background and then all the signal
-    # events which would look like that there is discrimination
-    # power in this region but there is not because
-    # we could not put a cut between signal and background
-    # (because the events have the same values here)
+    return retval
 
-    lastValue = None
+#----------------------------------------------------------------------
 
-    for index in indices:
-        weight = getWeight(index)
+def weightedCorrelationMatrix(columns, weights, method = 'pearson', chunkSize = 200):
+    # calculates the weighted correlation coefficients between all pairs
+    # of the given columns
+    #
+    # @param columns is a list of arrays of values, one per variable
+    # @param method is 'pearson' for the linear correlation coefficient
+    #        or 'rank' for (weighted) Spearman's rank correlation coefficient
+    # @param chunkSize is the number of columns processed at once, limiting
+    #        the memory needed to two blocks of (number of events x chunkSize)
+    #        values. With more columns, the standardized values of all
+    #        columns are kept in a temporary file.
+    #
+    # @return the correlation matrix as 2D numpy array
+    import numpy, tempfile
 
-        value = getValue(index)
+    weights = numpy.asarray(weights, dtype = 'f8')
 
-        assert lastValue == None or value >= lastValue
+    numColumns = len(columns)
 
-        if isSignal(index):
-            cumulativeSumSoFar += weight / sumWeightsSig
-        else:
-            cumulativeSumSoFar -= weight / sumWeightsBkg
+    if numColumns <= chunkSize or len(weights) == 0:
+        standardized = _standardizedColumns(columns, weights, method)
+        retval = numpy.dot(standardized.T, standardized)
+
+    else:
+        # standardize each chunk of columns only once, one row per
+        # column (such that a chunk is contiguous in the file)
+        standardized = numpy.memmap(tempfile.TemporaryFile(), dtype = 'f8', mode = 'w+',
+                                    shape = (numColumns, len(weights)))
+
+        for start in range(0, numColumns, chunkSize):
+            end = min(start + chunkSize, numColumns)
+            standardized[start:end] = _standardizedColumns(columns[start:end], weights, method).T
+
+        retval = numpy.zeros((numColumns, numColumns))
+
+        for rowStart in range(0, numColumns, chunkSize):
+            rowEnd = min(rowStart + chunkSize, numColumns)
+
+            rowBlock = numpy.array(standardized[rowStart:rowEnd])
+
+            for colStart in range(rowStart, numColumns, chunkSize):
+                colEnd = min(colStart + chunkSize, numColumns)
+
+                if colStart == rowStart:
+                    colBlock = rowBlock
+                else:
+                    colBlock = standardized[colStart:colEnd]
+
+                block = numpy.dot(rowBlock, colBlock.T)
+
+                retval[rowStart:rowEnd, colStart:colEnd] = block
+                retval[colStart:colEnd, rowStart:rowEnd] = block.T
+
+        del standardized
+
+    # constant columns have no defined correlation,
+    # we set the diagonal to one nevertheless
+    numpy.fill_diagonal(retval, 1.)
+
+    return retval
+
+#----------------------------------------------------------------------
+
+def makeHistograms(valuesSig, valuesBkg, weightsSig, weightsBkg, numBins = 50):
+    # fills the normalized signal and background distribution of a variable
+    # into histograms with numBins bins from the minimum to the maximum
+    # value (plus one bin margin on each side)
+    #
+    # @return (binEdges, contentsSig, contentsBkg)
+    import numpy
+
+    valuesSig = numpy.asarray(valuesSig, dtype = 'f8')
+    valuesBkg = numpy.asarray(valuesBkg, dtype = 'f8')
+
+    # undefined values are not plotted
+    isDefinedSig = numpy.isfinite(valuesSig)
+    isDefinedBkg = numpy.isfinite(valuesBkg)
+
+    definedValues = [ values for values in (valuesSig[isDefinedSig], valuesBkg[isDefinedBkg]) if len(values) > 0 ]
+
+    if definedValues:
+        xmin = min(values.min() for values in definedValues)
+        xmax = max(values.max() for values in definedValues)
+    else:
+        xmin, xmax = 0., 1.
+
+    if xmax <= xmin:
+        # constant variable
+        xmin, xmax = xmin - 0.5, xmin + 0.5
+
+    numbinsWithMargin = numBins + 2
+
+    binWidth = (xmax - xmin) / float(numBins)
+
+    # add some margin
+    xmid = 0.5 * (xmin + xmax)
+
+    binEdges = numpy.linspace(xmid - (numbinsWithMargin * binWidth) / 2.0,
+                              xmid + (numbinsWithMargin * binWidth) / 2.0,
+                              numbinsWithMargin + 1)
+
+    retval = [ binEdges ]
+
+    for values, weights, isDefined in (
+        (valuesSig, weightsSig, isDefinedSig),
+        (valuesBkg, weightsBkg, isDefinedBkg),
+        ):
+        contents, edges = numpy.histogram(values[isDefined], binEdges,
+                                          weights = numpy.asarray(weights, dtype = 'f8')[isDefined])
+
+        # normalize histograms to unit area
+        tot = contents.sum()
+        if tot > 0:
+            contents = contents / float(tot)
+
+        retval.append(contents)
+
+    return tuple(retval)
+
+#----------------------------------------------------------------------
+
+def findPlotBackend():
+    # @return 'matplotlib' if matplotlib is installed, 'root' otherwise
+    try:
+        import matplotlib
+        return 'matplotlib'
+    except ImportError:
+        return 'root'
+
+#----------------------------------------------------------------------
+
+def _renderPlotMatplotlib(title, binEdges, contentsSig, contentsBkg, imageFormat, fileName = None):
+    # uses matplotlib's object oriented interface with the
+    # Agg backend directly (i.e. no display is needed and the
+    # pyplot state machine is not involved)
+    #
+    # @param fileName see _renderPlot(..)
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import io
+
+    fig = Figure(figsize = (6.4, 4.8))
+    FigureCanvasAgg(fig)
+
+    ax = fig.add_subplot(1, 1, 1)
+
+    for contents, color in ((contentsSig, 'red'), (contentsBkg, 'blue')):
+        ax.hist(binEdges[:-1], bins = binEdges, weights = contents, histtype = 'step', color = color, linewidth = 2)
+
+    ax.set_xlim(binEdges[0], binEdges[-1])
+    ax.set_ylim(0, max(contentsSig.max(), contentsBkg.max()) * 1.1 or 1)
+    ax.set_title(title)
+
+    if fileName != None:
+        fig.savefig(fileName, format = imageFormat)
+        return None
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format = imageFormat)
+
+    return buf.getvalue()
+
+#----------------------------------------------------------------------
 
-        # update the maximum difference
-        # only update this if the value of the variable
-        # actually increased (see the discussion above)
-        if value > lastValue:
-            maxDiff = max(maxDiff, abs(cumulativeSumSoFar))
+def _renderPlotRoot(title, binEdges, contentsSig, contentsBkg, imageFormat, fileName = None):
+    # @param fileName see _renderPlot(..)
+    import ROOT, array, tempfile
 
-        # prepare the next iteration
-        lastValue = value
+    ROOT.gROOT.SetBatch(True)
 
+    histos = []
 
-    return maxDiff
+    for contents, color in ((contentsSig, ROOT.kRed), (contentsBkg, ROOT.kBlue)):
+        histo = ROOT.TH1F("", title, len(binEdges) - 1, array.array('d', binEdges))
+        histo.SetDirectory(0)
 
+        for binIndex, content in enumerate(contents):
+            histo.SetBinContent(binIndex + 1, content)
+
+        histo.SetLineColor(color)
+        histo.SetLineWidth(2)
+
+        histos.append(histo)
+
+    ymax = max(histo.GetMaximum() for histo in histos) * 1.1
+
+    canv = ROOT.TCanvas()
+
+    for index, histo in enumerate(histos):
+        histo.SetMaximum(ymax)
+        histo.Draw("same" if index > 0 else "")
+
+    if fileName != None:
+        canv.SaveAs(fileName)
+        canv.Close()
+        return None
+
+    # ROOT can only write images to files
+    fd, fname = tempfile.mkstemp(suffix = "." + imageFormat)
+    os.close(fd)
+
+    try:
+        canv.SaveAs(fname)
+        canv.Close()
+
+        fin = open(fname, "rb")
+        retval = fin.read()
+        fin.close()
+    finally:
+        os.unlink(fname)
+
+    return retval
+
+#----------------------------------------------------------------------
+
+def _renderPlot(job, fileName = None):
+    # renders the (already filled) signal and background histograms of one
+    # variable, this is called in the worker processes when making
+    # several plots in parallel (see VariableRanking.makePlotImages(..))
+    #
+    # @param job is a tuple (backend, imageFormat, title, binEdges, contentsSig, contentsBkg)
+    # @param fileName if not None, the image is written to this file
+    #        (the format is given by imageFormat) instead of being returned
+    # @return the image file contents (None if fileName is given)
+    backend, imageFormat, title, binEdges, contentsSig, contentsBkg = job
+
+    if backend == 'matplotlib':
+        return _renderPlotMatplotlib(title, binEdges, contentsSig, contentsBkg, imageFormat, fileName)
+    elif backend == 'root':
+        return _renderPlotRoot(title, binEdges, contentsSig, contentsBkg, imageFormat, fileName)
+    else:
+        raise ValueError("unknown plot backend '%s'" % backend)
+
+#----------------------------------------------------------------------
+
+def _renderPlotToFile(jobAndFileName):
+    # renders a plot into the given file (see _renderPlot(..)),
+    # removing an incomplete file if rendering fails
+    job, fileName = jobAndFileName
+
+    try:
+        _renderPlot(job, fileName)
+    except:
+        if os.path.exists(fileName):
+            os.unlink(fileName)
+        raise
+
+#----------------------------------------------------------------------
+
+def _renderPlots(jobs, numProcesses, fileNames = None):
+    # renders the given plots (see _renderPlot(..)), in parallel
+    # if numProcesses is larger than one
+    #
+    # @param fileNames if not None, the images are written to these
+    #        files (one per job) by the processes rendering them
+    #
+    # @return the list of image file contents (None for each
+    #         job if fileNames is given)
+    import multiprocessing
+
+    if fileNames != None:
+        func, jobs = _renderPlotToFile, zip(jobs, fileNames)
+    else:
+        func = _renderPlot
+
+    if numProcesses == None:
+        numProcesses = multiprocessing.cpu_count()
+
+    numProcesses = min(numProcesses, len(jobs))
+
+    if numProcesses <= 1:
+        return [ func(job) for job in jobs ]
+
+    pool = multiprocessing.Pool(numProcesses)
+
+    try:
+        retval = pool.map(func, jobs, chunksize = max(1, len(jobs) // (4 * numProcesses)))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return retval
+
+#----------------------------------------------------------------------
+
+def _plotJobHash(job):
+    # @return a hash of everything which goes into the plot image
+    # (backend, format, title, binning and bin contents), used as
+    # file name of cached plots
+    import hashlib
+
+    backend, imageFormat, title, binEdges, contentsSig, contentsBkg = job
+
+    hasher = hashlib.sha1()
+    hasher.update(repr((backend, imageFormat, title)))
+
+    for array in (binEdges, contentsSig, contentsBkg):
+        hasher.update(array.astype('f8').tostring())
+
+    return hasher.hexdigest()
 
 #----------------------------------------------------------------------
 
@@ -114,15 +424,29 @@ class VariableRanking:
     #----------------------------------------
 
     def __init__(self, valuesSig, valuesBkg, weightColSig = None, weightColBkg = None, columnsToCompare = None,
-                 varDescriptions = None):
+                 varDescriptions = None, metrics = None, primaryMetric = 'ks', numBins = 50,
+                 bootstrap = 0, confidenceLevel = 0.68, bootstrapSeed = 1, bootstrapChunkSize = None):
         """
         :param valuesSig: a numpy record array for the signal events
         :param valuesBkg: same as valuesSignal but for background
         :param columnsToCompare: if not None, restrict the comparison to the given columns
         :param variableDescriptions: if not None, specifies a mapping of output variable names to the string
             to be printed instead
+        :param metrics: list of names of separation metrics to calculate (see SeparationMetrics.metricNames),
+            'all' for all supported metrics. All metrics of a variable are calculated from one sort
+            of its values.
+        :param primaryMetric: name of the metric the variables are ranked by
+        :param numBins: number of bins used for the binned metrics (separation, mutual information)
+        :param bootstrap: if larger than zero, the number of bootstrap replicas (with Poisson(1)
+            distributed event weight factors) used to estimate confidence intervals on the metrics
+        :param confidenceLevel: coverage of the (percentile) bootstrap confidence intervals
+        :param bootstrapSeed: random seed for the bootstrap replicas (None for a random seed)
+        :param bootstrapChunkSize: number of bootstrap replicas evaluated at once, by default
+            chosen such that the weights of a chunk have about 5 million entries
         """
 
+        import numpy
+
         #----------
         # get the event weights
         #----------
@@ -157,6 +481,33 @@ class VariableRanking:
 
         self.columns = columnsToCompare
 
+        if metrics == None:
+            metrics = [ primaryMetric ]
+        elif metrics == 'all':
+            metrics = list(SeparationMetrics.metricNames)
+        elif not primaryMetric in metrics:
+            metrics = [ primaryMetric ] + list(metrics)
+
+        self.metrics = metrics
+        self.numBins = numBins
+
+        # one dict (metric name to value) per variable
+        self.metricValues = []
+
+        # bootstrap replicas: one dict (metric name to array of
+        # values of all replicas) per variable
+        self.bootstrap = bootstrap
+        self.confidenceLevel = confidenceLevel
+        self.bootstrapValues = []
+
+        if bootstrap > 0:
+            if bootstrapSeed == None:
+                bootstrapSeed = numpy.random.randint(2**31)
+
+            if bootstrapChunkSize == None:
+                bootstrapChunkSize = max(1, min(bootstrap, 5000000 // max(1, len(valuesSig) + len(valuesBkg))))
+
+        self.primaryMetric = primaryMetric
         self.similarities = []
 
         self.varDescriptions = []
@@ -166,7 +517,15 @@ class VariableRanking:
         
 
         for colname in columnsToCompare:
-            self.similarities.append(self.calcSimilarity(valuesSig[colname], valuesBkg[colname], self.weightsSig, self.weightsBkg))
+            # all metrics (and bootstrap replicas) of this variable
+            # are calculated from the same sort of the values
+            sortedSamples = SeparationMetrics.SortedSamples(valuesSig[colname], valuesBkg[colname])
+
+            self.metricValues.append(sortedSamples.calcMetrics(self.weightsSig, self.weightsBkg, self.metrics, self.numBins))
+            self.similarities.append(self.metricValues[-1][primaryMetric])
+
+            if bootstrap > 0:
+                self.bootstrapValues.append(self.__calcBootstrapMetrics(sortedSamples, bootstrap, bootstrapChunkSize, bootstrapSeed))
 
             # keep the signal and background values for generating a report later
             self.valuesSig.append(valuesSig[colname])
@@ -178,6 +537,10 @@ class VariableRanking:
 
             self.varDescriptions.append(varDescription)
 
+        # confidence intervals of the metrics
+        self.metricIntervals = [ self.__calcIntervals(replicaValues) for replicaValues in self.bootstrapValues ]
+        self.__updateScoreIntervals()
+
 
     #----------------------------------------
 
@@ -197,166 +560,475 @@ class VariableRanking:
     def calcSimilarity(self, valuesSig, valuesBkg, weightsSig, weightsBkg):
         return maxCumulativeDifference(valuesSig, valuesBkg, weightsSig, weightsBkg)
 
+    #----------------------------------------
+
+    def __calcBootstrapMetrics(self, sortedSamples, numReplicas, chunkSize, seed):
+        # @return a dict with the values of each metric for all bootstrap
+        # replicas
+        #
+        # the replicas are evaluated in chunks, with the weights of a chunk
+        # given as (number of events x number of replicas in the chunk)
+        # matrix. The random numbers of a chunk only depend on the seed and
+        # the index of the chunk such that the same replicas are used
+        # for all variables.
+        import numpy
+
+        retval = dict((metric, []) for metric in self.metrics)
+
+        for chunkIndex, chunkStart in enumerate(range(0, numReplicas, chunkSize)):
+            numChunkReplicas = min(chunkSize, numReplicas - chunkStart)
+
+            randomState = numpy.random.RandomState([ seed, chunkIndex ])
+
+            weightsSig = randomState.poisson(1, (len(self.weightsSig), numChunkReplicas)) * \
+                         numpy.asarray(self.weightsSig, dtype = 'f8')[:, numpy.newaxis]
+            weightsBkg = randomState.poisson(1, (len(self.weightsBkg), numChunkReplicas)) * \
+                         numpy.asarray(self.weightsBkg, dtype = 'f8')[:, numpy.newaxis]
+
+            chunkValues = sortedSamples.calcMetrics(weightsSig, weightsBkg, self.metrics, self.numBins)
+
+            for metric in self.metrics:
+                retval[metric].append(chunkValues[metric])
+
+        return dict((metric, numpy.concatenate(values)) for metric, values in retval.items())
 
     #----------------------------------------
 
-    def printSummary(self, os = sys.stdout):
-        print >> os,"similarity ranking (least similar variables first):"
+    def __calcIntervals(self, replicaValues):
+        # @return a dict with the (percentile) confidence interval
+        # for each metric
+        import numpy
 
-        indices = range(len(self.similarities))
+        alpha = 0.5 * (1 - self.confidenceLevel)
+
+        return dict((metric, tuple(numpy.percentile(values, [ 100 * alpha, 100 * (1 - alpha) ])))
+                    for metric, values in replicaValues.items())
+
+    #----------------------------------------
+
+    def __updateScoreIntervals(self):
+        # the confidence intervals of the primary metric
+        # (empty if no bootstrapping was done)
+        self.scoreIntervals = [ intervals[self.primaryMetric] for intervals in self.metricIntervals ]
+
+    #----------------------------------------
+
+    def setPrimaryMetric(self, primaryMetric):
+        # changes the metric the variables are ranked by (which
+        # must be one of the metrics calculated)
+        if not primaryMetric in self.metrics:
+            raise ValueError("metric '%s' was not calculated (calculated metrics are: %s)" % (primaryMetric, ", ".join(self.metrics)))
 
-        # reverse = True will make put the most dissimilar variable first
+        self.primaryMetric = primaryMetric
+        self.similarities = [ values[primaryMetric] for values in self.metricValues ]
+        self.__updateScoreIntervals()
+
+    #----------------------------------------
+
+    def calcKSBounds(self, confidenceLevel = 0.95):
+        """
+        calculates confidence bounds on the Kolmogorov-Smirnov distance ('ks') of
+        the signal and background distributions each variable would have with
+        infinite statistics, from the Dvoretzky-Kiefer-Wolfowitz inequality applied
+        to the signal and background samples (with the effective number of
+        events given the weights). The bounds are conservative but assume
+        independent events.
+
+        :param confidenceLevel: probability that the distance lies within the bounds
+        :return: a list of (lower, upper) tuples, one per variable
+        """
+        import numpy, math
+
+        if not 'ks' in self.metrics:
+            raise ValueError("metric 'ks' was not calculated")
+
+        # each of the two samples is allowed to deviate
+        # by half of the total probability
+        logTerm = math.log(4. / (1. - confidenceLevel))
+
+        retval = []
+
+        for index in range(len(self.columns)):
+            tolerance = 0.
+
+            for values, weights in ((self.valuesSig[index], self.weightsSig),
+                                    (self.valuesBkg[index], self.weightsBkg)):
+                weights = numpy.asarray(weights, dtype = 'f8')[numpy.isfinite(values)]
+
+                sumWeights2 = (weights * weights).sum()
+
+                if sumWeights2 > 0:
+                    numEffective = weights.sum() ** 2 / sumWeights2
+                    tolerance += math.sqrt(logTerm / (2. * numEffective))
+                else:
+                    tolerance = 1.
+
+            ks = self.metricValues[index]['ks']
+
+            retval.append((max(ks - tolerance, 0.), min(ks + tolerance, 1.)))
+
+        return retval
+
+    #----------------------------------------
+
+    def getRankedIndices(self):
+        # @return the indices of the variables, the most dissimilar
+        # variable first
+        indices = range(len(self.similarities))
         indices.sort(key = lambda i: self.similarities[i], reverse = True)
+        return indices
 
-        maxWidth = max(len(name) for name in self.varDescriptions)
+    #----------------------------------------
 
-        for index in indices:
-            print >> os,"  %-*s : %f" % (maxWidth, self.varDescriptions[index], self.similarities[index])
+    def calcCorrelations(self, topN = None, method = 'pearson', chunkSize = 200):
+        """
+        calculates the weighted correlation coefficients between the
+        top ranked variables, separately for signal and background
+
+        :param topN: if not None, only the topN most dissimilar variables are considered
+        :param method: 'pearson' for the linear correlation coefficient or 'rank'
+            for the rank correlation coefficient
+        :param chunkSize: number of variables processed at once (see weightedCorrelationMatrix(..))
+        :return: a tuple (indices, correlationsSig, correlationsBkg) with the indices of
+            the variables considered (most dissimilar first) and the correlation matrices
+            (rows and columns in the order of indices)
+        """
+
+        indices = self.getRankedIndices()
+        if topN != None:
+            indices = indices[:topN]
+
+        correlationsSig = weightedCorrelationMatrix([ self.valuesSig[index] for index in indices ],
+                                                    self.weightsSig, method, chunkSize)
+        correlationsBkg = weightedCorrelationMatrix([ self.valuesBkg[index] for index in indices ],
+                                                    self.weightsBkg, method, chunkSize)
+
+        return indices, correlationsSig, correlationsBkg
 
     #----------------------------------------
 
-    def plotVariableToImageFile(self, varIndex, foutName):
+    def selectDecorrelated(self, maxCorrelation = 0.9, topN = None, method = 'pearson', chunkSize = 200):
+        """
+        selects variables going from the most to the least dissimilar one, skipping variables
+        which are strongly correlated to an already selected variable (in signal or background)
 
-        # determine the binning: take 50 bins from min to max
-        # (add some margin on the left and right)
-        values = list(self.valuesSig[varIndex]) + list(self.valuesBkg[varIndex])
-        xmin = min(values)
-        xmax = max(values)
+        :param maxCorrelation: variables with an absolute correlation coefficient above this
+            value with one of the already selected variables are skipped
+        :param topN, method, chunkSize: see calcCorrelations(..)
+        :return: the list of names of the selected columns, most dissimilar first
+        """
+        import numpy
 
-        numbins = 50
-        numbinsWithMargin = numbins + 2
+        indices, correlationsSig, correlationsBkg = self.calcCorrelations(topN, method, chunkSize)
 
-        binWidth = (xmax - xmin) / float(numbins)
+        # largest absolute correlation in signal or background
+        correlations = numpy.maximum(numpy.abs(correlationsSig), numpy.abs(correlationsBkg))
 
-        # add some margin
-        xmid = 0.5 * (xmin + xmax)
-        
-        xmin = xmid - (numbinsWithMargin * binWidth) / 2.0
-        xmax = xmid + (numbinsWithMargin * binWidth) / 2.0
+        # positions (in indices) of the variables selected so far
+        selected = []
 
-        import ROOT
+        for pos in range(len(indices)):
+            if selected and correlations[pos, selected].max() > maxCorrelation:
+                continue
 
-        histoSig = ROOT.TH1F("",self.varDescriptions[varIndex],numbinsWithMargin, xmin, xmax)
-        histoBkg = ROOT.TH1F("",self.varDescriptions[varIndex],numbinsWithMargin, xmin, xmax)
+            selected.append(pos)
 
-        histoSig.SetLineColor(ROOT.kRed)
-        histoBkg.SetLineColor(ROOT.kBlue)
+        return [ self.columns[indices[pos]] for pos in selected ]
 
-        histoSig.SetLineWidth(2)
-        histoBkg.SetLineWidth(2)
 
-        for values, weights, histo in (
-            (self.valuesSig[varIndex], self.weightsSig, histoSig),
-            (self.valuesBkg[varIndex], self.weightsBkg, histoBkg),
-            ):
-            for i in range(len(values)):
-                histo.Fill(values[i], weights[i])
+    #----------------------------------------
 
-        # normalize histograms to unit are
-        for histo in (histoSig, histoBkg):
-            tot = histo.GetSum()
-            if tot > 0:
-                histo.Scale(1 / float(tot))
+    def __getOtherMetrics(self):
+        # @return the calculated metrics other than the primary one
+        return [ metric for metric in self.metrics if metric != self.primaryMetric ]
 
-        ymax = max(histoSig.GetMaximum(), histoBkg.GetMaximum()) * 1.1
+    #----------------------------------------
 
-        histoSig.SetMaximum(ymax)
-        histoBkg.SetMaximum(ymax)
+    def printSummary(self, os = sys.stdout):
+        if self.primaryMetric == 'ks':
+            print >> os,"similarity ranking (least similar variables first):"
+        else:
+            print >> os,"similarity ranking by %s (least similar variables first):" % self.primaryMetric
 
-        # TODO: can we prevent ROOT from drawing an actual window on the screen
-        canv = ROOT.TCanvas()
+        if self.scoreIntervals:
+            print >> os,"(%.0f%% confidence intervals from %d bootstrap replicas)" % (100 * self.confidenceLevel, self.bootstrap)
 
-        histoSig.Draw()
-        histoBkg.Draw("same")
+        indices = self.getRankedIndices()
 
-        canv.SaveAs(foutName)
+        maxWidth = max(len(name) for name in self.varDescriptions)
 
-        canv.Close()
-        
+        otherMetrics = self.__getOtherMetrics()
+
+        # width of the columns when printing more than one metric
+        primaryWidth = 0
+        widths = [ max(10, len(metric)) for metric in otherMetrics ]
+
+        intervals = [ " [%f, %f]" % interval for interval in self.scoreIntervals ]
+
+        if intervals:
+            intervalTitle = " %.0f%% interval" % (100 * self.confidenceLevel)
+            intervalWidth = max([ len(intervalTitle) ] + [ len(interval) for interval in intervals ])
+
+        if otherMetrics or intervals:
+            # the header is formatted as the lines below
+            primaryWidth = max(10, len(self.primaryMetric))
+
+            header = "  %-*s   %*s" % (maxWidth, "", primaryWidth, self.primaryMetric)
+
+            if intervals:
+                header += "%-*s" % (intervalWidth, intervalTitle)
+
+            for metric, width in zip(otherMetrics, widths):
+                header += " %*s" % (width, metric)
+
+            print >> os, header
+
+        for index in indices:
+            line = "  %-*s : %*f" % (maxWidth, self.varDescriptions[index], primaryWidth, self.similarities[index])
+
+            if intervals:
+                line += "%-*s" % (intervalWidth, intervals[index])
+
+            for metric, width in zip(otherMetrics, widths):
+                line += " %*f" % (width, self.metricValues[index][metric])
+
+            print >> os, line
 
     #----------------------------------------
 
-    def writeHtmlReport(self,fout):
-        # sort by decreasing smilarity
-        indices = range(len(self.similarities))
+    def __makePlotJob(self, varIndex, backend, imageFormat = 'png'):
+        # histograms the variable (which is fast with numpy and keeps
+        # the data sent to worker processes small)
+        binEdges, contentsSig, contentsBkg = makeHistograms(self.valuesSig[varIndex], self.valuesBkg[varIndex],
+                                                            self.weightsSig, self.weightsBkg)
 
-        # reverse = True will make put the most dissimilar variable first
-        indices.sort(key = lambda i: self.similarities[i], reverse = True)
+        if backend == None:
+            backend = findPlotBackend()
 
-        # fout must be a file like object
+        return (backend, imageFormat, self.varDescriptions[varIndex], binEdges, contentsSig, contentsBkg)
+
+    #----------------------------------------
+
+    def plotVariableToImageFile(self, varIndex, foutName, backend = None):
+        imageFormat = os.path.splitext(foutName)[1][1:] or 'png'
+
+        imageData = _renderPlot(self.__makePlotJob(varIndex, backend, imageFormat))
+
+        fout = open(foutName, "wb")
+        fout.write(imageData)
+        fout.close()
+
+    #----------------------------------------
+
+    def makePlotImages(self, varIndices, numProcesses = None, backend = None):
+        """
+        renders the signal and background distributions of the given variables
+
+        :param varIndices: indices of the variables to plot
+        :param numProcesses: number of processes rendering the plots in parallel,
+            by default the number of cpus
+        :param backend: 'matplotlib' or 'root', by default matplotlib if it is installed
+        :return: list of png images (as strings) in the order of varIndices
+        """
+
+        jobs = [ self.__makePlotJob(varIndex, backend) for varIndex in varIndices ]
 
+        return _renderPlots(jobs, numProcesses)
+
+    #----------------------------------------
+
+    def __writeHtmlHeader(self, fout, title):
         print >> fout,"<html>"
         print >> fout,"<head>"
-        print >> fout,"<title>variable ranking</title>"
+        print >> fout,"<title>%s</title>" % title
         print >> fout,"</head>"
 
         print >> fout,"<body>"
 
-        print >> fout, "<h1>variable ranking</h1>"
+        print >> fout, "<h1>%s</h1>" % title
+
+    #----------------------------------------
+
+    def __writeHtmlFooter(self, fout):
+        print >> fout,"</body>"
+        print >> fout,"</html>"
+
+    #----------------------------------------
+
+    def __writeOverviewTable(self, fout, indices, getLink):
+        # @param getLink is a function returning the link target
+        # for the given rank (counting from one)
+
+        otherMetrics = self.__getOtherMetrics()
 
-        #----------
-        # print an overview table
-        #----------
         print >> fout, "<table>"
-        print >> fout, "<tr><th>dissimilarity rank</th><th>expression</th><th>dissimilarity</th></tr>"
+        print >> fout, "<tr><th>dissimilarity rank</th><th>expression</th><th>dissimilarity (%s)</th>%s%s</tr>" % (
+            self.primaryMetric,
+            "<th>%.0f%% confidence interval</th>" % (100 * self.confidenceLevel) if self.scoreIntervals else "",
+            "".join("<th>" + metric + "</th>" for metric in otherMetrics))
 
         for index,varIndex in enumerate(indices):
 
             items = [ index + 1,
-                      ('<a href="#%d">' % (index + 1)) + self.varDescriptions[varIndex] + "</a>",
+                      ('<a href="%s">' % getLink(index + 1)) + self.varDescriptions[varIndex] + "</a>",
                       self.similarities[varIndex],
                       ]
 
+            if self.scoreIntervals:
+                items.append("[%f, %f]" % self.scoreIntervals[varIndex])
+
+            items += [ self.metricValues[varIndex][metric] for metric in otherMetrics ]
+
             print >> fout, "<tr>", "".join([ "<td>" + str(x) + "</td>" for x in items ]),"</tr>"
         
 
         print >> fout, "</table>"
 
+    #----------------------------------------
+
+    def __writeVariableSection(self, fout, rank, varIndex, imageTag):
+
+        varDescription = self.varDescriptions[varIndex]
+
+        print >> fout, "<hr/>"
+
+        # HTML anchor
+        print >> fout, '<a name="%d"/>' % rank
+
+        print >> fout, "<h2>" + varDescription + "</h2>"
+
+        print >> fout, "dissimilarity rank:",rank,"<br/>"
+        print >> fout, "dissimilarity (%s):" % self.primaryMetric,self.similarities[varIndex],"<br/>"
+
+        if self.scoreIntervals:
+            print >> fout, "%.0f%% confidence interval (%d bootstrap replicas): [%f, %f]" % (
+                (100 * self.confidenceLevel, self.bootstrap) + self.scoreIntervals[varIndex]),"<br/>"
+
+        for metric in self.__getOtherMetrics():
+            print >> fout, "%s:" % metric,self.metricValues[varIndex][metric],"<br/>"
+
+        print >> fout, imageTag
+
+    #----------------------------------------
+
+    def writeHtmlReport(self, fout, numProcesses = None, plotBackend = None):
+        # sort by decreasing smilarity
+        indices = self.getRankedIndices()
+
+        # fout must be a file like object
+
+        self.__writeHtmlHeader(fout, "variable ranking")
+
+        #----------
+        # print an overview table
+        #----------
+        self.__writeOverviewTable(fout, indices, lambda rank: "#%d" % rank)
 
         #----------
 
-        import tempfile
-        workdir = tempfile.mkdtemp()
+        images = self.makePlotImages(indices, numProcesses, plotBackend)
+
+        import base64
 
         for index,varIndex in enumerate(indices):
+            # put the image as data URI directly into the html
+            self.__writeVariableSection(fout, index + 1, varIndex,
+                                        '<img src="data:image/png;base64,%s" />' % base64.b64encode(images[index]))
 
-            varDescription = self.varDescriptions[varIndex]
+        # end of loop over all variables
 
-            print >> fout, "<hr/>"
+        self.__writeHtmlFooter(fout)
 
-            # HTML anchor
-            print >> fout, '<a name="%d"/>' % (index + 1)
+    #----------------------------------------
 
-            print >> fout, "<h2>" + varDescription + "</h2>"
+    def writeHtmlReportDirectory(self, outputDir, variablesPerPage = 50, numProcesses = None, plotBackend = None):
+        """
+        writes the report as a set of files into the given directory:
+        an index page (index.html) with the overview table, pages with
+        variablesPerPage variables each and the plots (loaded lazily by the browser)
+        as separate image files in the plots subdirectory.
+
+        Plots are cached: the image file name is a hash of the histogram contents,
+        binning and title, so writing the report again into the same directory
+        (e.g. after adding variables) only renders the plots which changed.
+
+        :param variablesPerPage: number of variables shown per page
+        :param numProcesses, plotBackend: see makePlotImages(..)
+        :return: the number of plots rendered (i.e. not found in the cache)
+        """
 
-            print >> fout, "dissimilarity rank:",index + 1,"<br/>"
-            print >> fout, "dissimilarity:",self.similarities[varIndex],"<br/>"
+        indices = self.getRankedIndices()
 
-            fname = os.path.join(workdir, "%d.png" % varIndex)
-            self.plotVariableToImageFile(varIndex, fname)
+        plotDir = os.path.join(outputDir, "plots")
+        if not os.path.isdir(plotDir):
+            os.makedirs(plotDir)
 
-            # read the png file back
-            fin = open(fname)
-            imageData = fin.read()
-            fin.close()
+        #----------
+        # render the plots not yet in the cache
+        #----------
+        jobs = [ self.__makePlotJob(varIndex, plotBackend) for varIndex in indices ]
+        imageNames = [ _plotJobHash(job) + ".png" for job in jobs ]
 
-            os.unlink(fname)
+        missing = [ pos for pos, imageName in enumerate(imageNames)
+                    if not os.path.exists(os.path.join(plotDir, imageName)) ]
 
-            # put the image as data URI directly into the html
-            import base64
-            print >> fout,'<img src="data:image/png;base64,%s" />' % base64.b64encode(imageData)
-            
+        # the images are written directly into the cache by the
+        # processes rendering them (incomplete images of plots
+        # which failed are removed)
+        _renderPlots([ jobs[pos] for pos in missing ], numProcesses,
+                     [ os.path.join(plotDir, imageNames[pos]) for pos in missing ])
 
+        #----------
+        # write the pages
+        #----------
+        numPages = max(1, (len(indices) + variablesPerPage - 1) // variablesPerPage)
 
-        # end of loop over all variables
+        def getPageName(pageIndex):
+            return "page%04d.html" % (pageIndex + 1)
 
+        for pageIndex in range(numPages):
+            fout = open(os.path.join(outputDir, getPageName(pageIndex)), "w")
 
-        print >> fout,"</body>"
-        print >> fout,"</html>"
-        
-        
+            self.__writeHtmlHeader(fout, "variable ranking (page %d of %d)" % (pageIndex + 1, numPages))
 
-        
+            # navigation links
+            links = [ '<a href="index.html">overview</a>' ]
+            if pageIndex > 0:
+                links.append('<a href="%s">previous page</a>' % getPageName(pageIndex - 1))
+            if pageIndex + 1 < numPages:
+                links.append('<a href="%s">next page</a>' % getPageName(pageIndex + 1))
+
+            print >> fout, " | ".join(links)
+
+            for pos in range(pageIndex * variablesPerPage, min((pageIndex + 1) * variablesPerPage, len(indices))):
+                self.__writeVariableSection(fout, pos + 1, indices[pos],
+                                            '<img src="plots/%s" loading="lazy" />' % imageNames[pos])
+
+            self.__writeHtmlFooter(fout)
+            fout.close()
+
+        # remove pages left over from a previous report with more pages
+        pageIndex = numPages
+        while os.path.exists(os.path.join(outputDir, getPageName(pageIndex))):
+            os.unlink(os.path.join(outputDir, getPageName(pageIndex)))
+            pageIndex += 1
+
+        #----------
+        # write the index page
+        #----------
+        fout = open(os.path.join(outputDir, "index.html"), "w")
+
+        self.__writeHtmlHeader(fout, "variable ranking")
+
+        print >> fout, "pages:", " ".join('<a href="%s">%d</a>' % (getPageName(pageIndex), pageIndex + 1)
+                                          for pageIndex in range(numPages)), "<br/>"
+
+        self.__writeOverviewTable(fout, indices,
+                                  lambda rank: "%s#%d" % (getPageName((rank - 1) // variablesPerPage), rank))
+
+        self.__writeHtmlFooter(fout)
+        fout.close()
 
+        return len(missing)
 
 #----------------------------------------------------------------------
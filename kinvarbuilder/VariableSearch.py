@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#----------------------------------------------------------------------
+# finding the output variables of a VarBuilder which separate signal
+# and background best, without calculating all of them on all events
+#----------------------------------------------------------------------
+
+from .VariableRanking import VariableRanking
+
+#----------------------------------------------------------------------
+
+def sampleEntryBlocks(numEvents, fraction, blockSize, seed = 1):
+    # @return a boolean mask (one entry per event, to be used as selection
+    # for TreeProcessor) selecting a random sample of about the given
+    # fraction of the events, in blocks of blockSize consecutive events
+    # such that only few ranges of events must be read from the input
+    # (see TreeReader)
+    #
+    # The sample is stratified: the events are divided into as many
+    # consecutive ranges as blocks are selected and one block is chosen
+    # at random in each range, such that the sample covers the whole
+    # input (e.g. all input files or run periods).
+    import numpy
+
+    numBlocks = (numEvents + blockSize - 1) // blockSize
+
+    numSelected = min(numBlocks, max(1, int(round(fraction * numBlocks))))
+
+    # the first block of each range (the ranges have at least
+    # one block since numSelected <= numBlocks)
+    rangeStarts = (numpy.arange(numSelected + 1) * numBlocks) // max(numSelected, 1)
+
+    randomState = numpy.random.RandomState(seed)
+
+    retval = numpy.zeros(numEvents, dtype = bool)
+
+    for rangeStart, rangeEnd in zip(rangeStarts[:-1], rangeStarts[1:]):
+        block = randomState.randint(rangeStart, rangeEnd)
+        retval[block * blockSize:(block + 1) * blockSize] = True
+
+    return retval
+
+#----------------------------------------------------------------------
+
+def findCandidates(bounds, topN):
+    # @param bounds is a list of (lower, upper) confidence bounds
+    #        on the scores of the variables
+    #
+    # @return the indices of the variables whose upper bound is not below
+    # the topN-th largest lower bound, i.e. which could be among the
+    # topN best variables
+
+    if topN >= len(bounds):
+        return range(len(bounds))
+
+    threshold = sorted((lower for lower, upper in bounds), reverse = True)[topN - 1]
+
+    return [ index for index, (lower, upper) in enumerate(bounds) if upper >= threshold ]
+
+#----------------------------------------------------------------------
+
+class VariableSearch:
+    """ finds the output variables of a VarBuilder which separate signal and
+        background best, calculating the variables on samples of the events first
+    """
+
+    #----------------------------------------
+
+    def __init__(self, treeProcessor, inputSig, inputBkg, weightColumn = None, treeName = None,
+                 blockSize = None, seed = 1):
+        """
+        :param treeProcessor: the TreeProcessor calculating the variables (and spectator
+            variables like event weights), the output variables of its VarBuilder are
+            the candidate variables
+        :param inputSig: the signal input, a tree or input files (see TreeProcessor.makeTree(..))
+        :param inputBkg: same as inputSig but for background
+        :param weightColumn: the name of the output column (a spectator variable of
+            treeProcessor) with the event weights, None for unweighted events
+        :param treeName: the name of the tree to read when processing input files
+        :param blockSize: the number of consecutive events sampled together (see
+            sampleEntryBlocks(..)), by default the read batch size of treeProcessor
+        :param seed: random seed for sampling the events
+        """
+
+        self.treeProcessor = treeProcessor
+        self.varBuilder = treeProcessor.varBuilder
+
+        self.inputs = [ inputSig, inputBkg ]
+        self.weightColumn = weightColumn
+        self.treeName = treeName
+
+        if blockSize == None:
+            blockSize = treeProcessor.treeReaderArgs['readBatchSize']
+
+        self.blockSize = int(blockSize)
+        self.seed = seed
+
+        # the number of signal and background events
+        self.numEvents = [ treeProcessor.getNumInputEvents(inputTree, treeName) for inputTree in self.inputs ]
+
+        # the ranking of all variables on the sample of the last call
+        # to quickRank(..), the confidence bounds on their scores and
+        # the indices of the variables calculated on all events
+        self.sampleRanking = None
+        self.sampleBounds = None
+        self.candidates = None
+
+        # (fraction of events, indices of the variables, ranking) of each
+        # stage of the last call to successiveHalving(..)
+        self.stages = None
+
+    #----------------------------------------
+
+    def calcRanking(self, outputIndices, fraction = None, sampleIndex = 0):
+        """
+        calculates the given output variables for a sample of the events and ranks them
+
+        :param outputIndices: the indices of the variables (in the VarBuilder) to calculate
+        :param fraction: the fraction of the signal and background events to sample
+            (see sampleEntryBlocks(..)), None for all events
+        :param sampleIndex: samples with different indices are drawn independently
+        :return: a VariableRanking of these variables (by the Kolmogorov-Smirnov distance)
+        """
+
+        varBuilder = self.varBuilder.getSubset(outputIndices)
+        treeProcessor = self.treeProcessor.withVarBuilder(varBuilder)
+
+        samples = []
+
+        for inputIndex, (inputTree, numEvents) in enumerate(zip(self.inputs, self.numEvents)):
+            if fraction == None:
+                selection = None
+            else:
+                selection = sampleEntryBlocks(numEvents, fraction, self.blockSize,
+                                              [ self.seed, sampleIndex, inputIndex ])
+
+            samples.append(treeProcessor.makeArray(inputTree, selection = selection, treeName = self.treeName))
+
+        return VariableRanking(samples[0], samples[1], self.weightColumn, self.weightColumn,
+                               columnsToCompare = varBuilder.outputVarnames,
+                               varDescriptions = dict(zip(varBuilder.outputVarnames, varBuilder.outputVarDescriptions)))
+
+    #----------------------------------------
+
+    def quickRank(self, topN, sampleFraction = 0.1, confidenceLevel = 0.95):
+        """
+        ranks all variables on a sample of the events first, then calculates only the
+        variables which could be among the topN best ones (given the confidence bounds
+        on their Kolmogorov-Smirnov distance, see VariableRanking.calcKSBounds(..))
+        on all events
+
+        :param topN: the number of best variables looked for
+        :param sampleFraction: the fraction of the events used for the provisional ranking
+        :param confidenceLevel: the confidence level of the bounds on the provisional scores
+        :return: the VariableRanking of the remaining variables on all events. The provisional
+            ranking of all variables and the bounds are kept in the attributes sampleRanking
+            and sampleBounds, the indices of the remaining variables in candidates.
+        """
+
+        self.sampleRanking = self.calcRanking(range(len(self.varBuilder.outputScalars)), sampleFraction)
+        self.sampleBounds = self.sampleRanking.calcKSBounds(confidenceLevel)
+
+        self.candidates = findCandidates(self.sampleBounds, topN)
+
+        return self.calcRanking(self.candidates)
+
+    #----------------------------------------
+
+    def successiveHalving(self, topN = 1, initialFraction = None, keepFraction = None, growthFactor = 2):
+        """
+        ranks all variables on a small sample of the events, keeps the best variables
+        and ranks them again on a sample larger by growthFactor, until the remaining
+        variables are ranked on all events. Since the number of variables shrinks
+        while the number of events grows, each stage costs about as much as the first
+        one and the last stage calculates only few variables on all events.
+
+        The samples consist of whole blocks of events (see sampleEntryBlocks(..)), so
+        the first sample has at least one block of events and there are only as many
+        stages as the sample can grow by growthFactor until it contains all events.
+
+        :param topN: the minimum number of variables kept in each stage
+        :param initialFraction: the fraction of the events used in the first stage, by
+            default chosen such that about topN variables remain for the last stage
+            (with keepFraction one half if it is not given)
+        :param keepFraction: the fraction of the variables kept after each stage, by
+            default chosen such that about topN variables remain for the last stage
+        :param growthFactor: the factor by which the fraction of events grows in each stage
+        :return: the VariableRanking of the remaining variables on all events. The
+            stages are kept in the attribute stages.
+        """
+
+        import math
+
+        candidates = range(len(self.varBuilder.outputScalars))
+
+        # the number of blocks of the smaller input
+        numBlocks = min((numEvents + self.blockSize - 1) // self.blockSize for numEvents in self.numEvents)
+        numBlocks = max(numBlocks, 1)
+
+        # the number of stages on samples of the events (i.e. before the last stage)
+        # if the first sample has one block of events
+        maxNumStages = int(math.floor(math.log(numBlocks) / math.log(growthFactor) + 1e-9))
+
+        if initialFraction == None:
+            # number of stages needed to get from all variables to topN variables
+            numStages = math.log(max(float(len(candidates)) / topN, 1)) / -math.log(keepFraction or 0.5)
+            numStages = min(int(math.ceil(numStages - 1e-9)), maxNumStages)
+
+            initialFraction = float(growthFactor) ** -numStages
+        else:
+            initialFraction = max(initialFraction, 1. / numBlocks)
+
+            numStages = int(math.ceil(math.log(1. / initialFraction) / math.log(growthFactor) - 1e-9))
+
+        if keepFraction == None:
+            if numStages > 0 and len(candidates) > topN:
+                keepFraction = (float(topN) / len(candidates)) ** (1. / numStages)
+            else:
+                keepFraction = 0.5
+
+        fraction = initialFraction
+
+        self.stages = []
+
+        for stageIndex in range(numStages):
+            if len(candidates) <= topN:
+                break
+
+            ranking = self.calcRanking(candidates, fraction, sampleIndex = stageIndex + 1)
+            self.stages.append((fraction, candidates, ranking))
+
+            numKept = max(topN, int(math.ceil(keepFraction * len(candidates))))
+
+            candidates = sorted(candidates[index] for index in ranking.getRankedIndices()[:numKept])
+
+            fraction *= growthFactor
+
+        # the last stage on all events
+        ranking = self.calcRanking(candidates)
+        self.stages.append((1., candidates, ranking))
+
+        return ranking
+
+#----------------------------------------------------------------------
@@ -17,54 +17,72 @@
 # limitations under the License.
 
 
-from .kinvarbuilder import CachingFunction, IllegalArgumentTypes
+from .kinvarbuilder import Node, IllegalArgumentTypes
 
 from FourVector import FourVector
 from TransverseVector import TransverseVector, Vector2D
 
 
-@CachingFunction
-class VectorSum:
-    def __init__(self, inputObjects):
+def sumIsFourVector(inputObjects):
+    # @return True if the sum of the given input vectors is a
+    # fourvector and False if it is a transverse vector
+    #
+    # raises IllegalArgumentTypes if the given vectors can not be summed
 
-        # check that all input objects are either FourVector or TransverseVector objects
+    # check that all input objects are either FourVector or TransverseVector objects
+    #
+    # sums containing a TransverseVector are transverse vectors,
+    # the fourvectors in them are projected onto the transverse plane
 
-        if len(inputObjects) > 1:
-            for vec in inputObjects:
-                # for the moment we do not allow mixtures
-                # of FourVector and TransverseVector,
-                # just sums of FourVector
-                # or a single TransverseVector
-                if not isinstance(vec, FourVector):
-                    raise IllegalArgumentTypes()
+    retval = True
 
-            self.allAreFourvectors = True
-        else:
-            # allow one single vector to be a TransverseVector
+    for vec in inputObjects:
+        if isinstance(vec, TransverseVector):
+            retval = False
+        elif not isinstance(vec, FourVector):
+            # other type, don't know how to use this for a vector sum
+            raise IllegalArgumentTypes()
 
-            if isinstance(inputObjects[0], FourVector):
-                self.allAreFourvectors = True
-            elif isinstance(inputObjects[0], TransverseVector):
-                self.allAreFourvectors = False
-            else:
-                # other type, don't know how to use this for a vector sum
-                raise IllegalArgumentTypes()
+    return retval
+
+#----------------------------------------------------------------------
+
+class VectorSum(Node):
+
+    __slots__ = ('allAreFourvectors', 'inputObjects', 'vector', 'fourVectors', 'transverseVectors', 'fourVectorSum')
+
+    def __init__(self, inputObjects):
+
+        Node.__init__(self)
+
+        self.allAreFourvectors = sumIsFourVector(inputObjects)
 
         # we can add FourVectors to FourVectors
         #
         # if we add a FourVector to a TransverseVector, we can only
         # get a TransverseVector out (the z components are ignored
-        # in the end)
+        # in the end): the sum of the FourVectors is projected onto
+        # the transverse plane (with its transverse energy, as for
+        # the arguments of TransverseMass) and the TransverseVectors
+        # are added to it
 
         self.inputObjects = list(inputObjects)
 
+        # the vector to hold the sum of the fourvectors, created when first
+        # needed such that ROOT is only imported when processing events
+        self.fourVectorSum = None
+
         if self.allAreFourvectors:
-            # the vector to hold the sum
-            import ROOT
-            self.vector = ROOT.TLorentzVector()
+            self.vector = None
         else:
-            # a single TransverseVector
-            self.vector = Vector2D()
+            self.fourVectors = [ obj for obj in self.inputObjects if isinstance(obj, FourVector) ]
+            self.transverseVectors = [ obj for obj in self.inputObjects if not isinstance(obj, FourVector) ]
+
+            if len(self.inputObjects) > 1:
+                self.vector = Vector2D()
+            else:
+                # a single TransverseVector, its value is returned
+                self.vector = None
 
     #----------------------------------------
     def getParents(self):
@@ -76,52 +94,88 @@ class VectorSum:
     def isFourVector(self):
         # @return true if the sum is s fourvector quantity (i.e. all input vectors
         # are fourvectors) or false if the sum is a transverse vector
-        #
-        # for the moment, we just build sums of FourVectors
-        # (while transverse vectors can be used as function arguments)
 
         return self.allAreFourvectors
 
     #----------------------------------------
 
+    def isMixed(self):
+        # @return true if the sum contains both fourvectors and transverse vectors
+        # (i.e. it is the transverse projection of the fourvectors plus the
+        # transverse vectors)
+
+        return not self.allAreFourvectors and len(self.fourVectors) > 0
+
+    #----------------------------------------
+
     def numComponents(self):
         # returns the number of input vectors to this sum
         return len(self.inputObjects)
 
     #----------------------------------------
 
-    def getValue(self):
+    def calcValue(self):
         # @return the sum of vectors of the current event
 
         if self.allAreFourvectors:
+            return self.__sumFourVectors(self.inputObjects)
 
-            # sum the components by hand for the moment
-            self.vector.SetXYZT(0,0,0,0)
+        if self.vector == None:
+            # a single TransverseVector
+            return self.inputObjects[0].getValue()
 
-            for obj in self.inputObjects:
-                vector = obj.getValue()
+        px = py = et = 0
 
-                if vector == None:
-                    # not defined for this event
-                    return None
+        if self.fourVectors:
+            vector = self.__sumFourVectors(self.fourVectors)
 
-                self.vector += vector
-        else:
-            assert len(self.inputObjects) == 1
+            if vector == None:
+                # not defined for this event
+                return None
+
+            px, py, et = vector.Px(), vector.Py(), vector.Et()
 
-            vector = self.inputObjects[0].getValue()
+        for obj in self.transverseVectors:
+            vector = obj.getValue()
 
             if vector == None:
                 # not defined for this event
                 return None
-            
-            # self.vector += vector
-            self.vector = vector
+
+            px += vector.Px()
+            py += vector.Py()
+            et += vector.Et()
+
+        self.vector.SetPxPyEt(px, py, et)
 
         return self.vector
 
     #----------------------------------------
 
+    def __sumFourVectors(self, inputObjects):
+        # @return the sum of the given fourvectors for the current event
+        # or None if any of them is not defined
+
+        if self.fourVectorSum == None:
+            import ROOT
+            self.fourVectorSum = ROOT.TLorentzVector()
+
+        # sum the components by hand for the moment
+        self.fourVectorSum.SetXYZT(0,0,0,0)
+
+        for obj in inputObjects:
+            vector = obj.getValue()
+
+            if vector == None:
+                # not defined for this event
+                return None
+
+            self.fourVectorSum += vector
+
+        return self.fourVectorSum
+
+    #----------------------------------------
+
     def __str__(self):
 
         return " + ".join([str(x) for x in self.inputObjects])
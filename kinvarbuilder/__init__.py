@@ -26,3 +26,4 @@ from .VarBuilder import VarBuilder
 from .TreeProcessor import TreeProcessor
 from .TreeReader import TreeReader
 from .VariableRanking import VariableRanking
+from .VariableSearch import VariableSearch
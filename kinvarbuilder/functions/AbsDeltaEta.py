@@ -22,6 +22,16 @@ from .VectorDifferenceQuantity import VectorDifferenceQuantity
 class AbsDeltaEta(VectorDifferenceQuantity):
     """ delta Eta for indistinguishable particles """
 
+    # declared argument constraints and symmetry
+    # (see kinvarbuilder.acceptsArguments(..) and getSymmetry(..))
+    needFourVectors = True
+    symmetry = 'symmetric'
+
+    __slots__ = ()
+
+    # AbsDeltaEta(a, b) is abs(DeltaEta(a, b))
+    functionOf = 'DeltaEta'
+
     # TODO: can we somehow add information to a FourVector
     #       to check whether two particles are indistinguishable
     #       or not ?
@@ -29,7 +39,7 @@ class AbsDeltaEta(VectorDifferenceQuantity):
     def __init__(self, vector1, vector2):
         VectorDifferenceQuantity.__init__(self, vector1, vector2, True)
 
-    def getValue(self):
+    def calcValue(self):
         vecValues = [ vec.getValue() for vec in self.vectors ]
 
         for vecVal in vecValues:
@@ -38,5 +48,12 @@ class AbsDeltaEta(VectorDifferenceQuantity):
 
         return abs(vecValues[0].Eta() - vecValues[1].Eta())
 
+    @staticmethod
+    def getBatchCode(out, args, tmp):
+        # calculates this function for a batch of events
+        # (see BatchFunction.py)
+        return [ "numpy.subtract(%s, %s, out = %s)" % (args[0].get('eta'), args[1].get('eta'), out),
+                 "numpy.abs(%s, out = %s)" % (out, out) ]
+
     def __str__(self):
         return "AbsDeltaEta(" + ", ".join(str(v) for v in self.vectors) +")"
\ No newline at end of file
@@ -30,9 +30,53 @@ class Angle3D(VectorDifferenceQuantity):
 
      """
 
+    # declared argument constraints and symmetry
+    # (see kinvarbuilder.acceptsArguments(..) and getSymmetry(..))
+    needFourVectors = True
+    symmetry = 'symmetric'
+
+    __slots__ = ()
+
     def __init__(self, vector1, vector2):
         VectorDifferenceQuantity.__init__(self, vector1, vector2, True)
 
-    def getValue(self):
+    def calcValue(self):
+        vecValues = [ vec.getValue() for vec in self.vectors ]
+
+        for vecVal in vecValues:
+            if vecVal == None:
+                return None
+
+        return vecValues[0].Angle(vecValues[1].Vect())
+
+    @staticmethod
+    def getBatchCode(out, args, tmp):
+        # calculates this function for a batch of events
+        # (see BatchFunction.py)
+        vec1, vec2 = args
+
+        lines = []
+
+        # the squared magnitudes of the momenta
+        for vec, mag2 in ((vec1, tmp[0]), (vec2, tmp[1])):
+            lines.extend([
+                "numpy.multiply(%s, %s, out = %s)" % (vec.px, vec.px, mag2),
+                "%s += numpy.multiply(%s, %s, out = %s)" % (mag2, vec.py, vec.py, tmp[2]),
+                "%s += numpy.multiply(%s, %s, out = %s)" % (mag2, vec.pz, vec.pz, tmp[2]),
+                ])
+
+        lines.extend([
+            "%s *= %s" % (tmp[0], tmp[1]),
+
+            # the scalar product
+            "numpy.multiply(%s, %s, out = %s)" % (vec1.px, vec2.px, out),
+            "%s += numpy.multiply(%s, %s, out = %s)" % (out, vec1.py, vec2.py, tmp[2]),
+            "%s += numpy.multiply(%s, %s, out = %s)" % (out, vec1.pz, vec2.pz, tmp[2]),
+
+            "%s /= numpy.sqrt(%s, out = %s)" % (out, tmp[0], tmp[2]),
+            "numpy.clip(%s, -1, 1, out = %s)" % (out, out),
+            "numpy.arccos(%s, out = %s)" % (out, out),
+            "%s[%s <= 0] = 0" % (out, tmp[0]),
+            ])
 
-        return self.vectors[0].getValue().Angle(self.vectors[1].getValue().Vect())
\ No newline at end of file
+        return lines
\ No newline at end of file
@@ -22,10 +22,17 @@ from .VectorDifferenceQuantity import VectorDifferenceQuantity
 class DeltaEta(VectorDifferenceQuantity):
     """ delta pseudorapidity between two vectors """
 
+    # declared argument constraints and symmetry
+    # (see kinvarbuilder.acceptsArguments(..) and getSymmetry(..))
+    needFourVectors = True
+    symmetry = 'antisymmetric'
+
+    __slots__ = ()
+
     def __init__(self, vector1, vector2):
         VectorDifferenceQuantity.__init__(self, vector1, vector2, True)
 
-    def getValue(self):
+    def calcValue(self):
         vecValues = [ vec.getValue() for vec in self.vectors ]
 
         for vecVal in vecValues:
@@ -33,3 +40,12 @@ class DeltaEta(VectorDifferenceQuantity):
                 return None
 
         return vecValues[0].Eta() - vecValues[1].Eta()
+
+    @staticmethod
+    def getBatchCode(out, args, tmp):
+        # calculates this function for a batch of events
+        # (see BatchFunction.py)
+        return [ "numpy.subtract(%s, %s, out = %s)" % (args[0].get('eta'), args[1].get('eta'), out) ]
+
+    def __str__(self):
+        return "DeltaEta(" + ", ".join(str(v) for v in self.vectors) +")"
@@ -24,6 +24,13 @@ import math
 class DeltaPhi(VectorDifferenceQuantity):
     """angle in transverse plane between vectors """
 
+    # declared argument constraints and symmetry
+    # (see kinvarbuilder.acceptsArguments(..) and getSymmetry(..))
+    needFourVectors = False
+    symmetry = 'antisymmetric'
+
+    __slots__ = ()
+
 
     def __init__(self, vector1, vector2):
 
@@ -31,7 +38,7 @@ class DeltaPhi(VectorDifferenceQuantity):
         # fourvectors
         VectorDifferenceQuantity.__init__(self, vector1, vector2, False)
 
-    def getValue(self):
+    def calcValue(self):
 
         vecValues = [ vec.getValue() for vec in self.vectors ]
 
@@ -53,5 +60,13 @@ class DeltaPhi(VectorDifferenceQuantity):
 
         return diff
 
+    @staticmethod
+    def getBatchCode(out, args, tmp):
+        # calculates this function for a batch of events
+        # (see BatchFunction.py)
+        return [ "numpy.subtract(%s, %s, out = %s)" % (args[0].get('phi'), args[1].get('phi'), out),
+                 "%s[%s > math.pi] -= 2 * math.pi" % (out, out),
+                 "%s[%s <= - math.pi] += 2 * math.pi" % (out, out) ]
+
     def __str__(self):
         return "DeltaPhi(" + ", ".join(str(v) for v in self.vectors) +")"
\ No newline at end of file
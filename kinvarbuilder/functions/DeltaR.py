@@ -25,6 +25,13 @@ import math
 class DeltaR(VectorDifferenceQuantity):
     """distance in (eta,phi) plane between vectors """
 
+    # declared argument constraints and symmetry
+    # (see kinvarbuilder.acceptsArguments(..) and getSymmetry(..))
+    needFourVectors = True
+    symmetry = 'symmetric'
+
+    __slots__ = ()
+
     def __init__(self, vector1, vector2):
 
         if not vector1.isFourVector() or not vector2.isFourVector():
@@ -34,7 +41,7 @@ class DeltaR(VectorDifferenceQuantity):
         # fourvectors
         VectorDifferenceQuantity.__init__(self, vector1, vector2, False)
 
-    def getValue(self):
+    def calcValue(self):
 
         vecValues = [ vec.getValue() for vec in self.vectors ]
 
@@ -61,5 +68,24 @@ class DeltaR(VectorDifferenceQuantity):
 
         return math.sqrt(deta * deta + dphi * dphi)
 
+    @staticmethod
+    def getBatchCode(out, args, tmp):
+        # calculates this function for a batch of events
+        # (see BatchFunction.py)
+        return [
+            # delta phi
+            "numpy.subtract(%s, %s, out = %s)" % (args[0].get('phi'), args[1].get('phi'), tmp[0]),
+            "%s[%s > math.pi] -= 2 * math.pi" % (tmp[0], tmp[0]),
+            "%s[%s <= - math.pi] += 2 * math.pi" % (tmp[0], tmp[0]),
+
+            # delta eta
+            "numpy.subtract(%s, %s, out = %s)" % (args[0].get('eta'), args[1].get('eta'), out),
+
+            "%s *= %s" % (out, out),
+            "%s *= %s" % (tmp[0], tmp[0]),
+            "%s += %s" % (out, tmp[0]),
+            "numpy.sqrt(%s, out = %s)" % (out, out),
+            ]
+
     def __str__(self):
         return "DeltaR(" + ", ".join(str(v) for v in self.vectors) +")"
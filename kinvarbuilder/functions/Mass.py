@@ -17,10 +17,21 @@
 # limitations under the License.
 
 
-from ..kinvarbuilder import CachingFunction, IllegalArgumentTypes
+from ..kinvarbuilder import Node, IllegalArgumentTypes
 
-@CachingFunction
-class Mass:
+class Mass(Node):
+
+    __slots__ = ('vectorSum',)
+
+    # declared argument constraints and symmetry
+    # (see kinvarbuilder.acceptsArguments(..) and getSymmetry(..))
+    #
+    # sums containing transverse vectors are not accepted: their mass
+    # is the transverse mass of the fourvectors and the transverse
+    # vectors in them, which TransverseMass already calculates
+    needFourVectors = True
+    minComponents = 2
+    symmetry = 'symmetric'
 
     #----------------------------------------
     def __init__(self, vectorSum):
@@ -28,9 +39,11 @@ class Mass:
         # do NOT take masses of single vectors
         # (although for jets this could make sense ?)
         
-        if vectorSum.numComponents() < 2:
+        if vectorSum.numComponents() < 2 or not vectorSum.isFourVector():
             raise IllegalArgumentTypes()
 
+        Node.__init__(self)
+
         self.vectorSum = vectorSum
     
     #----------------------------------------
@@ -39,7 +52,7 @@ class Mass:
 
     #----------------------------------------
 
-    def getValue(self):
+    def calcValue(self):
         vecVal = self.vectorSum.getValue()
 
         if vecVal == None:
@@ -48,6 +61,28 @@ class Mass:
     
     #----------------------------------------
 
+    @staticmethod
+    def getBatchCode(out, args, tmp):
+        # calculates the mass for a batch of events
+        # (see BatchFunction.py)
+        vec = args[0]
+
+        lines = [
+            "numpy.multiply(%s, %s, out = %s)" % (vec.px, vec.px, tmp[0]),
+            "%s += numpy.multiply(%s, %s, out = %s)" % (tmp[0], vec.py, vec.py, tmp[1]),
+            "%s += numpy.multiply(%s, %s, out = %s)" % (tmp[0], vec.pz, vec.pz, tmp[1]),
+            "numpy.multiply(%s, %s, out = %s)" % (vec.e, vec.e, out),
+            ]
+
+        return lines + [
+            "%s -= %s" % (out, tmp[0]),
+            # negative for spacelike vectors
+            "numpy.sqrt(numpy.abs(%s, out = %s), out = %s)" % (out, tmp[0], tmp[0]),
+            "numpy.copysign(%s, %s, out = %s)" % (tmp[0], out, out),
+            ]
+
+    #----------------------------------------
+
     @staticmethod
     def getNumArguments(maxNumArguments):
         # needs one group of vectors
@@ -18,21 +18,29 @@
 
 
 from .VectorDifferenceQuantity import VectorDifferenceQuantity
-from ..kinvarbuilder import CachingFunction, IllegalArgumentTypes
+from ..kinvarbuilder import Node, IllegalArgumentTypes
 
-@CachingFunction
 class MeanEta(VectorDifferenceQuantity):
     """ average pseudorapidity of two or more vectors, as a generalization
     of the mean pseudorapidity proposed by Zeppenfeld et. al. in hep-ph/9605444"""
 
+    # declared argument constraints and symmetry
+    # (see kinvarbuilder.acceptsArguments(..) and getSymmetry(..))
+    needFourVectors = True
+    symmetry = 'symmetric'
+
+    __slots__ = ()
+
     def __init__(self, *vectors):
+        Node.__init__(self)
+
         self.vectors = vectors
 
         for vector in self.vectors:
             if not vector.isFourVector():
                 raise IllegalArgumentTypes()
 
-    def getValue(self):
+    def calcValue(self):
         vecValues = [ vec.getValue() for vec in self.vectors ]
 
         for vecVal in vecValues:
@@ -42,14 +50,18 @@ class MeanEta(VectorDifferenceQuantity):
         sumEta = sum([ vec.Eta() for vec in vecValues ])
         return sumEta / float(len(vecValues))
 
+    @staticmethod
+    def getBatchCode(out, args, tmp):
+        # calculates this function for a batch of events
+        # (see BatchFunction.py)
+        return [ "numpy.copyto(%s, %s)" % (out, args[0].get('eta')) ] + [
+            "%s += %s" % (out, arg.get('eta')) for arg in args[1:] ] + [
+            "%s /= %s" % (out, repr(float(len(args)))) ]
+
     @staticmethod
     def getNumArguments(maxNumArguments):
         return range(2, maxNumArguments + 1)
 
-    #----------------------------------------
-    def getParents(self):
-        return self.vectors
-
     #----------------------------------------
     def __str__(self):
         return "MeanEta(" + ",".join([ str(x) for x in self.vectors]) + ")"
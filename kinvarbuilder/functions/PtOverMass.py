@@ -17,13 +17,21 @@
 # limitations under the License.
 
 
-from ..kinvarbuilder import CachingFunction, IllegalArgumentTypes
+from ..kinvarbuilder import Node, IllegalArgumentTypes
 
-@CachingFunction
-class PtOverMass:
+class PtOverMass(Node):
+
+    __slots__ = ('vectors',)
+
+    # declared argument constraints and symmetry
+    # (see kinvarbuilder.acceptsArguments(..) and getSymmetry(..))
+    needFourVectors = True
+    symmetry = 'ordered'
 
     def __init__(self, vector1, vector2):
 
+        Node.__init__(self)
+
         self.vectors = [vector1, vector2]
 
         # we need fourvectors (even if massless, i.e. actually
@@ -33,7 +41,7 @@ class PtOverMass:
             if not vector.isFourVector():
                 raise IllegalArgumentTypes()
 
-    def getValue(self):
+    def calcValue(self):
         # TODO: for the moment we just calculate pt of the first vector (sum)
         # over the mass of both vectors combined. We should have a way
         # of specifying that the second vector should be taken
@@ -51,6 +59,27 @@ class PtOverMass:
     def getParents(self):
         return self.vectors
 
+    @staticmethod
+    def getBatchCode(out, args, tmp):
+        # calculates this function for a batch of events
+        # (see BatchFunction.py)
+        return [
+            # the sum of the two vectors
+            "numpy.add(%s, %s, out = %s)" % (getattr(args[0], component), getattr(args[1], component), tmp[index])
+            for index, component in enumerate(('px', 'py', 'pz', 'e'))
+            ] + [
+            # its mass
+            "%s *= %s" % (tmp[0], tmp[0]),
+            "%s += numpy.multiply(%s, %s, out = %s)" % (tmp[0], tmp[1], tmp[1], tmp[1]),
+            "%s += numpy.multiply(%s, %s, out = %s)" % (tmp[0], tmp[2], tmp[2], tmp[2]),
+            "numpy.multiply(%s, %s, out = %s)" % (tmp[3], tmp[3], out),
+            "%s -= %s" % (out, tmp[0]),
+            "numpy.sqrt(numpy.abs(%s, out = %s), out = %s)" % (out, tmp[0], tmp[0]),
+            "numpy.copysign(%s, %s, out = %s)" % (tmp[0], out, out),
+
+            "numpy.divide(%s, %s, out = %s)" % (args[0].get('pt'), out, out),
+            ]
+
     @staticmethod
     def getNumArguments(maxNumArguments):
         return [ 2 ]
@@ -16,22 +16,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from ..kinvarbuilder import CachingFunction
+from ..kinvarbuilder import Node
 
-@CachingFunction
-class SumPt:
+class SumPt(Node):
     """ scalar sum of transverse momenta of two or more objects
     (which themselves can be sums of vectors)
     """
-    # TODO: this function is invariant under the permutations
-    #       of the parameters, i.e. we might produce the same
-    #       quantity multiple times
+
+    # declared argument constraints and symmetry
+    # (see kinvarbuilder.acceptsArguments(..) and getSymmetry(..))
+    needFourVectors = False
+    symmetry = 'symmetric'
+
+    __slots__ = ('vectors',)
 
     def __init__(self, *args):
 
+        Node.__init__(self)
+
         self.vectors = args
 
-    def getValue(self):
+    def calcValue(self):
         # TODO: for the moment we just calculate pt of the first vector (sum)
         # over the mass of both vectors combined. We should have a way
         # of specifying that the second vector should be taken
@@ -48,6 +53,13 @@ class SumPt:
     def getParents(self):
         return self.vectors
 
+    @staticmethod
+    def getBatchCode(out, args, tmp):
+        # calculates this function for a batch of events
+        # (see BatchFunction.py)
+        return [ "numpy.copyto(%s, %s)" % (out, args[0].get('pt')) ] + [
+            "%s += %s" % (out, arg.get('pt')) for arg in args[1:] ]
+
     @staticmethod
     def getNumArguments(maxNumArguments):
         # for the moment, we exclude the pt of a single
@@ -17,15 +17,31 @@
 # limitations under the License.
 
 
-from ..kinvarbuilder import CachingFunction, IllegalArgumentTypes
+from ..kinvarbuilder import Node, IllegalArgumentTypes
 import math
 
-@CachingFunction
-class TransverseMass:
+class TransverseMass(Node):
+
+    __slots__ = ('vector1', 'vector2')
+
+    # declared argument constraints and symmetry
+    # (see kinvarbuilder.acceptsArguments(..) and getSymmetry(..))
+    needFourVectors = False
+    symmetry = 'symmetric'
 
     #----------------------------------------
     def __init__(self, vector1, vector2):
 
+        # do not take sums of fourvectors and transverse vectors as
+        # arguments: these only add the transverse energies of their parts,
+        # i.e. MT(A + met, B) is MT(A, B + met) and MT(A + met1, met2)
+        # is MT(A, met1 + met2)
+
+        if vector1.isMixed() or vector2.isMixed():
+            raise IllegalArgumentTypes()
+
+        Node.__init__(self)
+
         self.vector1 = vector1
         self.vector2 = vector2
     
@@ -35,7 +51,7 @@ class TransverseMass:
 
     #----------------------------------------
 
-    def getValue(self):
+    def calcValue(self):
 
         vecVal1 = self.vector1.getValue()
         vecVal2 = self.vector2.getValue()
@@ -59,6 +75,31 @@ class TransverseMass:
     
     #----------------------------------------
 
+    @staticmethod
+    def getBatchCode(out, args, tmp):
+        # calculates the transverse mass for a batch of events
+        # (see BatchFunction.py)
+        #
+        # the transverse energies are calculated as
+        # TLorentzVector.Et() does for fourvectors
+        return [
+            "numpy.add(%s, %s, out = %s)" % (args[0].get('et'), args[1].get('et'), out),
+            "%s *= %s" % (out, out),
+
+            "numpy.add(%s, %s, out = %s)" % (args[0].px, args[1].px, tmp[0]),
+            "%s *= %s" % (tmp[0], tmp[0]),
+            "%s -= %s" % (out, tmp[0]),
+
+            "numpy.add(%s, %s, out = %s)" % (args[0].py, args[1].py, tmp[0]),
+            "%s *= %s" % (tmp[0], tmp[0]),
+            "%s -= %s" % (out, tmp[0]),
+
+            "numpy.sqrt(numpy.abs(%s, out = %s), out = %s)" % (out, tmp[0], tmp[0]),
+            "numpy.copysign(%s, %s, out = %s)" % (tmp[0], out, out),
+            ]
+
+    #----------------------------------------
+
     @staticmethod
     def getNumArguments(maxNumArguments):
         # for the moment, require exactly two arguments
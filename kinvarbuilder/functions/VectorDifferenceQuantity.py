@@ -17,13 +17,14 @@
 # limitations under the License.
 
 
-from ..kinvarbuilder import CachingFunction, IllegalArgumentTypes
+from ..kinvarbuilder import Node, IllegalArgumentTypes
 
-@CachingFunction
-class VectorDifferenceQuantity:
+class VectorDifferenceQuantity(Node):
     # base class for quantities calculating a difference like
     # quantity of two (sums of) vectors
 
+    __slots__ = ('vectors',)
+
     #----------------------------------------
 
     def __init__(self, vector1, vector2, needFourvectors):
@@ -34,6 +35,8 @@ class VectorDifferenceQuantity:
         # take the delta Eta between the sums of vectors
         # with different signs
 
+        Node.__init__(self)
+
         self.vectors = [vector1, vector2]
 
         if needFourvectors:
@@ -44,6 +47,12 @@ class VectorDifferenceQuantity:
                 if not vector.isFourVector():
                     raise IllegalArgumentTypes()
 
+    #----------------------------------------
+
+    def getParents(self):
+        return self.vectors
+
+    #----------------------------------------
 
     @staticmethod
     def getNumArguments(maxNumArguments):
@@ -16,41 +16,170 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+import types
+import importlib
 
-import os
-import glob
+# the functions in this directory: maps from the name of the function
+# (class) to the name of the module it is defined in.
+#
+# The modules are only imported when the function is first accessed
+# as attribute of this package.
+_functionModules = {
+    'AbsDeltaEta'              : 'AbsDeltaEta',
+    'Angle3D'                  : 'Angle3D',
+    'DeltaEta'                 : 'DeltaEta',
+    'DeltaPhi'                 : 'DeltaPhi',
+    'DeltaR'                   : 'DeltaR',
+    'Mass'                     : 'Mass',
+    'MeanEta'                  : 'MeanEta',
+    'PtOverMass'               : 'PtOverMass',
+    'SumPt'                    : 'SumPt',
+    'TransverseMass'           : 'TransverseMass',
+    'VectorDifferenceQuantity' : 'VectorDifferenceQuantity',
+}
+
+__all__ = sorted(_functionModules.keys())
+
+# functions provided by other packages, in the order they were registered
+_pluginFunctions = []
+
+# maps from plugin functions to the name they were registered with
+_pluginFunctionNames = {}
+
+# entry point group under which other packages can provide functions
+pluginEntryPointGroup = 'kinvarbuilder.functions'
+
+#----------------------------------------------------------------------
+
+def registerFunction(func, name = None):
+    # makes an additional function available as attribute of
+    # this package and adds it to the default list of functions
+    # used by VarBuilder (see getPluginFunctions())
+    #
+    # the function should declare its argument constraints
+    # (see kinvarbuilder.acceptsArguments(..))
+
+    if name == None:
+        name = func.__name__
+
+    if name in _functionModules:
+        raise ValueError("function name %s is already used by a built-in function" % name)
+
+    if func not in _pluginFunctions:
+        _pluginFunctions.append(func)
+        _pluginFunctionNames[func] = name
+
+    setattr(sys.modules[__name__], name, func)
+
+#----------------------------------------------------------------------
+
+def getPluginFunctions():
+    # @return the list of functions registered with registerFunction(..)
+    return list(_pluginFunctions)
+
+#----------------------------------------------------------------------
+
+def getFunctionName(func):
+    # @return a name by which the given function can be retrieved
+    # with getFunction(..): the name of a built-in or registered function
+    # or 'module:attribute' for other functions (e.g. for describing
+    # the variables built by a VarBuilder, see VarBuilder.getGraphSpec())
+
+    if func in _pluginFunctionNames:
+        return _pluginFunctionNames[func]
+
+    # a built-in function (compared by module and name such that
+    # the other function modules are not imported)
+    name = getattr(func, '__name__', None)
+
+    if name in _functionModules and func.__module__ == __name__ + "." + _functionModules[name]:
+        return name
+
+    # search the module the function was defined in
+    module = sys.modules.get(func.__module__)
+
+    if module != None:
+        for name, value in module.__dict__.items():
+            if value is func:
+                return func.__module__ + ":" + name
+
+    raise ValueError("could not find a name for function %s" % func.__name__)
+
+#----------------------------------------------------------------------
+
+def getFunction(name):
+    # @return the function with the given name (see getFunctionName(..))
+
+    if ':' in name:
+        moduleName, attribute = name.split(':', 1)
+        return getattr(importlib.import_module(moduleName), attribute)
+
+    try:
+        return getattr(sys.modules[__name__], name)
+    except AttributeError:
+        raise ValueError("unknown function '%s' (plugin functions must be registered first)" % name)
+
+#----------------------------------------------------------------------
+
+def loadPlugins():
+    # registers the functions provided by other packages through
+    # entry points in the group given by pluginEntryPointGroup, e.g.
+    # in their setup.py:
+    #
+    #   entry_points = { 'kinvarbuilder.functions': [ 'MyFunc = mypackage.MyFunc:MyFunc' ] }
+    #
+    # (pkg_resources is only imported here because importing it is slow)
+    #
+    # @return the list of functions loaded
+
+    import pkg_resources
+
+    retval = []
+
+    for entryPoint in pkg_resources.iter_entry_points(pluginEntryPointGroup):
+        func = entryPoint.load()
+        registerFunction(func, entryPoint.name)
+        retval.append(func)
+
+    return retval
+
+#----------------------------------------------------------------------
 
-# import all functions in the current directory
+class _LazyFunctionModule(types.ModuleType):
+    # replaces this package in sys.modules, importing the
+    # module of a function when it is first accessed
 
-# get all .py files in this directory
-pythonFiles = glob.glob(os.path.dirname(__file__)+"/*.py")
+    def __getattr__(self, name):
+        if name not in _functionModules:
+            raise AttributeError("module '%s' has no attribute '%s'" % (self.__name__, name))
 
-__all__ = []
+        importlib.import_module('.' + _functionModules[name], self.__name__)
 
-# getattr(__import__('Mass', fromlist=['.Mass']),'Mass')
+        self.__resolveModules()
 
-funcNames = [ os.path.basename(pythonFile)[:-3] for pythonFile in pythonFiles ]
+        return self.__dict__[name]
 
-for funcName in funcNames:
-    if funcName == '__init__':
-        continue
+    def __resolveModules(self):
+        # importing a submodule sets an attribute of the package
+        # with the name of the submodule, replace these by the
+        # functions defined in them
+        for name, moduleName in _functionModules.items():
+            value = self.__dict__.get(name)
 
-    # getattr(__import__(funcName, fromlist=["." + funcName]), funcName)
-    __all__.append(funcName)
+            if isinstance(value, types.ModuleType):
+                setattr(self, name, getattr(value, name))
 
-    # __import__(funcName, locals(), globals())
+    def __dir__(self):
+        return sorted(set(self.__dict__.keys()) | set(_functionModules.keys()))
 
-    # locals()[funcName] = getattr(locals()[funcName],funcName)
+#----------------------------------------------------------------------
 
-    locals()[funcName] = getattr(__import__(funcName, locals(), globals()), funcName)
+_lazyModule = _LazyFunctionModule(__name__, __doc__)
+_lazyModule.__dict__.update(globals())
 
-#----------
-# cleanup
-#----------
-del funcName
-del funcNames
-del pythonFiles
-del pythonFile
+# keep a reference to the original module, its functions
+# refer to its globals
+_lazyModule._originalModule = sys.modules[__name__]
 
-del os
-del glob
\ No newline at end of file
+sys.modules[__name__] = _lazyModule
@@ -16,6 +16,73 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import abc
+
+#----------------------------------------------------------------------
+
+# marks that the value of a node was not yet calculated for
+# the current event (None is a valid value meaning 'undefined')
+_notCached = object()
+
+class Node(object):
+    # base class for the objects in the graph of quantities
+    # (input vectors, sums of vectors and functions) which
+    # caches the value calculated for the current event.
+    #
+    # This is an abstract base class: subclasses must override
+    # calcValue() (instead of getValue()), classes which do not can
+    # not be instantiated (e.g. VectorDifferenceQuantity). They
+    # implement getParents() returning the nodes they depend on
+    # (if any) and must declare the attributes they use in __slots__
+    # (an empty tuple if they don't add any) such that instances
+    # have no __dict__.
+
+    __metaclass__ = abc.ABCMeta
+
+    __slots__ = ('cachedValue',)
+
+    def __init__(self):
+        self.cachedValue = _notCached
+
+    def newEvent(self):
+        # this is called when a new event is read from the tree,
+        # invalidates the cache of this node and the nodes it depends on
+        #
+        # a node which was not evaluated since the last call
+        # can not have caused its parents to be evaluated, so
+        # we need not to go further up in this case
+        if self.cachedValue is _notCached:
+            return
+
+        self.cachedValue = _notCached
+
+        for parent in self.getParents():
+            parent.newEvent()
+
+    def resetCache(self):
+        # forgets the value cached for the current event without
+        # going to the parents, e.g. when an input vector starts
+        # reading from another tree (where newEvent() would not
+        # reach it if it was last evaluated through another graph
+        # sharing it)
+        self.cachedValue = _notCached
+
+    def getValue(self):
+        value = self.cachedValue
+
+        if value is _notCached:
+            value = self.cachedValue = self.calcValue()
+
+        return value
+
+    @abc.abstractmethod
+    def calcValue(self):
+        # @return the value for the current event or None
+        # if it is not defined for this event
+        pass
+
+    def getParents(self):
+        return ()
 
 #----------------------------------------------------------------------
 
@@ -25,6 +92,9 @@ def CachingFunction(wrappedClass):
     #
     # note that this is a function (with a class inside), NOT a class itself
     #
+    # the classes in this package derive from Node instead, this
+    # is kept for functions defined elsewhere
+    #
     # see e.g. https://www.inkling.com/read/learning-python-mark-lutz-4th/chapter-38/coding-class-decorators
 
     class Wrapper(object):
@@ -55,6 +125,13 @@ def CachingFunction(wrappedClass):
 
         def __getattr__(self, item):
             # this is for calling the methods on the wrapped function
+            #
+            # (this is only called when the attribute is not found in the
+            # usual way, so wrappedObj is not set yet e.g. when unpickling,
+            # make sure we do not recurse infinitely then)
+            if item == 'wrappedObj':
+                raise AttributeError(item)
+
             return getattr(self.wrappedObj, item)
 
         def getParents(self):
@@ -79,8 +156,17 @@ def CachingFunction(wrappedClass):
     # create a dynamic subclass to decorate the static/class methods
     retval = type('Wrapped' + wrappedClass.__name__, (Wrapper,), {})
 
+    # make the wrapper appear to be defined where the wrapped class is
+    retval.__module__ = wrappedClass.__module__
+
     setattr(retval, 'getNumArguments', staticmethod(lambda maxNumArguments: wrappedClass.getNumArguments(maxNumArguments)))
 
+    # also make the declared argument constraints available
+    # on the class (see acceptsArguments(..))
+    for attr in ('needFourVectors', 'minComponents', 'symmetry', 'functionOf'):
+        if hasattr(wrappedClass, attr):
+            setattr(retval, attr, getattr(wrappedClass, attr))
+
     # return Wrapper
     return retval
 
@@ -93,6 +179,62 @@ class IllegalArgumentTypes(Exception):
 
 #----------------------------------------------------------------------
 
+def acceptsArguments(func, argumentTypes):
+    # checks the argument constraints declared by a function
+    # class without creating an instance of it. Functions
+    # can declare the following class attributes:
+    #
+    #   needFourVectors  if True, all arguments must be sums of fourvectors
+    #                    (i.e. transverse vectors are not accepted)
+    #   minComponents    the minimum number of input vectors
+    #                    in the sum given for each argument
+    #
+    # together with getNumArguments(..) for the number of arguments.
+    #
+    # @param argumentTypes is a list with one (isFourVector, numComponents)
+    #        tuple per argument
+    #
+    # @return False if the declared constraints exclude these arguments.
+    #        Functions not declaring constraints accept any arguments
+    #        here (but their constructor may still raise IllegalArgumentTypes)
+
+    needFourVectors = getattr(func, 'needFourVectors', False)
+    minComponents = getattr(func, 'minComponents', 1)
+
+    for isFourVector, numComponents in argumentTypes:
+        if needFourVectors and not isFourVector:
+            return False
+
+        if numComponents < minComponents:
+            return False
+
+    return True
+
+#----------------------------------------------------------------------
+
+def getSymmetry(func):
+    # @return the behaviour of the given function under permutations
+    # of its arguments, declared by the class attribute 'symmetry':
+    #
+    #   'symmetric'      the value does not change
+    #   'antisymmetric'  the value changes sign when exchanging two arguments
+    #   'ordered'        the order of the arguments matters
+    #
+    # For symmetric and antisymmetric functions, only one (canonical)
+    # order of the arguments is used. Functions not declaring
+    # their symmetry are treated as ordered, i.e. they are applied
+    # to all orders of their arguments (nothing is dropped unless
+    # the function declares that it can be dropped).
+
+    symmetry = getattr(func, 'symmetry', 'ordered')
+
+    if symmetry not in ('symmetric', 'antisymmetric', 'ordered'):
+        raise ValueError("unknown symmetry '%s' declared by %s" % (symmetry, func.__name__))
+
+    return symmetry
+
+#----------------------------------------------------------------------
+
 #----------------------------------------------------------------------
 
 def makePartitions(items, numsubsets):
@@ -101,63 +243,48 @@ def makePartitions(items, numsubsets):
 
     assert numsubsets >= 1
 
-    # generate a 'power set': a set and the rest
-    # then recursively generate partitions with numsubsets - 1 groups
-    # and join them 
+    # assign each item either to none or to one of the groups.
+    # A new group is only opened by the first item in it, i.e. the
+    # groups are numbered by their first item, such that each
+    # set of groups is generated exactly once (and we do not need
+    # to eliminate duplicates afterwards)
 
     numItems = len(items)
 
     retval = []
 
-    for i in range(1 << numItems):
-
-        thisGroup = []
+    groups = []
 
-        otherGroup = []
+    def assign(pos):
+        if numsubsets - len(groups) > numItems - pos:
+            # not enough items left to fill the remaining groups
+            return
 
-        for j in range(numItems):
-            if i & (1 << j):
-                thisGroup.append(items[j])
-            else:
-                otherGroup.append(items[j])
-
-        # skip empty sets
-        if not thisGroup:
-            continue
-
-        if numsubsets == 1:
-            retval.append([thisGroup])
-        else:
-            if not otherGroup:
-                continue
+        if pos == numItems:
+            # sort the groups such that the order of the
+            # groups is the same for equal sets of groups
+            retval.append(sorted([ list(group) for group in groups ]))
+            return
 
-            for subs in makePartitions(otherGroup, numsubsets - 1):
-                retval.append(sorted([ thisGroup ] + subs))
+        item = items[pos]
 
+        # do not use this item
+        assign(pos + 1)
 
-    # end of loop over powers
+        # add the item to one of the existing groups
+        for group in groups:
+            group.append(item)
+            assign(pos + 1)
+            group.pop()
 
-    #----------
-    # eliminate dupliactes
-    #----------
-
-    # this is probably not the most efficient way
-    # but it works for small sets
-    
-    retval2 = []
-
-    seen = set()
-     
-    for line in retval:
-        # line is a list of lists
-        #
-        # sort the groups such that we avoid duplicates
-        line2 = tuple([tuple(x) for x in line])
+        # open a new group with this item
+        if len(groups) < numsubsets:
+            groups.append([ item ])
+            assign(pos + 1)
+            groups.pop()
 
-        if not line2 in seen:
-            seen.add(line2)
-            retval2.append(line)
+    assign(0)
 
-    return sorted(retval2)
+    return sorted(retval)
 
 #----------------------------------------------------------------------
@@ -29,7 +29,8 @@ setup(
     author_email = 'andre.holzner@gmail.com',
     description = 'A library for building kinematic variables systematically',
     long_description = '',
-    packages = find_packages(),
+    packages = find_packages(exclude = [ 'tests' ]),
+    test_suite = 'tests',
     include_package_data = True,
     platforms = 'any',
     classifiers = [
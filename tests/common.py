@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#----------------------------------------------------------------------
+# common setup of the tests: the fake ROOT module (also when ROOT
+# is installed, such that the input trees can be created from
+# numpy arrays) and input trees with a few particles
+#----------------------------------------------------------------------
+
+import sys
+
+from . import fakeroot
+sys.modules['ROOT'] = fakeroot
+
+import numpy
+import kinvarbuilder
+
+#----------------------------------------------------------------------
+
+def makeColumns(numEvents, seed = 1):
+    # @return a dict with the columns of an input tree with two leptons,
+    # a jet (which may be missing) and missing transverse energy
+    randomState = numpy.random.RandomState(seed)
+
+    retval = {}
+
+    for prefix in ('l1', 'l2', 'j1'):
+        retval[prefix + 'pt'] = randomState.exponential(40, numEvents) + 5
+        retval[prefix + 'eta'] = randomState.normal(0, 1.5, numEvents)
+        retval[prefix + 'phi'] = randomState.uniform(-numpy.pi, numpy.pi, numEvents)
+        retval[prefix + 'm'] = randomState.uniform(0.1, 5, numEvents)
+
+    retval['j1valid'] = (randomState.uniform(0, 1, numEvents) > 0.2).astype('f8')
+
+    retval['metet'] = randomState.exponential(30, numEvents)
+    retval['metphi'] = randomState.uniform(-numpy.pi, numpy.pi, numEvents)
+
+    retval['weight'] = randomState.uniform(0.5, 1.5, numEvents)
+    retval['evt'] = numpy.arange(numEvents, dtype = 'i8') * 7
+
+    return retval
+
+#----------------------------------------------------------------------
+
+def makeTree(numEvents, seed = 1, name = 't'):
+    return fakeroot.makeTree(name, makeColumns(numEvents, seed))
+
+#----------------------------------------------------------------------
+
+def makeVarBuilder(withMet = True, hadronCollider = True):
+    # @return a VarBuilder (with the output variables created) for the
+    # particles of the trees returned by makeTree(..)
+    inputVectors = [ kinvarbuilder.FourVector('l1pt', 'l1eta', 'l1phi', 'l1m'),
+                     kinvarbuilder.FourVector('l2pt', 'l2eta', 'l2phi', 0),
+                     kinvarbuilder.FourVector('j1pt', 'j1eta', 'j1phi', 'j1m', validExpr = 'j1valid'),
+                     ]
+
+    if withMet:
+        inputVectors.append(kinvarbuilder.TransverseVector('metphi', 'metet'))
+
+    retval = kinvarbuilder.VarBuilder(inputVectors, not hadronCollider)
+    retval.makeDerived()
+
+    return retval
+
+#----------------------------------------------------------------------
+
+def assertArraysEqual(testCase, expected, actual):
+    # checks that the two record arrays have the same columns
+    # and values (undefined values are NaN or equal)
+    testCase.assertEqual(expected.dtype.names, actual.dtype.names)
+
+    for name in expected.dtype.names:
+        testCase.assertTrue(numpy.allclose(expected[name], actual[name], rtol = 1e-5, atol = 1e-6, equal_nan = True),
+                            "column %s differs" % name)
@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#----------------------------------------------------------------------
+# a minimal replacement for the parts of PyROOT used by kinvarbuilder,
+# such that the tests run without ROOT:
+#
+#   - trees hold their columns as numpy arrays, TTree::Draw(..)
+#     evaluates expressions as python expressions of the columns
+#     ('Entry$' is the index of the event)
+#
+#   - files are kept in memory (see the module variable 'disk'):
+#     a tree attached to a file is only visible to TFile::Get(..)
+#     after TTree::AutoSave(..) or TTree::Write(..), with the entries
+#     it had at that time (as the tree header on disk in ROOT)
+#----------------------------------------------------------------------
+
+import math
+import numpy
+
+# maps from the file name to a dict of the objects saved to the file
+# (the name of the tree to a list of (branchName, values, leafType))
+disk = {}
+
+# if not None, trees are saved automatically every this number
+# of entries (as ROOT does by default every ~300 MB) unless
+# TTree::SetAutoSave(..) was called
+defaultAutoSave = None
+
+# the TFile objects created so far
+openedFiles = []
+
+#----------------------------------------------------------------------
+
+def reset():
+    # removes all files
+    global defaultAutoSave
+
+    disk.clear()
+    defaultAutoSave = None
+
+    del openedFiles[:]
+    del savedImages[:]
+    ROOT.threadSafetyEnabled = False
+
+#----------------------------------------------------------------------
+
+def makeTree(name, columns):
+    # @return a TTree with the given columns (a list of (name, array)
+    # or a dict, the branches are then ordered by name)
+    if isinstance(columns, dict):
+        columns = sorted(columns.items())
+
+    retval = TTree(name, "")
+
+    for branchName, values in columns:
+        retval.branchNames.append(branchName)
+        retval.columns[branchName] = numpy.asarray(values)
+
+    retval.numEntries = len(columns[0][1]) if columns else 0
+
+    return retval
+
+#----------------------------------------------------------------------
+
+def writeFile(fileName, trees):
+    # creates a file with the given trees
+    disk[fileName] = dict((tree.GetName(), tree.getSnapshot()) for tree in trees)
+
+#----------------------------------------------------------------------
+
+def readColumns(fileName, treeName):
+    # @return a dict with the values of the branches of the given
+    # tree as saved in the given file (None if it does not exist)
+    snapshot = disk.get(fileName, {}).get(treeName)
+
+    if snapshot == None:
+        return None
+
+    return dict((branchName, values) for branchName, values, leafType in snapshot)
+
+#----------------------------------------------------------------------
+
+class TVector3(object):
+
+    def __init__(self, x = 0., y = 0., z = 0.):
+        self.x, self.y, self.z = x, y, z
+
+#----------------------------------------------------------------------
+
+class TLorentzVector(object):
+
+    def __init__(self, x = 0., y = 0., z = 0., t = 0.):
+        self.SetXYZT(x, y, z, t)
+
+    def SetXYZT(self, x, y, z, t):
+        self.x, self.y, self.z, self.t = float(x), float(y), float(z), float(t)
+
+    def SetPtEtaPhiM(self, pt, eta, phi, m):
+        pt = abs(pt)
+        x, y, z = pt * math.cos(phi), pt * math.sin(phi), pt * math.sinh(eta)
+
+        if m >= 0:
+            t = math.sqrt(x * x + y * y + z * z + m * m)
+        else:
+            t = math.sqrt(max(x * x + y * y + z * z - m * m, 0))
+
+        self.SetXYZT(x, y, z, t)
+
+    def __iadd__(self, other):
+        self.SetXYZT(self.x + other.x, self.y + other.y, self.z + other.z, self.t + other.t)
+        return self
+
+    def __add__(self, other):
+        return TLorentzVector(self.x + other.x, self.y + other.y, self.z + other.z, self.t + other.t)
+
+    def Px(self): return self.x
+    def Py(self): return self.y
+    def Pz(self): return self.z
+    def E(self): return self.t
+
+    def Pt(self):
+        return math.sqrt(self.x * self.x + self.y * self.y)
+
+    def M(self):
+        m2 = self.t * self.t - self.x * self.x - self.y * self.y - self.z * self.z
+        return math.sqrt(m2) if m2 >= 0 else -math.sqrt(-m2)
+
+    def Phi(self):
+        if self.x == 0 and self.y == 0:
+            return 0.
+        return math.atan2(self.y, self.x)
+
+    def Eta(self):
+        pt = self.Pt()
+        if pt == 0:
+            return 0. if self.z == 0 else math.copysign(10e10, self.z)
+        return math.asinh(self.z / pt)
+
+    def Et(self):
+        pt2 = self.x * self.x + self.y * self.y
+        p2 = pt2 + self.z * self.z
+        if p2 == 0 or pt2 == 0:
+            return 0.
+        et = math.sqrt(self.t * self.t * pt2 / p2)
+        return et if self.t >= 0 else -et
+
+    def Vect(self):
+        return TVector3(self.x, self.y, self.z)
+
+    def Angle(self, v):
+        norm2 = (self.x ** 2 + self.y ** 2 + self.z ** 2) * (v.x ** 2 + v.y ** 2 + v.z ** 2)
+        if norm2 <= 0:
+            return 0.
+        cosine = (self.x * v.x + self.y * v.y + self.z * v.z) / math.sqrt(norm2)
+        return math.acos(max(-1., min(1., cosine)))
+
+#----------------------------------------------------------------------
+
+class _Named(object):
+    def __init__(self, name):
+        self.name = name
+
+    def GetName(self):
+        return self.name
+
+class _Leaf(_Named):
+    def __init__(self, name, typeName):
+        _Named.__init__(self, name)
+        self.typeName = typeName
+
+    def GetTypeName(self):
+        return self.typeName
+
+# the leaf types of the branch type codes (as in TTree::Branch(..))
+_branchTypeToLeafType = { 'O': 'Bool_t', 'B': 'Char_t', 'b': 'UChar_t', 'S': 'Short_t', 's': 'UShort_t',
+                          'I': 'Int_t', 'i': 'UInt_t', 'L': 'Long64_t', 'l': 'ULong64_t',
+                          'f': 'Float16_t', 'F': 'Float_t', 'D': 'Double_t' }
+
+_dtypeToLeafType = { 'b1': 'Bool_t',
+                     'i1': 'Char_t', 'u1': 'UChar_t', 'i2': 'Short_t', 'u2': 'UShort_t',
+                     'i4': 'Int_t', 'u4': 'UInt_t', 'i8': 'Long64_t', 'u8': 'ULong64_t',
+                     'f4': 'Float_t', 'f8': 'Double_t' }
+
+#----------------------------------------------------------------------
+
+class TTree(object):
+
+    def __init__(self, name, title = ""):
+        self.name = name
+
+        self.branchNames = []
+
+        # the ROOT type names of the leaves (for the branches not
+        # created from numpy arrays)
+        self.leafTypes = {}
+
+        # the values of the branches (a numpy array or a list
+        # of values filled)
+        self.columns = {}
+
+        self.numEntries = 0
+
+        # the buffers of the branches for Fill()
+        self.buffers = {}
+
+        self.directory = None
+        self.autoSave = defaultAutoSave
+
+        # result of the last call to Draw(..)
+        self.v1 = None
+
+        # the (expression, selection) and the range of events
+        # (begin, end) of each call to Draw(..)
+        self.drawCalls = []
+        self.drawRanges = []
+
+    #----------------------------------------
+    # reading
+    #----------------------------------------
+
+    def GetName(self):
+        return self.name
+
+    def GetEntries(self):
+        return self.numEntries
+
+    def GetLeaf(self, name):
+        if not name in self.columns:
+            return None
+
+        leafType = self.leafTypes.get(name)
+        if leafType == None:
+            leafType = _dtypeToLeafType.get(numpy.asarray(self.columns[name]).dtype.str[1:], 'Double_t')
+
+        return _Leaf(name, leafType)
+
+    def GetListOfBranches(self):
+        return [ _Named(name) for name in self.branchNames ]
+
+    def __evaluate(self, expression, indices):
+        namespace = dict((name, numpy.asarray(values)[indices]) for name, values in self.columns.items())
+        namespace['numpy'] = numpy
+
+        expression = expression.replace('Entry$', "namespace_entry")
+        namespace['namespace_entry'] = indices
+
+        return numpy.asarray(eval(expression, namespace), dtype = 'f8') * numpy.ones(len(indices))
+
+    def Draw(self, expression, selection = "", option = "", nentries = 1000000000, firstentry = 0):
+        self.drawCalls.append((expression, selection))
+
+        indices = numpy.arange(firstentry, min(firstentry + nentries, self.numEntries))
+        self.drawRanges.append((firstentry, firstentry + len(indices)))
+
+        values = self.__evaluate(expression, indices)
+
+        if selection:
+            values = values[self.__evaluate(selection, indices) != 0]
+
+        self.v1 = numpy.array(values, dtype = 'f8')
+
+        return len(values)
+
+    def GetV1(self):
+        return self.v1
+
+    def GetSelectedRows(self):
+        return len(self.v1)
+
+    #----------------------------------------
+    # writing
+    #----------------------------------------
+
+    def SetDirectory(self, directory):
+        self.directory = directory
+
+    def SetAutoSave(self, autoSave):
+        self.autoSave = autoSave
+
+    def Branch(self, name, buffer, leafList):
+        self.branchNames.append(name)
+        self.leafTypes[name] = _branchTypeToLeafType[leafList.split('/')[-1]]
+        self.columns[name] = []
+        self.buffers[name] = buffer
+
+    def SetBranchAddress(self, name, buffer):
+        assert name in self.columns
+        self.buffers[name] = buffer
+
+    def Fill(self):
+        for name in self.branchNames:
+            self.columns[name].append(self.buffers[name][0])
+
+        self.numEntries += 1
+
+        if self.autoSave and self.numEntries % self.autoSave == 0:
+            self.AutoSave()
+
+    def getSnapshot(self):
+        # @return the (branchName, values, leafType) of this tree
+        retval = []
+
+        for name in self.branchNames:
+            values = self.columns[name]
+            if isinstance(values, list):
+                dtype = self.buffers[name].dtype if name in self.buffers else 'f8'
+                values = numpy.array(values, dtype = dtype)
+
+            retval.append((name, values.copy(), self.GetLeaf(name).GetTypeName()))
+
+        return retval
+
+    def AutoSave(self, option = ""):
+        if self.directory != None:
+            disk[self.directory.name][self.name] = self.getSnapshot()
+
+    def Write(self, name = "", option = 0):
+        self.AutoSave()
+
+#----------------------------------------------------------------------
+
+class TFile(object):
+
+    def __init__(self, name, mode = "READ"):
+        self.name = name
+
+        mode = mode.upper()
+
+        if mode in ("RECREATE", "NEW", "CREATE"):
+            disk[name] = {}
+        elif mode == "UPDATE":
+            disk.setdefault(name, {})
+
+        self.zombie = not name in disk
+        self.closed = False
+
+        openedFiles.append(self)
+
+    @staticmethod
+    def Open(name, mode = "READ"):
+        return TFile(name, mode)
+
+    def IsZombie(self):
+        return self.zombie
+
+    def Get(self, name):
+        snapshot = disk[self.name].get(name)
+        if snapshot == None:
+            return None
+
+        retval = TTree(name)
+
+        for branchName, values, leafType in snapshot:
+            retval.branchNames.append(branchName)
+            retval.columns[branchName] = list(values)
+            retval.buffers[branchName] = numpy.zeros(1, dtype = values.dtype)
+            retval.leafTypes[branchName] = leafType
+
+        retval.numEntries = len(snapshot[0][1]) if snapshot else 0
+        retval.directory = self
+
+        return retval
+
+    def cd(self):
+        pass
+
+    def Close(self):
+        self.closed = True
+
+#----------------------------------------------------------------------
+
+kRed = 632
+kBlue = 600
+
+# the names of the image files written by TCanvas::SaveAs(..)
+savedImages = []
+
+class TH1F(object):
+    # a histogram with variable bin widths
+
+    def __init__(self, name, title, numBins, binEdges):
+        self.title = title
+        self.binEdges = list(binEdges)
+        self.contents = [ 0. ] * (numBins + 2)
+        self.maximum = None
+        self.lineColor = None
+
+    def SetDirectory(self, directory):
+        pass
+
+    def SetBinContent(self, binIndex, content):
+        self.contents[binIndex] = content
+
+    def SetLineColor(self, color):
+        self.lineColor = color
+
+    def SetLineWidth(self, width):
+        pass
+
+    def GetMaximum(self):
+        return max(self.contents[1:-1])
+
+    def SetMaximum(self, maximum):
+        self.maximum = maximum
+
+    def Draw(self, option = ""):
+        TCanvas.current.histos.append(self)
+
+class TCanvas(object):
+    # the 'image' saved is a description of the histograms drawn
+
+    current = None
+
+    def __init__(self):
+        self.histos = []
+        TCanvas.current = self
+
+    def SaveAs(self, fileName):
+        fout = open(fileName, "wb")
+        for histo in self.histos:
+            fout.write(repr((histo.title, histo.lineColor, histo.maximum, histo.binEdges, histo.contents)) + "\n")
+        fout.close()
+
+        savedImages.append(fileName)
+
+    def Close(self):
+        pass
+
+#----------------------------------------------------------------------
+
+class TObject(object):
+    kOverwrite = 2
+
+class _GlobalROOT(object):
+    def cd(self):
+        pass
+
+    def SetBatch(self, batch = True):
+        pass
+
+gROOT = _GlobalROOT()
+
+class _ROOTNamespace(object):
+    # the ROOT:: namespace
+    def __init__(self):
+        self.threadSafetyEnabled = False
+
+    def EnableThreadSafety(self):
+        self.threadSafetyEnabled = True
+
+ROOT = _ROOTNamespace()
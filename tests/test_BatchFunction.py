@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import gc, linecache, re, unittest
+
+import numpy
+
+from .common import makeColumns, makeVarBuilder
+from kinvarbuilder import VarBuilder, BatchFunction, functions
+from kinvarbuilder.TreeReader import BufferPool
+
+#----------------------------------------------------------------------
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.maxCachedBatchFunctions = BatchFunction.maxCachedBatchFunctions
+        BatchFunction.maxCachedBatchFunctions = 3
+
+        BatchFunction._batchFunctions.clear()
+
+        inputVectors = makeVarBuilder().inputVectors
+
+        # VarBuilders with different graphs
+        self.varBuilders = []
+
+        for func in (functions.Mass, functions.SumPt, functions.DeltaPhi, functions.DeltaR, functions.MeanEta):
+            varBuilder = VarBuilder(inputVectors, False, listOfFunctions = [ func ])
+            varBuilder.makeDerived()
+            self.varBuilders.append(varBuilder)
+
+    def tearDown(self):
+        BatchFunction.maxCachedBatchFunctions = self.maxCachedBatchFunctions
+        BatchFunction._batchFunctions.clear()
+
+    def getCachedHashes(self):
+        return list(BatchFunction._batchFunctions.keys())
+
+    def testSameGraph(self):
+        batchFunction = self.varBuilders[0].getBatchFunction()
+
+        self.assertTrue(VarBuilder.fromGraphSpec(self.varBuilders[0].getGraphSpec()).getBatchFunction() is batchFunction)
+
+    def testLeastRecentlyUsed(self):
+        hashes = [ varBuilder.getGraphHash() for varBuilder in self.varBuilders ]
+
+        for varBuilder in self.varBuilders[:3]:
+            varBuilder.getBatchFunction()
+
+        self.assertEqual(self.getCachedHashes(), hashes[:3])
+
+        # using the first one again keeps it
+        first = self.varBuilders[0].getBatchFunction()
+        self.varBuilders[3].getBatchFunction()
+
+        self.assertEqual(self.getCachedHashes(), [ hashes[2], hashes[0], hashes[3] ])
+        self.assertTrue(self.varBuilders[0].getBatchFunction() is first)
+
+        self.varBuilders[4].getBatchFunction()
+        self.assertEqual(self.getCachedHashes(), [ hashes[3], hashes[0], hashes[4] ])
+
+    def testLinecache(self):
+        # the source is available while the function exists
+        batchFunction = self.varBuilders[0].getBatchFunction()
+        fileName = batchFunction.fileName
+
+        self.assertEqual("".join(linecache.getlines(fileName)), batchFunction.source)
+
+        for varBuilder in self.varBuilders[1:]:
+            varBuilder.getBatchFunction()
+
+        # still in use
+        self.assertEqual("".join(linecache.getlines(fileName)), batchFunction.source)
+
+        # generated again after it was removed from the cache,
+        # deleting the old one keeps the source of the new one
+        newFunction = self.varBuilders[0].getBatchFunction()
+        self.assertFalse(newFunction is batchFunction)
+
+        del batchFunction
+        gc.collect()
+
+        self.assertEqual("".join(linecache.getlines(fileName)), newFunction.source)
+
+        # only the functions in the cache (or still used) are kept
+        del newFunction
+        for varBuilder in self.varBuilders[1:4]:
+            varBuilder.getBatchFunction()
+        gc.collect()
+
+        cached = set(batchFunction.fileName for batchFunction in BatchFunction._batchFunctions.values())
+        self.assertEqual(len(cached), 3)
+
+        for varBuilder in self.varBuilders:
+            fileName = "<kinvarbuilder-batch-%s>" % varBuilder.getGraphHash()[:12]
+            self.assertEqual(fileName in linecache.cache, fileName in cached)
+
+#----------------------------------------------------------------------
+
+class BufferPoolTest(unittest.TestCase):
+
+    def testReuse(self):
+        pool = BufferPool(100)
+
+        array = pool.getArray('a', 3, 100)
+        self.assertEqual(array.shape, (3, 100))
+
+        # the same memory for all batches
+        for numRows, numEvents in ((3, 100), (2, 40), (3, 1)):
+            other = pool.getArray('a', numRows, numEvents)
+
+            self.assertEqual(other.shape, (numRows, numEvents))
+            self.assertTrue(other.base is array.base)
+
+        # other names, more rows or another type
+        self.assertFalse(pool.getArray('b', 3, 100).base is array.base)
+        self.assertFalse(pool.getArray('a', 3, 100, bool).base is array.base)
+        self.assertFalse(pool.getArray('a', 4, 100, bool).base is array.base)
+
+    def testCapacity(self):
+        pool = BufferPool(100)
+
+        # allocated for the capacity
+        pool.getArray('a', 3, 10)
+        pool.getArray('b', 2, 10, bool)
+
+        self.assertEqual(pool.arrays['a'].shape, (3, 100))
+        self.assertEqual(pool.getBytesPerEvent(), 3 * 8 + 2)
+
+        # larger batches than the capacity
+        self.assertEqual(pool.getArray('c', 1, 200).shape, (1, 200))
+
+        # arrays larger than needed are released
+        pool.setCapacity(100)
+        self.assertEqual(sorted(pool.arrays.keys()), [ 'a', 'b' ])
+
+        pool.setCapacity(50)
+        self.assertEqual(pool.arrays, {})
+        self.assertEqual(pool.getArray('a', 3, 10).base.shape, (3, 50))
+
+#----------------------------------------------------------------------
+
+class BufferReuseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.varBuilder = makeVarBuilder()
+        self.batchFunction = self.varBuilder.getBatchFunction()
+
+    def tearDown(self):
+        self.batchFunction = None
+
+    def evaluate(self, columns, bufferPool):
+        # @return the output values and undefined flags of the batch function
+        batchFunction = self.batchFunction
+
+        values = numpy.empty((len(batchFunction.outputIndices), len(columns['l1pt'])))
+        isUndefined = batchFunction([ numpy.asarray(columns[expression], dtype = 'f8')
+                                      for expression in batchFunction.inputExpressions ],
+                                    values, bufferPool)
+
+        return values, isUndefined.copy()
+
+    def testRowsReused(self):
+        # fewer rows than intermediate arrays
+        declared = re.findall(r'^ +(\w+) = (buffers|masks)\[(\d+)\]$', self.batchFunction.source, re.MULTILINE)
+
+        self.assertEqual(len(set(row for name, kind, row in declared if kind == 'buffers')), self.batchFunction.numBuffers)
+        self.assertEqual(len(set(row for name, kind, row in declared if kind == 'masks')), self.batchFunction.numMasks)
+
+        self.assertTrue(self.batchFunction.numBuffers < len([ name for name, kind, row in declared if kind == 'buffers' ]))
+
+    def testSameResults(self):
+        # the same values with a new pool and with a pool
+        # used before (containing the values of other events)
+        pool = BufferPool(300)
+
+        for seed in (1, 2):
+            columns = makeColumns(300, seed)
+
+            expected = self.evaluate(columns, None)
+
+            # intermediate arrays filled with garbage
+            for array in pool.arrays.values():
+                array[...] = numpy.random.RandomState(seed).uniform(-1e3, 1e3, array.shape).astype(array.dtype)
+
+            for actual in (self.evaluate(columns, pool), self.evaluate(columns, pool)):
+                self.assertTrue(numpy.array_equal(actual[1], expected[1]))
+                self.assertTrue(numpy.allclose(actual[0], expected[0], equal_nan = True))
+
+        # a smaller batch
+        columns = dict((name, values[:17]) for name, values in makeColumns(300, 3).items())
+
+        expected = self.evaluate(columns, None)
+        actual = self.evaluate(columns, pool)
+
+        self.assertTrue(numpy.allclose(actual[0], expected[0], equal_nan = True))
+
+    def testOneRowPerArray(self):
+        # the result does not depend on the rows assigned: the same as
+        # with a separate row for each intermediate array
+        source = self.batchFunction.source
+        rows = {}
+
+        def assignRow(match):
+            row = rows.setdefault((match.group(2), match.group(1)), len(rows))
+            return "%s = %s[%d]" % (match.group(1), match.group(2), row)
+
+        separateSource = re.sub(r'(\w+) = (buffers|masks)\[(\d+)\]', assignRow, source)
+
+        separate = BatchFunction.BatchFunction(separateSource, "<kinvarbuilder-test-separate>",
+                                               self.batchFunction.inputExpressions, self.batchFunction.outputIndices,
+                                               self.batchFunction.fallbackIndices, len(rows), len(rows))
+
+        columns = makeColumns(200)
+        expected = self.evaluate(columns, None)
+
+        self.batchFunction = separate
+        actual = self.evaluate(columns, None)
+
+        self.assertTrue(numpy.array_equal(actual[1], expected[1]))
+        self.assertTrue(numpy.allclose(actual[0], expected[0], equal_nan = True))
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+import numpy
+
+from .common import fakeroot, makeColumns, assertArraysEqual
+from kinvarbuilder import VarBuilder, FourVector, TransverseVector, TreeProcessor
+
+# number of events of the input tree
+numEvents = 400
+
+#----------------------------------------------------------------------
+
+class MassTest(unittest.TestCase):
+
+    def setUp(self):
+        columns = makeColumns(numEvents)
+
+        randomState = numpy.random.RandomState(5)
+        columns['j1flavour'] = randomState.choice([ 0, 3, 5, 21 ], numEvents).astype('f8')
+
+        self.columns = columns
+
+    def makeArrays(self, j1mass, l1mass = 'l1m', batchMode = True):
+        # @return the output of the VarBuilder for the given mass
+        # hypotheses of the jet and the lepton
+        inputVectors = [ FourVector('l1pt', 'l1eta', 'l1phi', l1mass),
+                         FourVector('l2pt', 'l2eta', 'l2phi', 0),
+                         FourVector('j1pt', 'j1eta', 'j1phi', j1mass, validExpr = 'j1valid'),
+                         TransverseVector('metphi', 'metet'),
+                         ]
+
+        varBuilder = VarBuilder(inputVectors, False)
+        varBuilder.makeDerived()
+
+        tree = fakeroot.makeTree('t', self.columns)
+
+        return TreeProcessor(varBuilder, readBatchSize = 300, batchMode = batchMode).makeArray(tree)
+
+    def addColumn(self, name, values):
+        self.columns[name] = numpy.asarray(values, dtype = 'f8')
+
+    def checkSameAs(self, j1mass, j1massValues, l1mass = 'l1m', l1massValues = None):
+        # checks the output for the given mass hypotheses
+        # in both modes against the output with the masses read
+        # from the tree
+        self.addColumn('j1massExpected', j1massValues)
+
+        if l1massValues != None:
+            self.addColumn('l1massExpected', l1massValues)
+            expectedL1mass = 'l1massExpected'
+        else:
+            expectedL1mass = l1mass
+
+        expected = self.makeArrays('j1massExpected', expectedL1mass, batchMode = False)
+
+        for batchMode in (False, True):
+            assertArraysEqual(self, expected, self.makeArrays(j1mass, l1mass, batchMode))
+
+    def testMassTable(self):
+        # keys not in the table have mass zero
+        table = { 0: 0.105, 5: 4.18, 21: 0. }
+        flavour = self.columns['j1flavour']
+
+        self.checkSameAs(('j1flavour', table), [ table.get(key, 0.) for key in flavour ])
+
+        # the masses matter
+        massless, withTable = self.makeArrays(0), self.makeArrays(('j1flavour', table))
+        self.assertTrue(any(not numpy.allclose(massless[name], withTable[name], equal_nan = True)
+                            for name in massless.dtype.names))
+
+        # also given as list
+        self.checkSameAs(('j1flavour', sorted(table.items())), [ table.get(key, 0.) for key in flavour ])
+
+    def testNegativeMasses(self):
+        # as TLorentzVector.SetPtEtaPhiM(..)
+        table = { 3: -1.5, 5: 4.18 }
+
+        self.checkSameAs(('j1flavour', table), [ table.get(key, 0.) for key in self.columns['j1flavour'] ])
+
+    def testFixedMass(self):
+        for mass in (0, 1.777, -0.5):
+            self.checkSameAs(mass, [ mass ] * numEvents, l1mass = mass, l1massValues = [ mass ] * numEvents)
+
+    def testGraphSpec(self):
+        vector = FourVector('j1pt', 'j1eta', 'j1phi', ('j1flavour', { 5: 4.18, 0: 0.105 }))
+
+        self.assertEqual(vector.getSpec()['mass'], [ 'j1flavour', [ [ 0., 0.105 ], [ 5., 4.18 ] ] ])
+        self.assertEqual(vector.getExpressions(), [ 'j1pt', 'j1eta', 'j1phi', 'j1flavour' ])
+
+        # the same for a list
+        self.assertEqual(FourVector('j1pt', 'j1eta', 'j1phi', ('j1flavour', [ (5, 4.18), (0, 0.105) ])).getSpec(),
+                         vector.getSpec())
+
+        # fixed masses are not read
+        self.assertEqual(FourVector('j1pt', 'j1eta', 'j1phi', 0.105).getExpressions(), [ 'j1pt', 'j1eta', 'j1phi' ])
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
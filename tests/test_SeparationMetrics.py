@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy
+
+from kinvarbuilder import SeparationMetrics
+
+#----------------------------------------------------------------------
+
+def bruteForceKS(valuesSig, valuesBkg, weightsSig, weightsBkg):
+    # maximum difference of the cumulative distributions
+    # at all values of the variable
+    retval = 0.
+
+    for cut in numpy.unique(numpy.concatenate((valuesSig, valuesBkg))):
+        fracSig = weightsSig[valuesSig <= cut].sum() / weightsSig.sum()
+        fracBkg = weightsBkg[valuesBkg <= cut].sum() / weightsBkg.sum()
+
+        retval = max(retval, abs(fracSig - fracBkg))
+
+    return retval
+
+#----------------------------------------------------------------------
+
+def bruteForceAUC(valuesSig, valuesBkg, weightsSig, weightsBkg):
+    # probability of a signal event having a larger value than
+    # a background event, considering all pairs of events
+    pairWeights = numpy.outer(weightsSig, weightsBkg)
+
+    isLarger = numpy.subtract.outer(valuesSig, valuesBkg)
+
+    auc = (pairWeights * ((isLarger > 0) + 0.5 * (isLarger == 0))).sum() / pairWeights.sum()
+
+    return max(auc, 1 - auc)
+
+#----------------------------------------------------------------------
+
+def bruteForceSOverSqrtB(valuesSig, valuesBkg, weightsSig, weightsBkg):
+    # best S / sqrt(B) over all cuts x <= cut and x > cut
+    retval = 0.
+
+    cuts = numpy.unique(numpy.concatenate((valuesSig, valuesBkg)))
+
+    for cut in numpy.append(cuts, cuts.min() - 1):
+        for passSig, passBkg in ((valuesSig <= cut, valuesBkg <= cut),
+                                 (valuesSig > cut, valuesBkg > cut)):
+            numBkg = weightsBkg[passBkg].sum()
+            if numBkg > 0:
+                retval = max(retval, weightsSig[passSig].sum() / numpy.sqrt(numBkg))
+
+    return retval
+
+#----------------------------------------------------------------------
+
+class SeparationMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        randomState = numpy.random.RandomState(3)
+
+        # rounded such that there are many equal values
+        self.valuesSig = numpy.round(randomState.normal(0.5, 1, 300), 1)
+        self.valuesBkg = numpy.round(randomState.normal(0, 1.2, 400), 1)
+
+        self.weightsSig = randomState.uniform(0.2, 2, 300)
+        self.weightsBkg = randomState.uniform(0.2, 2, 400)
+
+    def testAgainstBruteForce(self):
+        metrics = SeparationMetrics.calcMetrics(self.valuesSig, self.valuesBkg, self.weightsSig, self.weightsBkg)
+
+        for metric, bruteForce in (('ks', bruteForceKS),
+                                   ('auc', bruteForceAUC),
+                                   ('sOverSqrtB', bruteForceSOverSqrtB)):
+            self.assertAlmostEqual(metrics[metric], bruteForce(self.valuesSig, self.valuesBkg, self.weightsSig, self.weightsBkg),
+                                   places = 10, msg = metric)
+
+        # signal with smaller values separates as well
+        metrics = SeparationMetrics.calcMetrics(-self.valuesSig, -self.valuesBkg, self.weightsSig, self.weightsBkg)
+        self.assertAlmostEqual(metrics['auc'], bruteForceAUC(self.valuesSig, self.valuesBkg, self.weightsSig, self.weightsBkg))
+
+    def testUndefinedValues(self):
+        # undefined values are ignored
+        valuesSig = numpy.append(self.valuesSig, [ numpy.nan, numpy.inf ])
+        weightsSig = numpy.append(self.weightsSig, [ 5., 5. ])
+
+        withUndefined = SeparationMetrics.calcMetrics(valuesSig, self.valuesBkg, weightsSig, self.weightsBkg)
+        expected = SeparationMetrics.calcMetrics(self.valuesSig, self.valuesBkg, self.weightsSig, self.weightsBkg)
+
+        for metric in SeparationMetrics.metricNames:
+            self.assertAlmostEqual(withUndefined[metric], expected[metric], msg = metric)
+
+    def testSetsOfWeights(self):
+        # several sets of weights give the same as separate calculations
+        randomState = numpy.random.RandomState(4)
+        factorsSig = randomState.poisson(1, (300, 5))
+        factorsBkg = randomState.poisson(1, (400, 5))
+
+        sortedSamples = SeparationMetrics.SortedSamples(self.valuesSig, self.valuesBkg)
+
+        # (the bins are determined by the first set of weights)
+        sortedSamples.calcMetrics(self.weightsSig, self.weightsBkg)
+
+        metrics = sortedSamples.calcMetrics(self.weightsSig[:, numpy.newaxis] * factorsSig,
+                                            self.weightsBkg[:, numpy.newaxis] * factorsBkg)
+
+        for replica in range(5):
+            expected = sortedSamples.calcMetrics(self.weightsSig * factorsSig[:, replica],
+                                                 self.weightsBkg * factorsBkg[:, replica])
+
+            for metric in SeparationMetrics.metricNames:
+                self.assertAlmostEqual(metrics[metric][replica], expected[metric], msg = metric)
+
+        self.assertAlmostEqual(expected['ks'], bruteForceKS(self.valuesSig, self.valuesBkg,
+                                                            self.weightsSig * factorsSig[:, 4],
+                                                            self.weightsBkg * factorsBkg[:, 4]))
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
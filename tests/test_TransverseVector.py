@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+import numpy
+
+from .common import fakeroot, makeColumns, assertArraysEqual
+from kinvarbuilder import VarBuilder, FourVector, TransverseVector, TreeProcessor
+from kinvarbuilder.TransverseVector import Vector2D, Vector2DArray
+from kinvarbuilder.TreeReader import TreeReader
+
+#----------------------------------------------------------------------
+
+def assertSameVectors(testCase, vectorArray, vectors):
+    # checks that the Vector2DArray has the values of the
+    # list of Vector2D objects
+    testCase.assertEqual(len(vectorArray), len(vectors))
+
+    for method in ('Px', 'Py', 'Et', 'M', 'Phi', 'Pt'):
+        expected = [ getattr(vector, method)() for vector in vectors ]
+
+        testCase.assertTrue(numpy.allclose(getattr(vectorArray, method)(), expected, rtol = 1e-12, atol = 1e-12),
+                            "%s differs" % method)
+
+#----------------------------------------------------------------------
+
+def _asArray(vector):
+    # @return a Vector2DArray with the given Vector2D as only event
+    retval = Vector2DArray()
+    retval.SetPxPyEt([ vector.Px() ], [ vector.Py() ], [ vector.Et() ])
+    return retval
+
+#----------------------------------------------------------------------
+
+class Vector2DArrayTest(unittest.TestCase):
+
+    def setUp(self):
+        randomState = numpy.random.RandomState(1)
+
+        self.phi = randomState.uniform(-numpy.pi, numpy.pi, 200)
+        self.et = randomState.exponential(30, 200)
+
+        # including spacelike vectors (pt > et)
+        self.pt = self.et * randomState.uniform(0.5, 1.5, 200)
+
+        self.phi[:3] = [ 0., numpy.pi, -numpy.pi / 2 ]
+
+    def makeVectors(self, phi, et, pt):
+        retval = []
+
+        for index in range(len(phi)):
+            vector = Vector2D()
+            vector.SetPhiEtPt(phi[index], et[index], pt[index] if pt is not None else None)
+            retval.append(vector)
+
+        return retval
+
+    def testSetPhiEtPt(self):
+        for pt in (self.pt, None):
+            vectorArray = Vector2DArray()
+            vectorArray.SetPhiEtPt(self.phi, self.et, pt)
+
+            vectors = self.makeVectors(self.phi, self.et, pt)
+            assertSameVectors(self, vectorArray, vectors)
+
+            # the vectors of single events
+            for index in (0, 17, 199):
+                assertSameVectors(self, _asArray(vectorArray[index]), [ vectors[index] ])
+
+        # massless without pt
+        self.assertTrue((numpy.abs(vectorArray.M()) < 1e-6 * self.et).all())
+
+    def testSetPxPyEt(self):
+        px, py = self.pt * numpy.cos(self.phi), self.pt * numpy.sin(self.phi)
+
+        vectorArray = Vector2DArray()
+        vectorArray.SetPxPyEt(px, py, self.et)
+
+        assertSameVectors(self, vectorArray, self.makeVectors(self.phi, self.et, self.pt))
+
+        # the values are copied
+        px[:] = 0
+        self.assertFalse((vectorArray.Px() == 0).all())
+
+    def testEmpty(self):
+        vectorArray = Vector2DArray(5)
+
+        self.assertEqual(len(vectorArray), 5)
+        self.assertTrue((vectorArray.Pt() == 0).all())
+
+#----------------------------------------------------------------------
+
+class TransverseVectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.columns = makeColumns(500)
+        self.tree = fakeroot.makeTree('t', self.columns)
+
+    def testEventValues(self):
+        # the values of the current event taken from the vectors
+        # calculated for the batch
+        columns = self.columns
+
+        for pt in (None, 'metet * 0.8'):
+            vector = TransverseVector('metphi', 'metet', pt, validExpr = 'j1valid')
+
+            treeReader = TreeReader(self.tree, readBatchSize = 128)
+            vector.setTreeReader(treeReader)
+
+            for entry in range(0, 500, 7):
+                treeReader.getEvent(entry)
+                vector.newEvent()
+
+                value = vector.getValue()
+
+                if not columns['j1valid'][entry]:
+                    self.assertEqual(value, None)
+                    continue
+
+                expected = Vector2D()
+                expected.SetPhiEtPt(columns['metphi'][entry], columns['metet'][entry],
+                                    columns['metet'][entry] * 0.8 if pt != None else None)
+
+                assertSameVectors(self, _asArray(value), [ expected ])
+
+            treeReader.close()
+
+    def testBatchMode(self):
+        # the same output in event and batch mode, with a massive transverse vector
+        inputVectors = [ FourVector('l1pt', 'l1eta', 'l1phi', 'l1m'),
+                         FourVector('l2pt', 'l2eta', 'l2phi', 0),
+                         TransverseVector('metphi', 'metet', 'metet * 0.8'),
+                         ]
+
+        varBuilder = VarBuilder(inputVectors, False)
+        varBuilder.makeDerived()
+
+        outputs = [ TreeProcessor(varBuilder, readBatchSize = 128, batchMode = batchMode).makeArray(self.tree)
+                    for batchMode in (False, True) ]
+
+        assertArraysEqual(self, outputs[0], outputs[1])
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
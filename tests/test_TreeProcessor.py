@@ -0,0 +1,628 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math, os, shutil, tempfile, time, unittest
+
+import numpy
+
+from .common import fakeroot, makeColumns, makeTree, makeVarBuilder, assertArraysEqual
+from kinvarbuilder import TreeProcessor, VarBuilder
+from kinvarbuilder.TreeProcessor import ProcessingMetrics, _InputFileReader, _RootTreeWriter
+from kinvarbuilder.kinvarbuilder import Node
+
+#----------------------------------------------------------------------
+
+class SelectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.varBuilder = makeVarBuilder()
+        self.tree = makeTree(2000)
+
+        self.treeProcessor = TreeProcessor(self.varBuilder, readBatchSize = 300)
+        self.treeProcessor.addSpectatorVariable('evt')
+
+    def testEntryColumn(self):
+        columns = makeColumns(2000)
+        expected = numpy.nonzero(columns['l1pt'] > 50)[0]
+
+        values = self.treeProcessor.makeArray(self.tree, selection = "l1pt > 50")
+
+        self.assertTrue(numpy.array_equal(values['entry'], expected))
+        self.assertTrue(numpy.array_equal(values['evt'], columns['evt'][expected]))
+
+    def testStringAndMask(self):
+        mask = makeColumns(2000)['l1pt'] > 50
+
+        byString = self.treeProcessor.makeArray(self.tree, selection = "l1pt > 50", firstEvent = 150, maxEvents = 1500)
+        byUnicode = self.treeProcessor.makeArray(self.tree, selection = u"l1pt > 50", firstEvent = 150, maxEvents = 1500)
+        byMask = self.treeProcessor.makeArray(self.tree, selection = mask, firstEvent = 150, maxEvents = 1500)
+
+        assertArraysEqual(self, byString, byUnicode)
+        assertArraysEqual(self, byString, byMask)
+
+        self.assertEqual(byString['entry'][0], 150 + numpy.nonzero(mask[150:])[0][0])
+        self.assertTrue(byString['entry'][-1] < 1650)
+
+    def testSelectionEvaluatedOnce(self):
+        # the selection is only evaluated to find the selected
+        # events, not again for each expression read
+        self.treeProcessor.makeArray(self.tree, selection = "l1pt > 50")
+
+        numSelectionDraws = len([ selection for expression, selection in self.tree.drawCalls if selection ])
+
+        self.assertEqual(numSelectionDraws, 7)
+
+        # the values are read for ranges of events
+        # and the selected events taken from them
+        self.assertEqual(set(expression for expression, selection in self.tree.drawCalls if selection), set([ "Entry$" ]))
+
+#----------------------------------------------------------------------
+
+class LogPtDifference(Node):
+    # a function which is NaN for some events where
+    # its arguments are defined
+
+    needFourVectors = False
+    symmetry = 'ordered'
+
+    __slots__ = ('vectors',)
+
+    def __init__(self, vector1, vector2):
+        Node.__init__(self)
+        self.vectors = [ vector1, vector2 ]
+
+    def getParents(self):
+        return self.vectors
+
+    def calcValue(self):
+        vecValues = [ vec.getValue() for vec in self.vectors ]
+
+        if None in vecValues:
+            return None
+
+        difference = vecValues[0].Pt() - vecValues[1].Pt()
+
+        if difference < 0:
+            return float('nan')
+
+        return math.log(difference) if difference > 0 else float('-inf')
+
+    @staticmethod
+    def getNumArguments(maxNumArguments):
+        return [ 2 ]
+
+    def __str__(self):
+        return "LogPtDifference(%s,%s)" % tuple(self.vectors)
+
+class BatchLogPtDifference(LogPtDifference):
+
+    __slots__ = ()
+
+    @staticmethod
+    def getBatchCode(out, args, tmp):
+        return [ "numpy.subtract(%s, %s, out = %s)" % (args[0].get('pt'), args[1].get('pt'), out),
+                 "numpy.log(%s, out = %s)" % (out, out) ]
+
+#----------------------------------------------------------------------
+
+class BatchModeTest(unittest.TestCase):
+
+    def compare(self, varBuilder, **kwargs):
+        tree = makeTree(1500)
+
+        outputs = []
+        for batchMode in (False, True):
+            treeProcessor = TreeProcessor(varBuilder, undefValue = -99, readBatchSize = 400, batchMode = batchMode)
+            treeProcessor.addSpectatorVariable('evt')
+            outputs.append(treeProcessor.makeArray(tree, **kwargs))
+
+        assertArraysEqual(self, outputs[0], outputs[1])
+
+        return outputs[1]
+
+    def testHadronCollider(self):
+        varBuilder = makeVarBuilder(withMet = True, hadronCollider = True)
+
+        # all variables are calculated by the generated function
+        self.assertEqual(varBuilder.getBatchFunction().fallbackIndices, [])
+
+        values = self.compare(varBuilder, selection = "l2pt > 20", firstEvent = 100)
+
+        # some variables are undefined for events without the jet
+        self.assertTrue(any((values[name] == -99).any() for name in varBuilder.outputVarnames))
+
+    def testLeptonCollider(self):
+        self.compare(makeVarBuilder(withMet = False, hadronCollider = False), maxEvents = 1000)
+
+    def testNaNValues(self):
+        # NaN values calculated by functions are not undefined values,
+        # also for variables calculated event by event in batch mode
+        inputVectors = makeVarBuilder().inputVectors
+
+        for func in (LogPtDifference, BatchLogPtDifference):
+            varBuilder = VarBuilder(inputVectors, False, listOfFunctions = [ func ])
+            varBuilder.makeDerived()
+
+            self.assertEqual(len(varBuilder.getBatchFunction().fallbackIndices), 0 if func == BatchLogPtDifference else
+                             len(varBuilder.outputVarnames))
+
+            values = self.compare(varBuilder)
+
+            # with the jet
+            name = varBuilder.outputVarnames[varBuilder.outputVarDescriptions.index('LogPtDifference(l1,j1)')]
+
+            columns = makeColumns(1500)
+
+            isDefined = columns['j1valid'] != 0
+            isNaN = isDefined & (columns['l1pt'] < columns['j1pt'])
+
+            self.assertTrue(isNaN.any())
+            self.assertTrue(numpy.isnan(values[name][isNaN]).all())
+            self.assertTrue((values[name][~isDefined] == -99).all())
+            self.assertFalse(numpy.isnan(values[name][isDefined & ~isNaN]).any())
+
+#----------------------------------------------------------------------
+
+class OutputTypesTest(unittest.TestCase):
+
+    def setUp(self):
+        fakeroot.reset()
+
+        self.varBuilder = makeVarBuilder(withMet = False)
+
+        self.columns = makeColumns(500)
+        self.columns['run'] = (numpy.arange(500) // 100 + 1).astype('i4')
+
+        self.tree = fakeroot.makeTree('t', self.columns)
+
+    def makeArray(self, spectators = [], **kwargs):
+        treeProcessor = TreeProcessor(self.varBuilder, readBatchSize = 200, **kwargs)
+
+        for args in spectators:
+            treeProcessor.addSpectatorVariable(*args)
+
+        return treeProcessor, treeProcessor.makeArray(self.tree)
+
+    def testDerivedVariables(self):
+        varBuilder = self.varBuilder
+
+        treeProcessor, reference = self.makeArray(defaultOutputType = 'f8')
+
+        treeProcessor, values = self.makeArray(outputTypes = { 'out01': 'f8', varBuilder.outputVarDescriptions[2]: 'f2' })
+        treeProcessor.setOutputType('out03', 'f8')
+
+        self.assertEqual(values.dtype['out00'], numpy.dtype('f4'))
+        self.assertEqual(values.dtype['out01'], numpy.dtype('f8'))
+        self.assertEqual(values.dtype['out02'], numpy.dtype('f2'))
+
+        # the values are calculated in double precision
+        for name in varBuilder.outputVarnames:
+            expected = reference[name].astype(values.dtype[name])
+            self.assertTrue(((values[name] == expected) | (numpy.isnan(values[name]) & numpy.isnan(expected))).all(), name)
+
+        self.assertEqual(treeProcessor.makeArray(self.tree).dtype['out03'], numpy.dtype('f8'))
+
+    def testSpectators(self):
+        treeProcessor, values = self.makeArray([ ('run',), ('evt',), ('weight',), ('l1pt * 2', 'l1pt2'),
+                                                 ('evt', 'evt2', 'i8') ])
+
+        # branches keep their type unless they are 64 bit
+        # integers, which are read as doubles
+        self.assertEqual(values.dtype['run'], numpy.dtype('i4'))
+        self.assertEqual(values.dtype['evt'], numpy.dtype('f8'))
+        self.assertEqual(values.dtype['weight'], numpy.dtype('f8'))
+        self.assertEqual(values.dtype['l1pt2'], numpy.dtype('f8'))
+        self.assertEqual(values.dtype['evt2'], numpy.dtype('i8'))
+
+        self.assertTrue(numpy.array_equal(values['run'], self.columns['run']))
+        self.assertTrue(numpy.array_equal(values['evt'], self.columns['evt']))
+        self.assertTrue(numpy.array_equal(values['evt2'], self.columns['evt']))
+        self.assertTrue(numpy.array_equal(values['l1pt2'], self.columns['l1pt'] * 2))
+
+    def testOutputTree(self):
+        treeProcessor = TreeProcessor(self.varBuilder, readBatchSize = 200, outputTypes = { 'out00': 'f8' })
+        treeProcessor.addSpectatorVariable('run')
+
+        treeProcessor.makeTree(self.tree, 'out', 'out.root')
+
+        columns = fakeroot.readColumns('out.root', 'out')
+
+        self.assertEqual(columns['out00'].dtype, numpy.dtype('f8'))
+        self.assertEqual(columns['out01'].dtype, numpy.dtype('f4'))
+        self.assertEqual(columns['run'].dtype, numpy.dtype('i4'))
+        self.assertTrue(numpy.array_equal(columns['run'], self.columns['run']))
+
+#----------------------------------------------------------------------
+
+class InputFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        fakeroot.reset()
+
+        self.varBuilder = makeVarBuilder()
+
+        # three input files and the same events in one tree
+        self.fileNames = []
+        allColumns = []
+
+        for index, numEvents in enumerate((700, 0, 1100)):
+            columns = makeColumns(numEvents, seed = index + 1)
+            allColumns.append(columns)
+
+            fileName = "input%d.root" % index
+            fakeroot.writeFile(fileName, [ fakeroot.makeTree('t', columns) ])
+            self.fileNames.append(fileName)
+
+        self.chainedTree = fakeroot.makeTree('t', dict((name, numpy.concatenate([ columns[name] for columns in allColumns ]))
+                                                       for name in allColumns[0]))
+
+    def makeArrays(self, **kwargs):
+        # @return the output for the input files and the chained tree
+        treeProcessor = TreeProcessor(self.varBuilder, readBatchSize = 250)
+        treeProcessor.addSpectatorVariable('evt')
+
+        fromFiles = treeProcessor.makeArray(self.fileNames, treeName = 't', **kwargs)
+        fileEntryCounts = treeProcessor.fileEntryCounts
+
+        fromTree = treeProcessor.makeArray(self.chainedTree, **kwargs)
+
+        return fromFiles, fromTree, fileEntryCounts
+
+    def testAllEvents(self):
+        fromFiles, fromTree, fileEntryCounts = self.makeArrays()
+
+        assertArraysEqual(self, fromTree, fromFiles)
+        self.assertEqual(fileEntryCounts, zip(self.fileNames, [ 700, 0, 1100 ]))
+
+    def testEventRange(self):
+        fromFiles, fromTree, fileEntryCounts = self.makeArrays(firstEvent = 600, maxEvents = 500)
+
+        self.assertEqual(len(fromFiles), 500)
+        assertArraysEqual(self, fromTree, fromFiles)
+
+        # the last file is not needed
+        self.assertEqual(fileEntryCounts, zip(self.fileNames, [ 100, 0, 400 ]))
+
+        fromFiles, fromTree, fileEntryCounts = self.makeArrays(firstEvent = 800)
+        self.assertEqual(len(fromFiles), 1000)
+        assertArraysEqual(self, fromTree, fromFiles)
+
+    def testSelection(self):
+        fromFiles, fromTree, fileEntryCounts = self.makeArrays(firstEvent = 300, maxEvents = 1000,
+                                                               selection = "l1pt > 40")
+
+        # the entry column counts from the first event of the first file
+        assertArraysEqual(self, fromTree, fromFiles)
+        self.assertTrue(fromFiles['entry'][-1] >= 700)
+
+    def testProgress(self):
+        calls = []
+
+        treeProcessor = TreeProcessor(self.varBuilder, readBatchSize = 250, progressEvents = 100)
+        values = treeProcessor.makeArray(self.fileNames, treeName = 't', selection = "l1pt > 40",
+                                         progressCallback = lambda numEventsToProcess, eventIndex: calls.append((numEventsToProcess, eventIndex)))
+
+        # the number of events to process grows when the last file is opened
+        self.assertEqual(calls[0], (700, values['entry'][0]))
+        self.assertEqual(calls[-1][0], 1800)
+
+        # the event indices count from the first event in the first file
+        self.assertTrue(set(index for numEventsToProcess, index in calls) <= set(values['entry']))
+
+        for (numBefore, indexBefore), (numEventsToProcess, eventIndex) in zip(calls[:-1], calls[1:]):
+            self.assertTrue(eventIndex < numEventsToProcess)
+            self.assertTrue(eventIndex >= indexBefore + 100)
+
+#----------------------------------------------------------------------
+
+class ProgressTest(unittest.TestCase):
+
+    def testEventIndices(self):
+        # as before progressEvents and progressSeconds were introduced: called
+        # with the number of events to process and the index of each event
+        tree = makeTree(700)
+
+        for batchMode in (False, True):
+            calls = []
+
+            treeProcessor = TreeProcessor(makeVarBuilder(), readBatchSize = 200, batchMode = batchMode)
+            treeProcessor.makeArray(tree, firstEvent = 100, maxEvents = 500,
+                                    progressCallback = lambda numEventsToProcess, eventIndex: calls.append((numEventsToProcess, eventIndex)))
+
+            if batchMode:
+                # once per batch
+                self.assertEqual(calls, [ (500, 100), (500, 200), (500, 400) ])
+            else:
+                self.assertEqual(calls, [ (500, index) for index in range(100, 600) ])
+
+    def testProgressEvents(self):
+        # the callback is called at most every progressEvents events
+        tree = makeTree(700)
+
+        for batchMode in (False, True):
+            indices = []
+
+            treeProcessor = TreeProcessor(makeVarBuilder(), readBatchSize = 200, batchMode = batchMode,
+                                          progressEvents = 150)
+            treeProcessor.makeArray(tree, firstEvent = 100, maxEvents = 500,
+                                    progressCallback = lambda numEventsToProcess, eventIndex: indices.append(eventIndex))
+
+            if batchMode:
+                # only once per batch
+                self.assertEqual(indices, [ 100, 400 ])
+            else:
+                self.assertEqual(indices, [ 100, 250, 400, 550 ])
+
+    def testMetricsDuringProcessing(self):
+        # the metrics of the running processing are available in the callback
+        tree = makeTree(700)
+
+        treeProcessor = TreeProcessor(makeVarBuilder(), readBatchSize = 200)
+
+        processed = []
+        treeProcessor.makeArray(tree, firstEvent = 100, maxEvents = 500,
+                                progressCallback = lambda numEventsToProcess, eventIndex: processed.append((eventIndex, treeProcessor.metrics.numEvents)))
+
+        self.assertEqual(processed, [ (index, index - 100) for index in range(100, 600) ])
+
+#----------------------------------------------------------------------
+
+class MetricsTest(unittest.TestCase):
+
+    def makeMetrics(self, batchMode):
+        # @return the metrics after processing 500 events in batches of 200
+        treeProcessor = TreeProcessor(makeVarBuilder(), readBatchSize = 200, batchMode = batchMode)
+        treeProcessor.makeArray(makeTree(700), firstEvent = 100, maxEvents = 500)
+
+        return treeProcessor.metrics
+
+    def testBatches(self):
+        for batchMode in (False, True):
+            metrics = self.makeMetrics(batchMode)
+
+            self.assertEqual(metrics.numEvents, 500)
+            self.assertEqual(metrics.numBatches, 3)
+
+            # the batches start at multiples of the read batch size
+            self.assertEqual([ numEvents for numEvents, seconds in metrics.batches ], [ 100, 200, 200 ])
+            self.assertTrue(all(seconds >= 0 for numEvents, seconds in metrics.batches))
+
+            eventsPerSecond = metrics.getEventsPerSecond()
+            self.assertEqual(len(eventsPerSecond), 3)
+            self.assertTrue(all(rate > 0 for rate in eventsPerSecond))
+
+    def testAsDict(self):
+        for batchMode in (False, True):
+            metrics = self.makeMetrics(batchMode)
+            values = metrics.asDict()
+
+            self.assertEqual(sorted(values.keys()),
+                             sorted([ 'numEvents', 'numBatches', 'elapsedTime', 'readTime', 'evaluationTime',
+                                      'undefinedTime', 'writeTime', 'ioWaitTime', 'treeReadTime',
+                                      'eventsPerSecond', 'cacheHitRate' ]))
+
+            self.assertEqual(values['numEvents'], 500)
+            self.assertEqual(values['numBatches'], 3)
+
+            # processing is finished, the elapsed time does not change anymore
+            self.assertEqual(values['elapsedTime'], metrics.getElapsedTime())
+
+            for name in ('readTime', 'evaluationTime', 'undefinedTime', 'writeTime'):
+                self.assertTrue(0 <= values[name] <= values['elapsedTime'], name)
+
+    def testCacheHitRate(self):
+        for batchMode in (False, True):
+            metrics = self.makeMetrics(batchMode)
+
+            # three batches were loaded for the 500 events
+            self.assertEqual(metrics.numBatchLoads, 3)
+            self.assertTrue(metrics.numEventLookups >= 3)
+            self.assertAlmostEqual(metrics.getCacheHitRate(), 1. - 3. / metrics.numEventLookups)
+
+    def testNoLookups(self):
+        # no input tree was completed yet
+        metrics = ProcessingMetrics()
+
+        self.assertEqual(metrics.getCacheHitRate(), None)
+        self.assertEqual(metrics.getEventsPerSecond(), [])
+        self.assertEqual(metrics.endTime, None)
+
+#----------------------------------------------------------------------
+
+class InputFileReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        fakeroot.reset()
+
+        self.fileNames = [ "input%d.root" % index for index in range(3) ]
+
+        for index, fileName in enumerate(self.fileNames):
+            fakeroot.writeFile(fileName, [ makeTree(100 * (index + 1), seed = index + 1) ])
+
+    def getOpenedFiles(self):
+        return [ fin.name for fin in fakeroot.openedFiles ]
+
+    def waitUntilOpened(self, fileName):
+        # the files are opened in a background thread
+        for attempt in range(500):
+            if fileName in self.getOpenedFiles():
+                return True
+            time.sleep(0.01)
+
+        return False
+
+    def testReadAhead(self):
+        reader = _InputFileReader(self.fileNames, 't', [ 'l1pt' ], numPrefetchFiles = 1,
+                                  treeReaderArgs = dict(readBatchSize = 50))
+
+        inputTrees = iter(reader)
+
+        first = next(inputTrees)
+        self.assertEqual((first.fileName, first.entryOffset, len(first.entries)), ("input0.root", 0, 100))
+
+        # the next file is opened while the first one is processed
+        self.assertTrue(self.waitUntilOpened("input1.root"))
+        first.close()
+
+        second = next(inputTrees)
+        self.assertEqual((second.fileName, second.entryOffset, len(second.entries)), ("input1.root", 100, 200))
+
+        # and its first batch was already read
+        self.assertEqual(second.treeReader.numBatchLoads, 1)
+
+        # ROOT is only used from one thread at a time
+        self.assertFalse(fakeroot.ROOT.threadSafetyEnabled)
+        self.assertTrue(first.treeReader.treeLock is second.treeReader.treeLock)
+
+        second.close()
+
+        # stopping early closes the files opened ahead
+        self.assertTrue(self.waitUntilOpened("input2.root"))
+        reader.close()
+
+        self.assertFalse(reader.thread.is_alive())
+        self.assertTrue(all(fin.closed for fin in fakeroot.openedFiles))
+
+    def testThreadSafety(self):
+        reader = _InputFileReader(self.fileNames, 't', [ 'l1pt' ], enableThreadSafety = True)
+
+        inputTrees = list(reader)
+
+        self.assertTrue(fakeroot.ROOT.threadSafetyEnabled)
+        self.assertFalse(inputTrees[0].treeReader.treeLock is inputTrees[1].treeReader.treeLock)
+
+        for inputTree in inputTrees:
+            inputTree.close()
+
+    def testMissingFile(self):
+        reader = _InputFileReader([ self.fileNames[0], "missing.root" ], 't', [ 'l1pt' ])
+
+        inputTrees = iter(reader)
+
+        # the error is raised when the missing file is reached
+        next(inputTrees).close()
+        self.assertRaises(IOError, next, inputTrees)
+
+#----------------------------------------------------------------------
+
+class _Interrupted(Exception):
+    pass
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        fakeroot.reset()
+
+        self.varBuilder = makeVarBuilder()
+        self.tree = makeTree(1000)
+
+        self.outputDir = tempfile.mkdtemp()
+        self.outputFileName = os.path.join(self.outputDir, "out.root")
+
+    def tearDown(self):
+        shutil.rmtree(self.outputDir)
+
+    def makeTree(self, outputFileName, interruptAfter = None, spectators = [ 'evt' ], **kwargs):
+        treeProcessor = TreeProcessor(self.varBuilder, undefValue = -1, readBatchSize = 128)
+
+        for expression in spectators:
+            treeProcessor.addSpectatorVariable(expression)
+
+        def progressCallback(numEventsToProcess, eventIndex):
+            if interruptAfter != None and eventIndex >= interruptAfter:
+                raise _Interrupted()
+
+        treeProcessor.makeTree(self.tree, 'out', outputFileName, selection = "weight > 0.8",
+                               progressCallback = progressCallback, **kwargs)
+
+    def testResume(self):
+        self.makeTree("reference.root")
+        expected = fakeroot.readColumns("reference.root", 'out')
+
+        # let ROOT also save the tree between checkpoints
+        fakeroot.defaultAutoSave = 37
+
+        self.assertRaises(_Interrupted, self.makeTree, self.outputFileName, interruptAfter = 350, checkpointInterval = 100)
+        numSaved = len(fakeroot.readColumns(self.outputFileName, 'out')['entry'])
+        self.assertTrue(0 < numSaved < 250)
+
+        # interrupted again
+        self.assertRaises(_Interrupted, self.makeTree, self.outputFileName, interruptAfter = 700, checkpointInterval = 100, resume = True)
+        self.assertTrue(len(fakeroot.readColumns(self.outputFileName, 'out')['entry']) > numSaved)
+
+        self.makeTree(self.outputFileName, checkpointInterval = 100, resume = True)
+
+        actual = fakeroot.readColumns(self.outputFileName, 'out')
+
+        self.assertEqual(sorted(actual.keys()), sorted(expected.keys()))
+        for name in expected:
+            self.assertTrue(numpy.array_equal(expected[name], actual[name]), name)
+
+        # nothing left to do
+        self.assertEqual(self.makeTree(self.outputFileName, checkpointInterval = 100, resume = True), None)
+
+    def testDifferentConfig(self):
+        self.assertRaises(_Interrupted, self.makeTree, self.outputFileName, interruptAfter = 250, checkpointInterval = 100)
+
+        treeProcessor = TreeProcessor(self.varBuilder)
+        self.assertRaises(ValueError, treeProcessor.makeTree, self.tree, 'out', self.outputFileName, resume = True)
+
+    def testDifferentBranchTypes(self):
+        # the configuration is the same but the spectator
+        # variable has a different type in the input
+        self.tree.columns['run'] = numpy.ones(1000, dtype = 'i4')
+        self.assertRaises(_Interrupted, self.makeTree, self.outputFileName, interruptAfter = 250,
+                          checkpointInterval = 100, spectators = [ 'run' ])
+
+        self.tree.columns['run'] = numpy.ones(1000, dtype = 'i2')
+        self.assertRaises(ValueError, self.makeTree, self.outputFileName, checkpointInterval = 100, resume = True,
+                          spectators = [ 'run' ])
+
+    def testResumeWriter(self):
+        writer = _RootTreeWriter(self.outputFileName, 'out')
+        writer.setVariableNames([ 'a', 'b' ], [ 'f4', 'i4' ])
+        writer.addEvent([ 1.5, 2 ])
+        writer.finish()
+
+        for outputTypes in ([ 'f8', 'i4' ], [ 'f2', 'i4' ], [ 'f4', 'u4' ]):
+            writer = _RootTreeWriter(self.outputFileName, 'out', resume = True)
+            self.assertRaises(ValueError, writer.setVariableNames, [ 'a', 'b' ], outputTypes)
+
+        writer = _RootTreeWriter(self.outputFileName, 'out', resume = True)
+        writer.setVariableNames([ 'a', 'b' ], [ 'f4', 'i4' ])
+        writer.addEvent([ 2.5, 3 ])
+        writer.finish()
+
+        columns = fakeroot.readColumns(self.outputFileName, 'out')
+        self.assertEqual(list(columns['a']), [ 1.5, 2.5 ])
+        self.assertEqual(list(columns['b']), [ 2, 3 ])
+
+    def testDifferentOutputTypes(self):
+        self.assertRaises(_Interrupted, self.makeTree, self.outputFileName, interruptAfter = 250, checkpointInterval = 100)
+
+        for kwargs in (dict(defaultOutputType = 'f8'), dict(outputTypes = { 'out00': 'f8' })):
+            treeProcessor = TreeProcessor(self.varBuilder, undefValue = -1, readBatchSize = 128, **kwargs)
+            treeProcessor.addSpectatorVariable('evt')
+
+            self.assertRaises(ValueError, treeProcessor.makeTree, self.tree, 'out', self.outputFileName,
+                              selection = "weight > 0.8", checkpointInterval = 100, resume = True)
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy
+
+from .common import fakeroot, makeColumns
+from kinvarbuilder.TreeReader import TreeReader
+
+#----------------------------------------------------------------------
+
+def readEvents(tree, expressions, entries, **kwargs):
+    # @return the values of the given expressions (one row per event)
+    # read event by event and the TreeReader used
+    treeReader = TreeReader(tree, **kwargs)
+
+    variables = [ treeReader.getVar(expression) for expression in expressions ]
+
+    retval = []
+    for entry in entries:
+        treeReader.getEvent(entry)
+        retval.append([ var[0] for var in variables ])
+
+    treeReader.close()
+
+    return numpy.array(retval), treeReader
+
+#----------------------------------------------------------------------
+
+class PrefetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.columns = makeColumns(1000)
+        self.tree = fakeroot.makeTree('t', self.columns)
+
+        self.expressions = [ 'l1pt', 'l2eta', 'metet * 2' ]
+
+    def testSameValues(self):
+        expected = numpy.array([ self.columns['l1pt'], self.columns['l2eta'], self.columns['metet'] * 2 ]).T
+
+        for prefetchDepth in (0, 1, 3):
+            values, treeReader = readEvents(self.tree, self.expressions, range(1000),
+                                            readBatchSize = 128, prefetchDepth = prefetchDepth)
+
+            self.assertTrue(numpy.array_equal(values, expected))
+            self.assertEqual(treeReader.numBatchesRead, 8)
+
+            # the thread has stopped
+            self.assertEqual(treeReader.prefetchThread, None)
+
+    def testSkipping(self):
+        # events in later batches and going back
+        # restart reading ahead
+        entries = [ 5, 300, 301, 900, 10, 999, 11 ]
+
+        expected, treeReader = readEvents(self.tree, self.expressions, entries, readBatchSize = 128)
+        values, treeReader = readEvents(self.tree, self.expressions, entries, readBatchSize = 128, prefetchDepth = 2)
+
+        self.assertTrue(numpy.array_equal(values, expected))
+
+    def testSelection(self):
+        treeReader = TreeReader(self.tree, readBatchSize = 128, selection = "l1pt > 40")
+        entries = treeReader.getSelectedEntries(0, 1000)
+
+        self.assertTrue(numpy.array_equal(entries, numpy.nonzero(self.columns['l1pt'] > 40)[0]))
+
+        expected, treeReader = readEvents(self.tree, self.expressions, entries, readBatchSize = 128,
+                                          selection = "l1pt > 40")
+        values, treeReader = readEvents(self.tree, self.expressions, entries, readBatchSize = 128,
+                                        selection = "l1pt > 40", prefetchDepth = 2)
+
+        self.assertTrue(numpy.array_equal(values, expected))
+        self.assertTrue(numpy.array_equal(values[:, 0], self.columns['l1pt'][entries]))
+
+    def testReadRange(self):
+        treeReader = TreeReader(self.tree, readBatchSize = 100, prefetchDepth = 3)
+        treeReader.getVar('l1pt')
+        treeReader.setReadRange(0, 250)
+
+        for entry in range(250):
+            treeReader.getEvent(entry)
+
+        treeReader.close()
+
+        # no batches after the end of the range are read
+        self.assertEqual(max(end for begin, end in self.tree.drawRanges), 300)
+
+    def testException(self):
+        treeReader = TreeReader(self.tree, readBatchSize = 100, prefetchDepth = 2)
+        treeReader.getVar('l1pt')
+        treeReader.getVar('nonexisting')
+
+        # an error in the background thread is raised by getEvent(..)
+        self.assertRaises(NameError, treeReader.getEvent, 0)
+        self.assertEqual(treeReader.prefetchThread, None)
+
+#----------------------------------------------------------------------
+
+class TreeVariableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.columns = makeColumns(1000)
+        self.tree = fakeroot.makeTree('t', self.columns)
+
+    def testBatchViews(self):
+        treeReader = TreeReader(self.tree, readBatchSize = 100)
+
+        l1pt = treeReader.getVar('l1pt')
+        metet = treeReader.getVar('metet')
+
+        self.assertTrue(treeReader.getVar('l1pt') is l1pt)
+
+        treeReader.getEvent(150)
+
+        # one row per expression
+        self.assertEqual(treeReader.cache.dtype, numpy.dtype('f8'))
+        self.assertEqual(treeReader.cache.shape, (2, 100))
+
+        self.assertEqual(l1pt[0], self.columns['l1pt'][150])
+        self.assertEqual(metet.getValue(), self.columns['metet'][150])
+
+        # the values of the batch without copying them
+        batch = l1pt.getBatch()
+        self.assertTrue(numpy.array_equal(batch, self.columns['l1pt'][100:200]))
+        self.assertTrue(numpy.may_share_memory(batch, treeReader.cache))
+
+        treeReader.getEvent(199)
+        self.assertEqual(metet[0], self.columns['metet'][199])
+        self.assertEqual(treeReader.numBatchLoads, 1)
+
+    def testNewExpression(self):
+        treeReader = TreeReader(self.tree, readBatchSize = 100)
+        l1pt = treeReader.getVar('l1pt')
+
+        treeReader.getEvent(150)
+
+        # the batch is read again with the new expression
+        j1pt = treeReader.getVar('j1pt')
+        treeReader.getEvent(150)
+
+        self.assertEqual(treeReader.cache.shape, (2, 100))
+        self.assertEqual(l1pt[0], self.columns['l1pt'][150])
+        self.assertEqual(j1pt[0], self.columns['j1pt'][150])
+
+    def testBatchRows(self):
+        treeReader = TreeReader(self.tree, readBatchSize = 100)
+        l1pt = treeReader.getVar('l1pt')
+
+        treeReader.getEvent(150)
+
+        # consecutive events give a slice
+        self.assertEqual(treeReader.getBatchRows([ 120, 121, 122 ]), slice(20, 23))
+        self.assertEqual(list(treeReader.getBatchRows([ 120, 130 ])), [ 20, 30 ])
+        self.assertTrue(numpy.array_equal(l1pt.getBatch()[treeReader.getBatchRows([ 120, 130 ])],
+                                          self.columns['l1pt'][[ 120, 130 ]]))
+
+        self.assertRaises(ValueError, treeReader.getBatchRows, [ 150, 250 ])
+
+        # with a selection, the columns of the batch are the selected events
+        treeReader = TreeReader(self.tree, readBatchSize = 100, selection = self.columns['l1pt'] > 40)
+        l1pt = treeReader.getVar('l1pt')
+
+        entries = treeReader.getSelectedEntries(0, 1000)
+        batchEntries = entries[(entries >= 100) & (entries < 200)]
+
+        treeReader.getEvent(batchEntries[0])
+        self.assertEqual(treeReader.cache.shape, (1, len(batchEntries)))
+        self.assertTrue(numpy.array_equal(l1pt.getBatch()[treeReader.getBatchRows(batchEntries[1:])],
+                                          self.columns['l1pt'][batchEntries[1:]]))
+
+        notSelected = numpy.nonzero(self.columns['l1pt'][100:200] <= 40)[0] + 100
+        self.assertRaises(ValueError, treeReader.getBatchRows, notSelected[:1])
+        self.assertRaises(ValueError, treeReader.getEvent, notSelected[0])
+
+#----------------------------------------------------------------------
+
+class MemoryBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.columns = makeColumns(5000)
+        self.tree = fakeroot.makeTree('t', self.columns)
+
+        self.expressions = [ 'l1pt', 'l2eta', 'metet' ]
+
+    def testMaxBatchSize(self):
+        # 8 bytes per value read and per output value
+        treeReader = TreeReader(self.tree, readBatchSize = 100000, memoryBudget = 8 * 5 * 1000,
+                                numOutputColumns = 2, minBatchSize = 10)
+
+        for expression in self.expressions:
+            treeReader.getVar(expression)
+
+        self.assertEqual(treeReader.getMaxBatchSize(), 1000)
+        self.assertEqual(treeReader.readBatchSize, 1000)
+
+        # more expressions
+        treeReader.getVar('j1pt')
+        treeReader.getVar('j1eta')
+        self.assertEqual(treeReader.readBatchSize, 714)
+
+        # the batches read ahead are also in memory
+        treeReader = TreeReader(self.tree, readBatchSize = 100000, memoryBudget = 8 * 5 * 1000,
+                                numOutputColumns = 2, prefetchDepth = 2, minBatchSize = 10)
+        for expression in self.expressions:
+            treeReader.getVar(expression)
+
+        self.assertEqual(treeReader.getMaxBatchSize(), 250)
+
+        # and the arrays in the buffer pool (3 values per event)
+        treeReader.bufferPool.getArray('tmp', 3, 10)
+        self.assertEqual(treeReader.getMaxBatchSize(), 8 * 5 * 1000 // (8 * 8 * 4))
+
+        # but not less than the minimum batch size
+        treeReader.minBatchSize = 300
+        self.assertEqual(treeReader.getMaxBatchSize(), 300)
+
+    def readBatchSizes(self, targetBatchTime, **kwargs):
+        # @return the values read and the sizes of the batches
+        treeReader = TreeReader(self.tree, readBatchSize = 200, memoryBudget = 8 * 3 * 1000,
+                                targetBatchTime = targetBatchTime, minBatchSize = 50, **kwargs)
+
+        variables = [ treeReader.getVar(expression) for expression in self.expressions ]
+
+        values = []
+        batchSizes = []
+
+        for entry in range(5000):
+            treeReader.getEvent(entry)
+            values.append([ var[0] for var in variables ])
+
+            if treeReader.cacheBegin == entry:
+                batchSizes.append(treeReader.cacheEnd - treeReader.cacheBegin)
+
+        treeReader.close()
+
+        return numpy.array(values), batchSizes
+
+    def testAdaptation(self):
+        expected = numpy.array([ self.columns[expression] for expression in self.expressions ]).T
+
+        for prefetchDepth in (0, 2):
+            # reading is faster than the target: the batch size
+            # doubles up to the memory budget
+            values, batchSizes = self.readBatchSizes(1e6, prefetchDepth = prefetchDepth)
+
+            self.assertTrue(numpy.array_equal(values, expected))
+            self.assertEqual(sum(batchSizes), 5000)
+
+            maxBatchSize = 1000 if prefetchDepth == 0 else 250
+            self.assertEqual(max(batchSizes), maxBatchSize)
+
+            if prefetchDepth == 0:
+                self.assertEqual(batchSizes[:4], [ 200, 400, 800, 1000 ])
+
+            # slower than the target: the batch size is halved
+            # down to the minimum
+            values, batchSizes = self.readBatchSizes(1e-9, prefetchDepth = prefetchDepth)
+
+            self.assertTrue(numpy.array_equal(values, expected))
+            self.assertEqual(sum(batchSizes), 5000)
+            self.assertEqual(batchSizes[-2], 50)
+
+            if prefetchDepth == 0:
+                self.assertEqual(batchSizes[:4], [ 200, 100, 50, 50 ])
+
+    def testBufferPoolCapacity(self):
+        treeReader = TreeReader(self.tree, readBatchSize = 400, memoryBudget = 8 * 3 * 1000,
+                                targetBatchTime = 1e-9, minBatchSize = 50)
+        treeReader.getVar('l1pt')
+
+        treeReader.getEvent(0)
+        array = treeReader.bufferPool.getArray('tmp', 2, 400)
+
+        # the batch size decreased: larger arrays are released
+        treeReader.getEvent(400)
+        self.assertEqual(treeReader.readBatchSize, 100)
+        self.assertFalse('tmp' in treeReader.bufferPool.arrays)
+        self.assertEqual(treeReader.bufferPool.getArray('tmp', 2, 100).shape, (2, 100))
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
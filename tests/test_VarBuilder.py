@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json, pickle, unittest
+
+import numpy
+
+from .common import makeTree, makeVarBuilder, assertArraysEqual
+from kinvarbuilder import VarBuilder, FourVector, TransverseVector, TreeProcessor
+
+#----------------------------------------------------------------------
+
+class MakeDerivedTest(unittest.TestCase):
+
+    def testNoDuplicateOutputs(self):
+        # e.g. the mass of a sum with the missing transverse energy
+        # would be the transverse mass of the fourvectors and the MET
+        varBuilder = makeVarBuilder()
+
+        values = TreeProcessor(varBuilder, readBatchSize = 200).makeArray(makeTree(300))
+
+        for index, name in enumerate(varBuilder.outputVarnames):
+            for otherIndex in range(index):
+                self.assertFalse(numpy.allclose(values[name], values[varBuilder.outputVarnames[otherIndex]], equal_nan = True),
+                                 "%s is the same as %s" % (varBuilder.outputVarDescriptions[index],
+                                                           varBuilder.outputVarDescriptions[otherIndex]))
+
+    def testSharedInputVectors(self):
+        # VarBuilders sharing their input vectors, processed one after
+        # the other: no values are kept from the previous tree
+        first = makeVarBuilder()
+        second = VarBuilder(first.inputVectors, False)
+        second.makeDerived()
+
+        TreeProcessor(first, batchMode = False).makeArray(makeTree(300, seed = 2))
+
+        tree = makeTree(300)
+        assertArraysEqual(self, TreeProcessor(makeVarBuilder(), batchMode = False).makeArray(tree),
+                          TreeProcessor(second, batchMode = False).makeArray(tree))
+
+#----------------------------------------------------------------------
+
+class GraphSpecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.varBuilder = makeVarBuilder()
+        self.tree = makeTree(500)
+
+    def makeArray(self, varBuilder):
+        return TreeProcessor(varBuilder, readBatchSize = 200).makeArray(self.tree)
+
+    def assertSameVarBuilder(self, expected, actual):
+        self.assertEqual(expected.getGraphSpec(), actual.getGraphSpec())
+        self.assertEqual(expected.outputVarnames, actual.outputVarnames)
+        self.assertEqual(expected.outputVarDescriptions, actual.outputVarDescriptions)
+
+        assertArraysEqual(self, self.makeArray(expected), self.makeArray(actual))
+
+    def testRoundTrip(self):
+        spec = self.varBuilder.getGraphSpec()
+
+        self.assertSameVarBuilder(self.varBuilder, VarBuilder.fromGraphSpec(spec))
+
+        # as JSON
+        self.assertSameVarBuilder(self.varBuilder, VarBuilder.fromGraphSpec(json.dumps(spec)))
+
+        self.assertEqual(VarBuilder.fromGraphSpec(json.dumps(spec)).getGraphHash(), self.varBuilder.getGraphHash())
+
+    def testPickle(self):
+        self.assertSameVarBuilder(self.varBuilder, pickle.loads(pickle.dumps(self.varBuilder)))
+
+    def testInputVectors(self):
+        # the parameters of the input vectors are kept
+        inputVectors = [ FourVector('l1pt', 'l1eta', 'l1phi', ('j1valid', { 0: 0.105, 1: 1.777 })),
+                         FourVector('j1pt', 'j1eta', 'j1phi', 'j1m', validExpr = 'j1valid'),
+                         TransverseVector('metphi', 'metet'),
+                         ]
+
+        varBuilder = VarBuilder(inputVectors, False)
+        varBuilder.makeDerived()
+
+        self.assertSameVarBuilder(varBuilder, VarBuilder.fromGraphSpec(json.dumps(varBuilder.getGraphSpec())))
+
+    def testSubset(self):
+        indices = [ 3, 0, 17 ]
+
+        subset = self.varBuilder.getSubset(indices)
+
+        names = [ self.varBuilder.outputVarnames[index] for index in indices ]
+        self.assertEqual(subset.outputVarnames, names)
+
+        # also when sent to another process
+        self.assertEqual(pickle.loads(pickle.dumps(subset)).outputVarnames, names)
+
+        values = self.makeArray(self.varBuilder)
+        assertArraysEqual(self, values[names], self.makeArray(pickle.loads(pickle.dumps(subset))))
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os, shutil, tempfile, unittest, StringIO
+
+import numpy
+
+from .common import fakeroot
+from kinvarbuilder import VariableRanking, SeparationMetrics
+from kinvarbuilder.VariableRanking import weightedCorrelationMatrix, maxCumulativeDifference, makeHistograms, \
+     _renderPlot, _renderPlots, _plotJobHash
+
+from .test_SeparationMetrics import bruteForceKS
+
+#----------------------------------------------------------------------
+
+def makeValues(numEvents, shift, seed):
+    randomState = numpy.random.RandomState(seed)
+
+    retval = numpy.zeros(numEvents, dtype = [ ('x', 'f8'), ('a_longer_name', 'f8'), ('w', 'f8') ])
+
+    retval['x'] = randomState.normal(shift, 1, numEvents)
+    retval['a_longer_name'] = randomState.normal(0, 100, numEvents)
+    retval['w'] = randomState.uniform(0.5, 1.5, numEvents)
+
+    return retval
+
+#----------------------------------------------------------------------
+
+class VariableRankingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.valuesSig = makeValues(500, 1., 1)
+        self.valuesBkg = makeValues(600, 0., 2)
+
+    def testMetrics(self):
+        ranking = VariableRanking(self.valuesSig, self.valuesBkg, 'w', 'w', metrics = 'all')
+
+        self.assertEqual(ranking.columns, [ 'x', 'a_longer_name' ])
+        self.assertEqual(ranking.getRankedIndices(), [ 0, 1 ])
+
+        for index, column in enumerate(ranking.columns):
+            expected = SeparationMetrics.calcMetrics(self.valuesSig[column], self.valuesBkg[column],
+                                                     self.valuesSig['w'], self.valuesBkg['w'])
+            for metric in SeparationMetrics.metricNames:
+                self.assertAlmostEqual(ranking.metricValues[index][metric], expected[metric])
+
+    def testMaxCumulativeDifference(self):
+        for column in ('x', 'a_longer_name'):
+            args = (self.valuesSig[column], self.valuesBkg[column], self.valuesSig['w'], self.valuesBkg['w'])
+
+            self.assertAlmostEqual(maxCumulativeDifference(*args), bruteForceKS(*args))
+
+        # also for lists and with ties
+        self.assertAlmostEqual(maxCumulativeDifference([ 1, 2, 2, 3 ], [ 2, 3, 4 ], [ 1, 1, 1, 1 ], [ 1, 2, 1 ]), 0.5)
+
+    def testSummaryHeader(self):
+        # the original header when ranking by the Kolmogorov-Smirnov distance
+        for primaryMetric, title in (('ks', "similarity ranking (least similar variables first):"),
+                                     ('auc', "similarity ranking by auc (least similar variables first):")):
+            ranking = VariableRanking(self.valuesSig, self.valuesBkg, 'w', 'w', primaryMetric = primaryMetric)
+
+            output = StringIO.StringIO()
+            ranking.printSummary(output)
+
+            lines = output.getvalue().splitlines()
+            self.assertEqual(lines[0], title)
+            self.assertEqual(len(lines), 3)
+
+            for line, index in zip(lines[1:], ranking.getRankedIndices()):
+                self.assertEqual(line, "  %-13s : %f" % (ranking.varDescriptions[index], ranking.similarities[index]))
+
+    def testPrintSummary(self):
+        # the columns of the header are aligned with the values
+        for bootstrap in (0, 20):
+            ranking = VariableRanking(self.valuesSig, self.valuesBkg, 'w', 'w', metrics = [ 'ks', 'auc' ],
+                                      bootstrap = bootstrap)
+
+            output = StringIO.StringIO()
+            ranking.printSummary(output)
+
+            lines = output.getvalue().splitlines()
+            header, rows = lines[-3], lines[-2:]
+
+            for row in rows:
+                self.assertEqual(len(header), len(row))
+
+                # the end of the metric names is the end of the values
+                for metric in ('ks', 'auc'):
+                    end = header.index(metric + " ") + len(metric) if metric == 'ks' else len(header)
+                    self.assertNotEqual(row[end - 1], " ")
+                    if end < len(row):
+                        self.assertEqual(row[end], " ")
+
+#----------------------------------------------------------------------
+
+class BootstrapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.valuesSig = makeValues(300, 0.5, 1)
+        self.valuesBkg = makeValues(400, 0., 2)
+
+        # the same variable twice
+        self.valuesSig['a_longer_name'] = self.valuesSig['x']
+        self.valuesBkg['a_longer_name'] = self.valuesBkg['x']
+
+    def makeRanking(self, **kwargs):
+        return VariableRanking(self.valuesSig, self.valuesBkg, 'w', 'w', metrics = 'all', bootstrap = 7,
+                               bootstrapChunkSize = 3, **kwargs)
+
+    def testReplicas(self):
+        ranking = self.makeRanking(bootstrapSeed = 5)
+
+        # the replicas calculated one by one with the same
+        # Poisson weight factors
+        sortedSamples = SeparationMetrics.SortedSamples(self.valuesSig['x'], self.valuesBkg['x'])
+        sortedSamples.calcMetrics(self.valuesSig['w'], self.valuesBkg['w'])
+
+        replica = 0
+        for chunkIndex, numReplicas in enumerate((3, 3, 1)):
+            randomState = numpy.random.RandomState([ 5, chunkIndex ])
+            factorsSig = randomState.poisson(1, (len(self.valuesSig), numReplicas))
+            factorsBkg = randomState.poisson(1, (len(self.valuesBkg), numReplicas))
+
+            for column in range(numReplicas):
+                expected = sortedSamples.calcMetrics(factorsSig[:, column] * self.valuesSig['w'],
+                                                     factorsBkg[:, column] * self.valuesBkg['w'])
+
+                for metric in SeparationMetrics.metricNames:
+                    self.assertAlmostEqual(ranking.bootstrapValues[0][metric][replica], expected[metric])
+
+                replica += 1
+
+        self.assertEqual(len(ranking.bootstrapValues[0]['ks']), 7)
+
+        # the same replicas are used for all variables
+        for metric in SeparationMetrics.metricNames:
+            self.assertTrue(numpy.array_equal(ranking.bootstrapValues[0][metric], ranking.bootstrapValues[1][metric]))
+
+    def testSeed(self):
+        values = [ self.makeRanking(bootstrapSeed = seed).bootstrapValues[0]['auc'] for seed in (5, 5, 6) ]
+
+        self.assertTrue(numpy.array_equal(values[0], values[1]))
+        self.assertFalse(numpy.array_equal(values[0], values[2]))
+
+    def testIntervals(self):
+        ranking = self.makeRanking(confidenceLevel = 0.8)
+
+        for index in range(len(ranking.columns)):
+            for metric in SeparationMetrics.metricNames:
+                replicaValues = ranking.bootstrapValues[index][metric]
+                lower, upper = ranking.metricIntervals[index][metric]
+
+                self.assertAlmostEqual(lower, numpy.percentile(replicaValues, 10))
+                self.assertAlmostEqual(upper, numpy.percentile(replicaValues, 90))
+
+        # the intervals of the primary metric
+        self.assertEqual(ranking.scoreIntervals, [ intervals['ks'] for intervals in ranking.metricIntervals ])
+
+        for (lower, upper), value in zip(ranking.scoreIntervals, ranking.similarities):
+            self.assertTrue(lower <= value <= upper)
+
+        ranking.setPrimaryMetric('auc')
+        self.assertEqual(ranking.scoreIntervals, [ intervals['auc'] for intervals in ranking.metricIntervals ])
+
+        # no intervals without bootstrapping
+        self.assertEqual(VariableRanking(self.valuesSig, self.valuesBkg, 'w', 'w').scoreIntervals, [])
+
+#----------------------------------------------------------------------
+
+def bruteForceCorrelations(columns, weights, method):
+    # @return the weighted correlation matrix calculated
+    # with numpy's weighted covariance
+    columns = [ numpy.array(column, dtype = 'f8') for column in columns ]
+
+    for column in columns:
+        isDefined = numpy.isfinite(column)
+
+        if method == 'rank':
+            # weighted mid-ranks
+            definedValues, definedWeights = column[isDefined], weights[isDefined]
+            column[isDefined] = [ definedWeights[definedValues < value].sum() +
+                                  0.5 * definedWeights[definedValues == value].sum()
+                                  for value in definedValues ]
+
+        # undefined values do not contribute
+        column[~isDefined] = numpy.average(column[isDefined], weights = weights[isDefined])
+
+    covariance = numpy.cov(numpy.array(columns), aweights = weights)
+    sigmas = numpy.sqrt(numpy.diag(covariance))
+
+    return covariance / numpy.outer(sigmas, sigmas)
+
+#----------------------------------------------------------------------
+
+class CorrelationTest(unittest.TestCase):
+
+    def setUp(self):
+        randomState = numpy.random.RandomState(3)
+
+        numEvents = 300
+        self.weights = randomState.uniform(0.5, 1.5, numEvents)
+
+        x = randomState.normal(0, 1, numEvents)
+        self.columns = [ x,
+                         x + randomState.normal(0, 0.5, numEvents),
+                         numpy.exp(x),
+                         randomState.normal(0, 1, numEvents),
+                         # with ties
+                         numpy.round(x - randomState.normal(0, 1, numEvents)),
+                         ]
+
+        # with undefined values
+        column = randomState.normal(0, 1, numEvents) - x
+        column[randomState.uniform(0, 1, numEvents) < 0.2] = numpy.nan
+        self.columns.append(column)
+
+    def testBruteForce(self):
+        for method in ('pearson', 'rank'):
+            expected = bruteForceCorrelations(self.columns, self.weights, method)
+
+            # in one or in several blocks
+            for chunkSize in (1, 2, 4, 200):
+                actual = weightedCorrelationMatrix(self.columns, self.weights, method, chunkSize)
+
+                self.assertTrue(numpy.allclose(actual, expected),
+                                "%s correlations differ with chunkSize %d" % (method, chunkSize))
+
+        # monotonic transformations do not change the rank correlation
+        actual = weightedCorrelationMatrix(self.columns, self.weights, 'rank', 2)
+        self.assertAlmostEqual(actual[0, 2], 1.)
+        self.assertTrue(actual[0, 1] < 1 - 1e-3)
+
+    def testStandardizedOnce(self):
+        # each chunk of columns is standardized only once
+        import sys
+        module = sys.modules[weightedCorrelationMatrix.__module__]
+
+        original = module._standardizedColumns
+        numColumns = []
+
+        def standardizedColumns(columns, weights, method):
+            numColumns.append(len(columns))
+            return original(columns, weights, method)
+
+        module._standardizedColumns = standardizedColumns
+        try:
+            weightedCorrelationMatrix(self.columns, self.weights, 'pearson', 4)
+        finally:
+            module._standardizedColumns = original
+
+        self.assertEqual(numColumns, [ 4, 2 ])
+
+    def testUnknownMethod(self):
+        self.assertRaises(ValueError, weightedCorrelationMatrix, self.columns, self.weights, 'kendall')
+
+    def testSelectDecorrelated(self):
+        randomState = numpy.random.RandomState(4)
+
+        values = []
+        for shift, numEvents in ((1., 500), (0., 600)):
+            x = randomState.normal(shift, 1, numEvents)
+
+            array = numpy.zeros(numEvents, dtype = [ ('x', 'f8'), ('y', 'f8'), ('z', 'f8'), ('w', 'f8') ])
+            array['x'] = x
+
+            # strongly correlated with x but less separating
+            array['y'] = x + randomState.normal(0, 0.3, numEvents)
+
+            # not correlated with x
+            array['z'] = randomState.normal(0.5 * shift, 1, numEvents)
+            array['w'] = randomState.uniform(0.5, 1.5, numEvents)
+
+            values.append(array)
+
+        ranking = VariableRanking(values[0], values[1], 'w', 'w')
+        self.assertEqual([ ranking.columns[index] for index in ranking.getRankedIndices() ], [ 'x', 'y', 'z' ])
+
+        indices, correlationsSig, correlationsBkg = ranking.calcCorrelations(chunkSize = 2)
+        self.assertEqual(indices, ranking.getRankedIndices())
+        self.assertTrue(numpy.allclose(correlationsSig,
+                                       bruteForceCorrelations([ values[0][name] for name in ('x', 'y', 'z') ],
+                                                              values[0]['w'], 'pearson')))
+
+        self.assertEqual(ranking.selectDecorrelated(0.9), [ 'x', 'z' ])
+        self.assertEqual(ranking.selectDecorrelated(0.9, method = 'rank', chunkSize = 1), [ 'x', 'z' ])
+
+        # no pair has a correlation above one
+        self.assertEqual(ranking.selectDecorrelated(1.), [ 'x', 'y', 'z' ])
+
+        self.assertEqual(ranking.selectDecorrelated(0.9, topN = 1), [ 'x' ])
+
+#----------------------------------------------------------------------
+
+class PlotTest(unittest.TestCase):
+
+    def setUp(self):
+        fakeroot.reset()
+
+        valuesSig = makeValues(500, 1., 1)
+        valuesBkg = makeValues(600, 0., 2)
+
+        valuesSig['w'][:10] = 0
+
+        self.ranking = VariableRanking(valuesSig, valuesBkg, 'w', 'w')
+
+        self.outputDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outputDir)
+
+    def getJob(self, varIndex, backend):
+        return (backend, 'png', self.ranking.varDescriptions[varIndex]) + \
+            makeHistograms(self.ranking.valuesSig[varIndex], self.ranking.valuesBkg[varIndex],
+                           self.ranking.weightsSig, self.ranking.weightsBkg)
+
+    def testRootImage(self):
+        # the histograms drawn
+        binEdges, contentsSig, contentsBkg = self.getJob(0, 'root')[3:]
+
+        lines = self.ranking.makePlotImages([ 0 ], backend = 'root')[0].splitlines()
+        self.assertEqual(len(lines), 2)
+
+        for line, contents, color in zip(lines, (contentsSig, contentsBkg), (fakeroot.kRed, fakeroot.kBlue)):
+            title, lineColor, maximum, edges, values = eval(line)
+
+            self.assertEqual((title, lineColor), ('x', color))
+            self.assertTrue(numpy.allclose(edges, binEdges))
+            self.assertTrue(numpy.allclose(values[1:-1], contents))
+
+        # the temporary file was removed
+        self.assertEqual(len(fakeroot.savedImages), 1)
+        self.assertFalse(os.path.exists(fakeroot.savedImages[0]))
+
+    def testRootToFile(self):
+        # saved directly to the given file
+        fileName = os.path.join(self.outputDir, "plot.png")
+
+        self.assertEqual(_renderPlot(self.getJob(0, 'root'), fileName), None)
+        self.assertEqual(fakeroot.savedImages, [ fileName ])
+
+        fin = open(fileName, "rb")
+        self.assertEqual(fin.read(), _renderPlot(self.getJob(0, 'root')))
+        fin.close()
+
+    def testFailedRendering(self):
+        # incomplete images are removed
+        def close(canvas):
+            raise RuntimeError("rendering failed")
+
+        original = fakeroot.TCanvas.Close
+        fakeroot.TCanvas.Close = close
+        try:
+            fileNames = [ os.path.join(self.outputDir, "plot%d.png" % index) for index in range(2) ]
+            self.assertRaises(RuntimeError, _renderPlots, [ self.getJob(index, 'root') for index in range(2) ], 1, fileNames)
+        finally:
+            fakeroot.TCanvas.Close = original
+
+        self.assertEqual(fakeroot.savedImages, fileNames[:1])
+        self.assertEqual(os.listdir(self.outputDir), [])
+
+    def testParallel(self):
+        # the same images when rendered in several processes
+        varIndices = [ 1, 0, 1 ]
+
+        for backend in ('root', 'matplotlib'):
+            images = self.ranking.makePlotImages(varIndices, numProcesses = 1, backend = backend)
+
+            self.assertEqual(self.ranking.makePlotImages(varIndices, numProcesses = 3, backend = backend), images)
+
+            # written to files by the worker processes
+            fileNames = [ os.path.join(self.outputDir, "%s%d.png" % (backend, pos)) for pos in range(len(varIndices)) ]
+            self.assertEqual(_renderPlots([ self.getJob(varIndex, backend) for varIndex in varIndices ], 2, fileNames),
+                             [ None ] * len(varIndices))
+
+            for fileName, image in zip(fileNames, images):
+                fin = open(fileName, "rb")
+                self.assertEqual(fin.read(), image)
+                fin.close()
+
+        self.assertTrue(images[0].startswith("\x89PNG"))
+
+#----------------------------------------------------------------------
+
+class ReportDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        fakeroot.reset()
+        self.outputDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outputDir)
+
+    def makeRanking(self, numVariables, seed = 1):
+        # the values of a variable do not depend on the number of variables
+        values = []
+        for sample, shift, numEvents in ((0, 1., 200), (1, 0., 300)):
+            array = numpy.zeros(numEvents, dtype = [ ('v%d' % index, 'f8') for index in range(numVariables) ])
+
+            for index in range(numVariables):
+                array['v%d' % index] = numpy.random.RandomState([ seed, sample, index ]).normal(shift * index, 1, numEvents)
+
+            values.append(array)
+
+        return VariableRanking(values[0], values[1])
+
+    def writeReport(self, ranking, variablesPerPage = 2):
+        return ranking.writeHtmlReportDirectory(self.outputDir, variablesPerPage, numProcesses = 2, plotBackend = 'root')
+
+    def getPlots(self):
+        return sorted(os.listdir(os.path.join(self.outputDir, "plots")))
+
+    def testCache(self):
+        ranking = self.makeRanking(5)
+
+        self.assertEqual(self.writeReport(ranking), 5)
+
+        # named by the hash of the histograms
+        plots = self.getPlots()
+        self.assertEqual(len(plots), 5)
+
+        for varIndex in range(5):
+            job = ('root', 'png', ranking.varDescriptions[varIndex]) + \
+                makeHistograms(ranking.valuesSig[varIndex], ranking.valuesBkg[varIndex], ranking.weightsSig, ranking.weightsBkg)
+
+            fin = open(os.path.join(self.outputDir, "plots", _plotJobHash(job) + ".png"), "rb")
+            self.assertEqual(fin.read(), _renderPlot(job))
+            fin.close()
+
+        # nothing is rendered again
+        del fakeroot.savedImages[:]
+        self.assertEqual(self.writeReport(ranking), 0)
+        self.assertEqual(fakeroot.savedImages, [])
+        self.assertEqual(self.getPlots(), plots)
+
+        # only plots of changed variables are rendered
+        ranking = self.makeRanking(6)
+        ranking.varDescriptions[0] = "renamed"
+
+        self.assertEqual(self.writeReport(ranking), 2)
+        self.assertEqual(len(set(self.getPlots()) - set(plots)), 2)
+
+    def testPages(self):
+        def getPages():
+            return sorted(name for name in os.listdir(self.outputDir) if name.endswith(".html"))
+
+        self.writeReport(self.makeRanking(5))
+        self.assertEqual(getPages(), [ "index.html", "page0001.html", "page0002.html", "page0003.html" ])
+
+        # the images of each page
+        fin = open(os.path.join(self.outputDir, "page0003.html"))
+        page = fin.read()
+        fin.close()
+
+        self.assertEqual(page.count('<img src="plots/'), 1)
+        self.assertTrue('<a href="page0002.html">previous page</a>' in page)
+
+        # pages left over from the previous report are removed
+        self.writeReport(self.makeRanking(3))
+        self.assertEqual(getPages(), [ "index.html", "page0001.html", "page0002.html" ])
+
+        fin = open(os.path.join(self.outputDir, "index.html"))
+        index = fin.read()
+        fin.close()
+
+        self.assertTrue('<a href="page0002.html#3">' in index)
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
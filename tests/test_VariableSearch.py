@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math, unittest
+
+import numpy
+
+from .common import fakeroot, makeColumns, makeVarBuilder
+from kinvarbuilder import TreeProcessor, VariableSearch
+from kinvarbuilder.VariableSearch import sampleEntryBlocks, findCandidates
+
+#----------------------------------------------------------------------
+
+class SamplingTest(unittest.TestCase):
+
+    def testSampleEntryBlocks(self):
+        mask = sampleEntryBlocks(1050, 0.3, 100, seed = 3)
+
+        self.assertEqual(len(mask), 1050)
+
+        # whole blocks
+        blocks = mask[:1000].reshape(10, 100)
+        self.assertTrue((blocks.all(axis = 1) == blocks.any(axis = 1)).all())
+
+        # one block in each of the ranges of blocks [0,3), [3,7) and [7,11)
+        selectedBlocks = numpy.nonzero(mask[::100])[0]
+        self.assertEqual(list(numpy.searchsorted([ 3, 7, 11 ], selectedBlocks, side = 'right')), [ 0, 1, 2 ])
+
+        self.assertTrue(numpy.array_equal(mask, sampleEntryBlocks(1050, 0.3, 100, seed = 3)))
+
+        # at least one block, at most all events
+        self.assertEqual(sampleEntryBlocks(1050, 0.001, 100).sum(), 100)
+        self.assertTrue(sampleEntryBlocks(1050, 2., 100).all())
+
+    def testFindCandidates(self):
+        bounds = [ (0.5, 0.7), (0.1, 0.2), (0.3, 0.55), (0.0, 0.35) ]
+
+        self.assertEqual(findCandidates(bounds, 1), [ 0, 2 ])
+        self.assertEqual(findCandidates(bounds, 2), [ 0, 2, 3 ])
+        self.assertEqual(findCandidates(bounds, 4), [ 0, 1, 2, 3 ])
+
+#----------------------------------------------------------------------
+
+class VariableSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        columnsSig = makeColumns(4000, seed = 1)
+        columnsSig['l1pt'] = columnsSig['l1pt'] * 2
+        columnsSig['l2eta'] = columnsSig['l2eta'] * 0.5
+
+        self.treeSig = fakeroot.makeTree('t', columnsSig)
+        self.treeBkg = fakeroot.makeTree('t', makeColumns(4000, seed = 2))
+
+        self.varBuilder = makeVarBuilder(withMet = False)
+
+        treeProcessor = TreeProcessor(self.varBuilder, readBatchSize = 200, batchMode = True)
+        treeProcessor.addSpectatorVariable('weight')
+
+        self.search = VariableSearch(treeProcessor, self.treeSig, self.treeBkg, weightColumn = 'weight')
+
+        self.fullRanking = self.search.calcRanking(range(len(self.varBuilder.outputScalars)))
+
+    def getBest(self, ranking, topN):
+        return [ ranking.columns[index] for index in ranking.getRankedIndices()[:topN] ]
+
+    def testQuickRank(self):
+        ranking = self.search.quickRank(3, sampleFraction = 0.25)
+
+        self.assertEqual(self.getBest(ranking, 3), self.getBest(self.fullRanking, 3))
+
+        # the variables calculated on all events have their original names and values
+        self.assertEqual(ranking.columns, [ self.varBuilder.outputVarnames[index] for index in self.search.candidates ])
+        self.assertTrue(len(self.search.candidates) < len(self.varBuilder.outputScalars))
+
+        for index, column in enumerate(ranking.columns):
+            self.assertAlmostEqual(ranking.metricValues[index]['ks'],
+                                   self.fullRanking.metricValues[self.fullRanking.columns.index(column)]['ks'])
+
+    def testSuccessiveHalving(self):
+        numVariables = len(self.varBuilder.outputScalars)
+
+        ranking = self.search.successiveHalving(topN = 2)
+
+        self.assertEqual(self.getBest(ranking, 1), self.getBest(self.fullRanking, 1))
+
+        # 20 blocks: the first sample has at least one block,
+        # the sample doubles in each stage
+        fractions = [ fraction for fraction, candidates, stageRanking in self.search.stages ]
+        self.assertEqual(fractions, [ 1 / 16., 1 / 8., 1 / 4., 1 / 2., 1. ])
+
+        # and about topN variables remain for the last stage
+        numCandidates = [ len(candidates) for fraction, candidates, stageRanking in self.search.stages ]
+        self.assertEqual(numCandidates[0], numVariables)
+        self.assertTrue(numCandidates[-1] <= 4)
+
+        # with a given fraction of events
+        self.search.successiveHalving(topN = 2, initialFraction = 0.001)
+        self.assertEqual(self.search.stages[0][0], 1 / 20.)
+        self.assertTrue(len(self.search.stages[-1][1]) <= 4)
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json, os, subprocess, sys, unittest
+
+import numpy
+
+from .common import makeColumns, makeTree, makeVarBuilder, assertArraysEqual
+from kinvarbuilder import VarBuilder, TreeProcessor, functions
+from kinvarbuilder.kinvarbuilder import Node
+
+#----------------------------------------------------------------------
+
+def runPython(code):
+    # @return the output of the given code run by a new python
+    # interpreter (i.e. without the fake ROOT module and
+    # without modules imported by other tests)
+    process = subprocess.Popen([ sys.executable, '-c', code ],
+                               cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    output, errors = process.communicate()
+
+    if process.returncode != 0:
+        raise AssertionError("python failed:\n" + errors)
+
+    return output
+
+# prints the imported modules of interest
+_printModules = """
+print sorted(name for name in sys.modules if sys.modules[name] != None and
+             (name == 'ROOT' or name.startswith('kinvarbuilder.functions.')))
+"""
+
+#----------------------------------------------------------------------
+
+class LazyImportTest(unittest.TestCase):
+
+    def testPackageImport(self):
+        # neither ROOT nor the function modules are imported
+        output = runPython("import sys, kinvarbuilder" + _printModules)
+
+        self.assertEqual(output.strip(), "[]")
+
+    def testFunctionAccess(self):
+        output = runPython("""
+import sys
+from kinvarbuilder import functions
+
+Mass = functions.Mass
+print functions.getFunctionName(Mass), functions.getFunction('Mass') is Mass, Mass.__name__
+""" + _printModules)
+
+        self.assertEqual(output.splitlines(), [ "Mass True Mass", "['kinvarbuilder.functions.Mass']" ])
+
+    def testGraphSpec(self):
+        # only the functions used are imported when building
+        # variables and describing them
+        output = runPython("""
+import sys
+from kinvarbuilder import VarBuilder, FourVector, functions
+
+varBuilder = VarBuilder([ FourVector('l1pt', 'l1eta', 'l1phi'), FourVector('l2pt', 'l2eta', 'l2phi') ], False,
+                        listOfFunctions = [ functions.Mass, functions.SumPt ])
+varBuilder.makeDerived()
+
+spec = varBuilder.getGraphSpec()
+print spec['functions'], len(VarBuilder.fromGraphSpec(spec).outputScalars)
+""" + _printModules)
+
+        self.assertEqual(output.splitlines(), [ "['Mass', 'SumPt'] 2",
+                                                "['kinvarbuilder.functions.Mass', 'kinvarbuilder.functions.SumPt']" ])
+
+#----------------------------------------------------------------------
+
+class PtAsymmetry(Node):
+    # a function as provided by another package: the pt
+    # asymmetry of two vectors (without batch code)
+
+    needFourVectors = False
+    symmetry = 'antisymmetric'
+
+    __slots__ = ('vectors',)
+
+    def __init__(self, vector1, vector2):
+        Node.__init__(self)
+        self.vectors = [ vector1, vector2 ]
+
+    def getParents(self):
+        return self.vectors
+
+    def calcValue(self):
+        vecValues = [ vec.getValue() for vec in self.vectors ]
+
+        if None in vecValues:
+            return None
+
+        pt1, pt2 = [ vecVal.Pt() for vecVal in vecValues ]
+        return (pt1 - pt2) / (pt1 + pt2)
+
+    @staticmethod
+    def getNumArguments(maxNumArguments):
+        return [ 2 ]
+
+    def __str__(self):
+        return "PtAsymmetry(%s,%s)" % tuple(self.vectors)
+
+#----------------------------------------------------------------------
+
+class _EntryPoint:
+    # an entry point as returned by pkg_resources.iter_entry_points(..)
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+    def load(self):
+        return self.func
+
+#----------------------------------------------------------------------
+
+class PluginTest(unittest.TestCase):
+
+    def tearDown(self):
+        # remove the registered functions again
+        for func, name in functions._pluginFunctionNames.items():
+            delattr(functions, name)
+
+        del functions._pluginFunctions[:]
+        functions._pluginFunctionNames.clear()
+
+    def testRegister(self):
+        functions.registerFunction(PtAsymmetry, 'PtAsym')
+
+        self.assertTrue(functions.PtAsym is PtAsymmetry)
+        self.assertTrue(functions.getFunction('PtAsym') is PtAsymmetry)
+        self.assertEqual(functions.getFunctionName(PtAsymmetry), 'PtAsym')
+        self.assertEqual(functions.getPluginFunctions(), [ PtAsymmetry ])
+
+        # registering again does not add it twice
+        functions.registerFunction(PtAsymmetry, 'PtAsym')
+        self.assertEqual(functions.getPluginFunctions(), [ PtAsymmetry ])
+
+        # built-in names can not be reused
+        self.assertRaises(ValueError, functions.registerFunction, PtAsymmetry, 'Mass')
+
+    def testUnregistered(self):
+        # referred to by module and attribute name
+        name = functions.getFunctionName(PtAsymmetry)
+
+        self.assertEqual(name, __name__ + ':PtAsymmetry')
+        self.assertTrue(functions.getFunction(name) is PtAsymmetry)
+
+        self.assertRaises(ValueError, functions.getFunction, 'PtAsymmetry')
+
+    def testLoadPlugins(self):
+        import pkg_resources
+
+        def iterEntryPoints(group):
+            self.assertEqual(group, functions.pluginEntryPointGroup)
+            return [ _EntryPoint('PtAsym', PtAsymmetry) ]
+
+        original = pkg_resources.iter_entry_points
+        pkg_resources.iter_entry_points = iterEntryPoints
+        try:
+            varBuilder = makeVarBuilder()
+            self.assertFalse(PtAsymmetry in varBuilder.listOfFunctions)
+
+            varBuilder = VarBuilder(varBuilder.inputVectors, False, loadPlugins = True)
+        finally:
+            pkg_resources.iter_entry_points = original
+
+        self.assertTrue(functions.PtAsym is PtAsymmetry)
+        self.assertEqual(varBuilder.listOfFunctions[-1], PtAsymmetry)
+
+    def testVarBuilder(self):
+        functions.registerFunction(PtAsymmetry, 'PtAsym')
+
+        # added to the default list of functions
+        varBuilder = makeVarBuilder()
+        self.assertEqual(varBuilder.listOfFunctions[-1], PtAsymmetry)
+
+        indices = [ index for index, func in enumerate(varBuilder.outputFunctions) if func is PtAsymmetry ]
+
+        # one canonical order of the arguments
+        self.assertTrue(len(indices) > 0)
+        self.assertEqual(len(set(frozenset(varBuilder.outputArguments[index]) for index in indices)), len(indices))
+
+        tree = makeTree(500)
+        outputs = [ TreeProcessor(varBuilder, readBatchSize = 200, batchMode = batchMode).makeArray(tree)
+                    for batchMode in (False, True) ]
+
+        assertArraysEqual(self, outputs[0], outputs[1])
+
+        # the value of the asymmetry of the two leptons
+        columns = makeColumns(500)
+        name = varBuilder.outputVarnames[varBuilder.outputVarDescriptions.index('PtAsymmetry(l1,l2)')]
+
+        self.assertTrue(numpy.allclose(outputs[1][name],
+                                       (columns['l1pt'] - columns['l2pt']) / (columns['l1pt'] + columns['l2pt'])))
+
+        # the function is found again by its registered name
+        spec = json.loads(json.dumps(varBuilder.getGraphSpec()))
+        self.assertEqual(spec['functions'][-1], 'PtAsym')
+
+        assertArraysEqual(self, outputs[1], TreeProcessor(VarBuilder.fromGraphSpec(spec), readBatchSize = 200).makeArray(tree))
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+# kinvarbuilder - A library for searching kinematic variables in a systematic way
+#
+# Copyright 2014 University of California, San Diego
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unittest
+
+from .common import makeVarBuilder
+from kinvarbuilder import VarBuilder, functions
+from kinvarbuilder.kinvarbuilder import Node, CachingFunction, acceptsArguments, getSymmetry
+
+#----------------------------------------------------------------------
+
+class CountingNode(Node):
+    # counts the calculations of its value
+
+    __slots__ = ('value', 'parents', 'numCalls')
+
+    def __init__(self, value, parents = ()):
+        Node.__init__(self)
+        self.value = value
+        self.parents = parents
+        self.numCalls = 0
+
+    def getParents(self):
+        return self.parents
+
+    def calcValue(self):
+        self.numCalls += 1
+
+        for parent in self.parents:
+            parent.getValue()
+
+        return self.value
+
+#----------------------------------------------------------------------
+
+class TestVector(object):
+    # a vector value with only a transverse momentum
+
+    def __init__(self, pt):
+        self.pt = pt
+
+    def Pt(self):
+        return self.pt
+
+#----------------------------------------------------------------------
+
+class NodeTest(unittest.TestCase):
+
+    def testAbstract(self):
+        self.assertRaises(TypeError, Node)
+
+        # calcValue() must be overridden
+        class NoCalcValue(Node):
+            __slots__ = ()
+
+        self.assertRaises(TypeError, NoCalcValue)
+
+        vectors = makeVarBuilder().inputVectors
+        self.assertRaises(TypeError, functions.VectorDifferenceQuantity, vectors[0], vectors[1], True)
+
+    def testCaching(self):
+        parent = CountingNode(3.)
+        node = CountingNode(None, (parent,))
+
+        # undefined values are cached, too
+        for event in range(3):
+            self.assertEqual(node.getValue(), None)
+            self.assertEqual(node.getValue(), None)
+
+            self.assertEqual((node.numCalls, parent.numCalls), (event + 1, event + 1))
+
+            node.newEvent()
+
+        # not evaluated nodes do not propagate to their parents
+        parent.getValue()
+        node.newEvent()
+        self.assertEqual(parent.getValue(), 3.)
+        self.assertEqual(parent.numCalls, 4)
+
+    def testSlots(self):
+        # no instance dicts for the nodes of the graph
+        varBuilder = makeVarBuilder()
+
+        for node in varBuilder.inputVectors + varBuilder.vectorSums.values() + varBuilder.outputScalars:
+            self.assertFalse(hasattr(node, '__dict__'), "%s has a __dict__" % type(node).__name__)
+
+    def testCachingFunction(self):
+        # classes decorated with the older CachingFunction still work
+        class Wrapped(object):
+            needFourVectors = False
+            symmetry = 'symmetric'
+
+            def __init__(self, vector1, vector2):
+                self.vectors = [ vector1, vector2 ]
+
+            def getParents(self):
+                return self.vectors
+
+            def getValue(self):
+                return self.vectors[0].getValue().Pt() + self.vectors[1].getValue().Pt()
+
+            @staticmethod
+            def getNumArguments(maxNumArguments):
+                return [ 2 ]
+
+            def __str__(self):
+                return "PtPair(%s,%s)" % tuple(self.vectors)
+
+        decorated = CachingFunction(Wrapped)
+        self.assertEqual((decorated.needFourVectors, decorated.symmetry), (False, 'symmetric'))
+
+        parents = (CountingNode(TestVector(1.)), CountingNode(TestVector(2.)))
+
+        node = decorated(*parents)
+        self.assertEqual(node.getValue(), 3.)
+        self.assertEqual(node.getValue(), 3.)
+        self.assertEqual([ parent.numCalls for parent in parents ], [ 1, 1 ])
+
+        node.newEvent()
+        self.assertEqual(node.getValue(), 3.)
+        self.assertEqual([ parent.numCalls for parent in parents ], [ 2, 2 ])
+
+#----------------------------------------------------------------------
+
+class AcceptsArgumentsTest(unittest.TestCase):
+
+    def testMass(self):
+        # masses of sums of at least two fourvectors
+        self.assertTrue(acceptsArguments(functions.Mass, [ (True, 2) ]))
+        self.assertTrue(acceptsArguments(functions.Mass, [ (True, 3) ]))
+
+        self.assertFalse(acceptsArguments(functions.Mass, [ (True, 1) ]))
+        self.assertFalse(acceptsArguments(functions.Mass, [ (False, 2) ]))
+
+    def testFourVectors(self):
+        self.assertTrue(acceptsArguments(functions.MeanEta, [ (True, 1), (True, 2) ]))
+        self.assertFalse(acceptsArguments(functions.MeanEta, [ (True, 1), (False, 1) ]))
+
+        # transverse vectors are accepted
+        self.assertTrue(acceptsArguments(functions.SumPt, [ (True, 1), (False, 1) ]))
+        self.assertTrue(acceptsArguments(functions.TransverseMass, [ (False, 2) ]))
+
+    def testUndeclared(self):
+        # functions not declaring constraints accept any arguments
+        class Undeclared(object):
+            pass
+
+        self.assertTrue(acceptsArguments(Undeclared, [ (False, 1), (True, 3) ]))
+
+#----------------------------------------------------------------------
+
+class DeclaredConstraintsTest(unittest.TestCase):
+
+    def checkSameOutputs(self, withMet, hadronCollider):
+        # the declared constraints only skip arguments which
+        # the constructors of the functions reject anyway
+        varBuilder = makeVarBuilder(withMet, hadronCollider)
+
+        # the same functions without declared constraints
+        # (keeping the name for the 'functionOf' declarations)
+        undeclared = [ type(func.__name__, (func,), dict(needFourVectors = False, minComponents = 1))
+                       for func in varBuilder.listOfFunctions ]
+
+        other = VarBuilder(varBuilder.inputVectors, not hadronCollider, listOfFunctions = undeclared)
+        other.makeDerived()
+
+        self.assertEqual([ (func.__name__, arguments) for func, arguments in zip(other.outputFunctions, other.outputArguments) ],
+                         [ (func.__name__, arguments) for func, arguments in zip(varBuilder.outputFunctions, varBuilder.outputArguments) ])
+
+    def testHadronCollider(self):
+        self.checkSameOutputs(withMet = True, hadronCollider = True)
+
+    def testLeptonCollider(self):
+        self.checkSameOutputs(withMet = False, hadronCollider = False)
+
+    def testSharedVectorSums(self):
+        # one VectorSum per group of input vectors
+        varBuilder = makeVarBuilder()
+
+        sums = {}
+        for scalar, arguments in zip(varBuilder.outputScalars, varBuilder.outputArguments):
+            for parent, group in zip(scalar.getParents(), arguments):
+                self.assertTrue(sums.setdefault(group, parent) is parent)
+
+        self.assertEqual(set(sums.keys()), set(varBuilder.vectorSums.keys()))
+
+#----------------------------------------------------------------------
+
+class PtDifference(Node):
+    # a function not declaring its symmetry
+
+    __slots__ = ('vectors',)
+
+    def __init__(self, vector1, vector2):
+        Node.__init__(self)
+        self.vectors = [ vector1, vector2 ]
+
+    def getParents(self):
+        return self.vectors
+
+    def calcValue(self):
+        return self.vectors[0].getValue().Pt() - self.vectors[1].getValue().Pt()
+
+    @staticmethod
+    def getNumArguments(maxNumArguments):
+        return [ 2 ]
+
+    def __str__(self):
+        return "PtDifference(%s,%s)" % tuple(self.vectors)
+
+#----------------------------------------------------------------------
+
+class SymmetryTest(unittest.TestCase):
+
+    def testDeclared(self):
+        self.assertEqual(getSymmetry(functions.Mass), 'symmetric')
+        self.assertEqual(getSymmetry(functions.DeltaEta), 'antisymmetric')
+        self.assertEqual(getSymmetry(functions.PtOverMass), 'ordered')
+
+        class Unknown(PtDifference):
+            symmetry = 'cyclic'
+
+        self.assertRaises(ValueError, getSymmetry, Unknown)
+
+    def testUndeclared(self):
+        # functions not declaring their symmetry are
+        # applied to all orders of their arguments
+        self.assertEqual(getSymmetry(PtDifference), 'ordered')
+
+        varBuilder = makeVarBuilder(withMet = False)
+        varBuilder = VarBuilder(varBuilder.inputVectors, False, listOfFunctions = [ PtDifference ])
+        varBuilder.makeDerived()
+
+        numVectors = len(varBuilder.inputVectors)
+        self.assertEqual(len(varBuilder.outputArguments), len(set(varBuilder.outputArguments)))
+
+        # all ordered pairs of disjoint groups of vectors
+        self.assertTrue(((0,), (1,)) in varBuilder.outputArguments)
+        self.assertTrue(((1,), (0,)) in varBuilder.outputArguments)
+        self.assertTrue(((0, 2), (1,)) in varBuilder.outputArguments)
+        self.assertTrue(((1,), (0, 2)) in varBuilder.outputArguments)
+
+        self.assertEqual(len(varBuilder.outputArguments), numVectors * (numVectors - 1) * 2)
+
+        # declaring the symmetry keeps only one order
+        class SymmetricPtDifference(PtDifference):
+            symmetry = 'antisymmetric'
+
+        varBuilder = VarBuilder(varBuilder.inputVectors, False, listOfFunctions = [ SymmetricPtDifference ])
+        varBuilder.makeDerived()
+
+        self.assertEqual(len(varBuilder.outputArguments), numVectors * (numVectors - 1))
+
+#----------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()